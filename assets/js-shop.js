@@ -5,11 +5,20 @@ $(document).ready(mainShop);
 function mainShop() {
   setupDebug(); // Special debug element unhiding
   setupToggleMenus(); // Slide sub-menus in and out when clicked
+  setupBagCount(); // Show the number of items in the bag in the header
   setupProductImageSwappingArrows(); // Select product images from arrows
   setupProductImageZoom(); // Full-page zoom main product img when clicked
   setupVariantHandling(); // Special handling for multiple variants
   setupBagUpdate(); // Auto-click the disclaimer when just updating the cart
   setupQtyButtons(); // enable minus/plus buttons for cart quantity field
+  setupAjaxCart(); // Add to and update the cart without reloading the page
+  setupInstafeed(); // Load the Instagram feed once it's nearly in view
+  setupInfiniteScroll(); // Append the next page of a list at the bottom
+  setupPredictiveSearch(); // Show matching products while typing a search
+  // Mark when the page is ready to use, for timing (see tests/throttle.py)
+  if (window.performance && performance.mark) {
+    performance.mark("mainShop");
+  }
 }
 
 // ----------------------------------------------------------------------------
@@ -43,35 +52,126 @@ function setupToggleMenus() {
       $(this).next().slideToggle();
       return(false);
       });
-  // Leave the current sub-menu expanded, if there is one.  This assumes
-  // that the theme has already put the "current" class on the ul
-  // server-side.
-  $("nav ul ul.current").css('display', 'block');
+  // Leave the current collection's sub-menu expanded, if there is one: the
+  // one with a link (its own or one of its items) to the collection we're
+  // in.  This is done here rather than server-side so that the nav is the
+  // same on every page.
+  var current = location.pathname.match(/^\/collections\/[^\/]+/);
+  if (current) {
+    $("nav ul ul").filter(function() {
+      return $(this).prev().add($(this).find("a")).filter(function() {
+        return this.pathname == current[0];
+      }).length > 0;
+    }).css('display', 'block');
+  }
+}
+
+// ----------------------------------------------------------------------------
+// Bag count
+
+// The header is the same for every visitor so pages can be cached, so the
+// count of items in the bag comes from the AJAX cart API instead.  It's kept
+// in sessionStorage (see updateBagCount) so most pages don't need to ask.
+// The cart page always asks, since that's where the plain cart forms and
+// links end up.  Checking out empties the cart without going through this
+// script, so a stored count other than zero isn't trusted coming back from
+// checkout, or when the browser restores a page from its back/forward cache.
+function setupBagCount() {
+  console.log("setupBagCount");
+  var cached = null;
+  try {
+    cached = JSON.parse(sessionStorage.getItem(SHOP_CONFIG.get("bag_count_key")));
+  } catch (e) {
+    // No sessionStorage; just ask every time
+  }
+  var fresh = cached && (Date.now() - cached.time) / 1000 < SHOP_CONFIG.get("bag_count_ttl");
+  var fromCheckout = /\/checkouts?\/|\/orders\/|checkout\.shopify\.com/.test(document.referrer);
+  if (fresh && (cached.count == 0 || !fromCheckout) && location.pathname != "/cart") {
+    updateBagCount(cached.count);
+  } else {
+    _fetchBagCount();
+  }
+  $(window).on("pageshow", function(event) {
+    if (event.originalEvent.persisted) {
+      _fetchBagCount();
+    }
+  });
+}
+
+function _fetchBagCount() {
+  $.getJSON("/cart.js").done(function(cart) { updateBagCount(cart.item_count); });
 }
 
 // ----------------------------------------------------------------------------
 // Product image swapping
 
+// The product gallery: the thumbnail links in order, the index of the one
+// showing as the main image, the main image link, and images preloaded so
+// far by srcset.  It's built once so swapping doesn't search the page each
+// time.
+var productGallery = null;
+
+function _getProductGallery() {
+  if (!productGallery) {
+    var thumbnails = $('[typeof="Product"] figure aside a').toArray();
+    productGallery = {
+      thumbnails: thumbnails,
+      index: Math.max(0, thumbnails.indexOf($(".current_thumbnail")[0])),
+      main: $('[typeof="Product"] figure > a[typeof="ImageObject"]'),
+      preloaded: {}
+    };
+  }
+  return productGallery;
+}
+
 // get the anchor element of either the "left" or "right" thumbnail, wrapping
 // as needed.
 function _getAdjacentThumbnail(arrow_class) {
-  var current_thumbnail = $(".current_thumbnail");
-  // There might not actually be a next or previous element, if
-  // we were already at the edge of the set of images.  In that
-  // case wrap around to the first/last depending on the case.
-  var elem = null;
+  var gallery = _getProductGallery();
+  var count = gallery.thumbnails.length;
+  var step = null;
   if (arrow_class == "left") {
-    elem = $(current_thumbnail).prev();
-    if (elem.length == 0) {
-      elem = $("figure aside a").last();
-    }
+    step = -1;
   } else if (arrow_class == "right") {
-    elem = $(current_thumbnail).next();
-    if (elem.length == 0) {
-      elem = $("figure aside a").first();
-    }
+    step = 1;
+  }
+  if (step === null) {
+    return null;
+  }
+  // There might not actually be a next or previous element, if we were
+  // already at the edge of the set of images.  In that case wrap around to
+  // the first/last depending on the case.
+  return $(gallery.thumbnails[(gallery.index + step + count) % count]);
+}
+
+// Fetch and decode the images either side of the current one while the
+// browser is idle, so swapping to them shows them right away.  A detached
+// img with the main image's sizes and the thumbnail's srcset picks the same
+// candidate the main image will.
+function _preloadAdjacentImages() {
+  var preload = function() {
+    var gallery = _getProductGallery();
+    var sizes = gallery.main.children("img").attr("sizes");
+    ["left", "right"].forEach(function(arrow_class) {
+      var source = _getAdjacentThumbnail(arrow_class).children("img")[0];
+      if (!source || gallery.preloaded[source.srcset]) {
+        return;
+      }
+      var img = new Image();
+      img.sizes = sizes;
+      img.srcset = source.srcset;
+      img.src = source.src;
+      gallery.preloaded[source.srcset] = img;
+      if (img.decode) {
+        img.decode().catch(function() {});
+      }
+    });
+  };
+  if ("requestIdleCallback" in window) {
+    requestIdleCallback(preload);
+  } else {
+    setTimeout(preload, 1);
   }
-  return elem;
 }
 
 // Cycle through product images for arrow_class either "left" or "right"
@@ -156,6 +256,7 @@ function setupProductImageSwappingArrows() {
   // When an arrow is clicked, swap out for the next or previous image
   var arrows = $('[typeof="Product"] figure a.arrow');
   if (arrows.length) {
+    _preloadAdjacentImages();
     setupProductImageSwappingArrowsClicks(arrows);
     setupProductImageSwappingArrowsKeyboard();
     setupProductImageSwappingArrowsSwipe();
@@ -225,11 +326,15 @@ function setupProductImageSwapping() {
 function swapImage(el) {
   // Keep track of the thumbnail matching the current image, for use in
   // the zooming feature below.
-  $(".current_thumbnail").removeClass("current_thumbnail");
+  var gallery = _getProductGallery();
+  $(gallery.thumbnails[gallery.index]).removeClass("current_thumbnail");
   $(el).addClass("current_thumbnail");
-  var img = $(el).children('img');
-  var current_img = $('[typeof="Product"] figure > a[typeof="ImageObject"] img');
-  current_img.replaceWith(img.clone());
+  gallery.index = gallery.thumbnails.indexOf($(el)[0]);
+  // The thumbnails load lazily since they're hidden until zoomed, but the
+  // main image shouldn't wait.
+  var img = $(el).children('img').clone().attr("loading", "eager");
+  gallery.main.children("img").replaceWith(img);
+  _preloadAdjacentImages();
   return false;
 }
 
@@ -268,7 +373,8 @@ function zoomProductImages() {
   // We also need to avoid double-scroolbars from the container.
   // Temporarily clipping will do that.
   $('body').css('overflow', 'hidden');
-  // Scroll to the current image.
+  // Scroll to the current image.  The images here load and decode lazily
+  // (see product.liquid), so only the ones scrolled past get fetched.
   var current = $('[typeof="Product"] a.current_thumbnail');
   var scroll = current.length ? current.offset().top : 0;
   $('.zoomed').scrollTop(scroll);
@@ -349,3 +455,348 @@ function setupQtyButtons() {
     input.val(Number(input.val()) + 1);
   });
 }
+
+// ----------------------------------------------------------------------------
+// AJAX cart
+
+// Adding to the cart, changing quantities, and removing items all work as
+// plain forms and links, each loading a whole new page.  With javascript we
+// use Shopify's AJAX cart API instead and update the bag count in the header
+// and the cart table in place.  (The Update Bag and Checkout buttons still
+// submit the cart form as usual.)
+function setupAjaxCart() {
+  console.log("setupAjaxCart");
+  $('form[action="/cart/add"]').submit(function() {
+    var form = $(this);
+    var button = form.find('button[type="submit"]');
+    button.prop("disabled", true);
+    $.post("/cart/add.js", form.serialize(), null, "json")
+      .then(function() { return $.getJSON("/cart.js"); })
+      .done(function(cart) {
+        updateBagCount(cart.item_count);
+        button.text("Added to bag");
+      })
+      .fail(function() {
+        // Fall back on the regular form (which will show any error)
+        form.off("submit").submit();
+      })
+      .always(function() { button.prop("disabled", false); });
+    return false;
+  });
+  $('form[action="/cart"] a[title="Remove Item"]').click(function() {
+    var input = $(this).closest("tr").find('input[type="number"]');
+    changeCartQuantity(input, 0);
+    return false;
+  });
+  $('form[action="/cart"] .decrement, form[action="/cart"] .increment').click(function() {
+    var input = $("#" + $(this).attr("for"));
+    changeCartQuantity(input, Number(input.val()));
+  });
+  $('form[action="/cart"] input[type="number"]').change(function() {
+    changeCartQuantity($(this), Number($(this).val()));
+  });
+}
+
+// Set the quantity for one cart row's variant and update the page to match.
+function changeCartQuantity(input, quantity) {
+  var variant = input.attr("id").replace("updates_", "");
+  $.post("/cart/change.js", {id: variant, quantity: quantity}, null, "json")
+    .done(updateCart)
+    .fail(function() { location.reload(); });
+}
+
+// Update the cart table and bag count from a cart object from the AJAX API.
+function updateCart(cart) {
+  var items = {};
+  cart.items.forEach(function(item) { items[item.variant_id] = item; });
+  $('form[action="/cart"] tbody tr').each(function() {
+    var input = $(this).find('input[type="number"]');
+    var item = items[input.attr("id").replace("updates_", "")];
+    if (item) {
+      input.val(item.quantity);
+      $(this).find(".line-price").text(formatMoney(item.final_line_price));
+    } else {
+      $(this).remove();
+    }
+  });
+  $("#total-cost").text(formatMoney(cart.total_price));
+  if (cart.item_count === 0) {
+    $('form[action="/cart"]').remove();
+    $(".alert-noitems").prop("hidden", false);
+  }
+  updateBagCount(cart.item_count);
+}
+
+// Show the number of items in the header's cart link, and remember it for
+// other pages.
+function updateBagCount(count) {
+  var text = "My Bag";
+  if (count > 0) {
+    text = count + " " + (count == 1 ? "item" : "items") + " in Bag";
+  }
+  $('header a[href="/cart"]').text(text);
+  try {
+    sessionStorage.setItem(
+      SHOP_CONFIG.get("bag_count_key"),
+      JSON.stringify({time: Date.now(), count: count}));
+  } catch (e) {
+    // No sessionStorage; setupBagCount will just ask every time
+  }
+}
+
+// Format an amount in cents like Liquid's money_with_currency filter.
+function formatMoney(cents) {
+  var group = function(digits, sep) {
+    return digits.replace(/\B(?=(\d{3})+(?!\d))/g, sep);
+  };
+  var parts = (cents / 100).toFixed(2).split(".");
+  var formats = {
+    "amount": group(parts[0], ",") + "." + parts[1],
+    "amount_no_decimals": group(String(Math.round(cents / 100)), ","),
+    "amount_with_comma_separator": group(parts[0], ".") + "," + parts[1]
+  };
+  return SHOP_CONFIG.get("money_format").replace(/{{\s*(\w+)\s*}}/, function(match, name) {
+    return formats[name] === undefined ? match : formats[name];
+  });
+}
+
+// ----------------------------------------------------------------------------
+// Instagram feed
+
+// The feed sits at the bottom of every page, so don't load its scripts or
+// anything from Instagram until the section gets close to the viewport.  The
+// rendered feed is kept in localStorage for instafeed_cache_ttl seconds so
+// repeat page views just show that.  The scripts to load are listed on the
+// section itself since only Liquid knows their asset URLs.
+function setupInstafeed() {
+  console.log("setupInstafeed");
+  var section = document.getElementById("instafeed");
+  if (!section) {
+    return;
+  }
+  if (!("IntersectionObserver" in window)) {
+    showInstafeed(section);
+    return;
+  }
+  var observer = new IntersectionObserver(function(entries) {
+    if (entries.some(function(entry) { return entry.isIntersecting; })) {
+      observer.disconnect();
+      showInstafeed(section);
+    }
+  }, {rootMargin: SHOP_CONFIG.get("instafeed_margin")});
+  observer.observe(section);
+}
+
+function showInstafeed(section) {
+  var container = section.querySelector("#instagramfeed");
+  var cached = getCachedInstafeed();
+  if (cached) {
+    container.innerHTML = cached;
+    return;
+  }
+  // Cache the feed once the plugin has rendered it
+  var cacher = new MutationObserver(function() {
+    if (container.querySelector("img")) {
+      cacher.disconnect();
+      setCachedInstafeed(container.innerHTML);
+    }
+  });
+  cacher.observe(container, {childList: true, subtree: true});
+  // Load the scripts in order, since the setup script uses the plugin.
+  // (cache: true keeps jQuery from adding a cache-busting parameter.)
+  var scripts = $(section).data("scripts").split(" ");
+  var next = function() {
+    if (scripts.length) {
+      $.ajax({url: scripts.shift(), dataType: "script", cache: true}).done(next);
+    }
+  };
+  next();
+}
+
+// Get the cached feed HTML, or null if there isn't any or it's too old.
+function getCachedInstafeed() {
+  try {
+    var cached = JSON.parse(localStorage.getItem(SHOP_CONFIG.get("instafeed_cache_key")));
+    var age = (Date.now() - cached.time) / 1000;
+    return age < SHOP_CONFIG.get("instafeed_cache_ttl") ? cached.html : null;
+  } catch (e) {
+    // No localStorage, or nothing (valid) cached
+    return null;
+  }
+}
+
+function setCachedInstafeed(html) {
+  try {
+    localStorage.setItem(
+      SHOP_CONFIG.get("instafeed_cache_key"),
+      JSON.stringify({time: Date.now(), html: html}));
+  } catch (e) {
+    // Storage full or disabled; we'll just fetch it again next time.
+  }
+}
+
+// ----------------------------------------------------------------------------
+// Infinite scroll
+
+// Paginated lists (collections, the collection list, and search results) end
+// with a nav of page links.  With data-infinite on the nav (from the theme
+// setting) we fetch the next page as the nav nears the viewport, append its
+// items, and swap in its nav, so the links still work from wherever the list
+// got to.  The address follows the page of the items in view, so reloading or
+// sharing it lands there.  A "true" or "false" under pagination_infinite_key
+// in sessionStorage overrides the theme setting for the rest of the visit, so
+// the tests can check both ways (see check_pagination in tests/store_site.py).
+function setupInfiniteScroll() {
+  console.log("setupInfiniteScroll");
+  var nav = document.querySelector("nav.pagination");
+  if (!nav || !("IntersectionObserver" in window)) {
+    return;
+  }
+  var key = SHOP_CONFIG.get("pagination_infinite_key");
+  try {
+    var override = sessionStorage.getItem(key);
+    if (override === "true" || override === "false") {
+      nav.setAttribute("data-infinite", override);
+    }
+  } catch (e) {
+    // No sessionStorage; just go with the setting
+  }
+  var list = nav.parentNode;
+  var pages = [];
+  var addPage = function(url, first) {
+    if (first) {
+      pages.push({url: url, first: first});
+    }
+  };
+  addPage(location.href, list.querySelector(":scope > section"));
+  var loading = false;
+  var observer = new IntersectionObserver(function(entries) {
+    var next = nav.querySelector('a[rel="next"]');
+    if (loading || !next || nav.getAttribute("data-infinite") !== "true" ||
+        !entries.some(function(entry) { return entry.isIntersecting; })) {
+      return;
+    }
+    loading = true;
+    $.get(next.href).done(function(html) {
+      var doc = new DOMParser().parseFromString(html, "text/html");
+      var fetched = doc.querySelector("nav.pagination");
+      var items = fetched ? fetched.parentNode.querySelectorAll(":scope > section") : [];
+      if (!items.length) {
+        return;
+      }
+      addPage(next.href, items[0]);
+      // Each page marks its own first row high priority, but here they're
+      // all further down.
+      $(items).find("img").removeAttr("fetchpriority").attr("loading", "lazy");
+      Array.prototype.forEach.call(items, function(item) {
+        list.insertBefore(document.adoptNode(item), nav);
+      });
+      // Keep prefetching one page ahead
+      var prefetch = doc.querySelector('link[rel="prefetch"]');
+      if (prefetch) {
+        document.head.appendChild(document.adoptNode(prefetch));
+      }
+      fetched.setAttribute("data-infinite", nav.getAttribute("data-infinite"));
+      observer.unobserve(nav);
+      list.replaceChild(document.adoptNode(fetched), nav);
+      nav = fetched;
+      observer.observe(nav);
+    }).always(function() { loading = false; });
+  }, {rootMargin: SHOP_CONFIG.get("pagination_margin")});
+  observer.observe(nav);
+  var ticking = false;
+  $(window).scroll(function() {
+    if (ticking) {
+      return;
+    }
+    ticking = true;
+    requestAnimationFrame(function() {
+      ticking = false;
+      var shown = pages[0];
+      pages.forEach(function(page) {
+        if (page.first.getBoundingClientRect().top < window.innerHeight / 2) {
+          shown = page;
+        }
+      });
+      if (shown && shown.url !== location.href) {
+        history.replaceState(history.state, "", shown.url);
+      }
+    });
+  });
+}
+
+// ----------------------------------------------------------------------------
+// Predictive search
+
+// Show matching products under the header search box while typing, from the
+// compact JSON search view (templates/search.json.liquid) rather than the
+// full search page.  Requests wait for a pause in typing, a newer one cancels
+// any still running, and results are kept per query so going back to an
+// earlier prefix (backspacing, say) doesn't ask again.  Submitting the form
+// still goes to the search page as usual.
+function setupPredictiveSearch() {
+  console.log("setupPredictiveSearch");
+  var form = $('header form[action="/search"]');
+  var input = form.find('input[name="q"]');
+  if (!input.length) {
+    return;
+  }
+  var list = $('<ul class="predictive-search" hidden></ul>').appendTo(form);
+  var cache = {};
+  var timer = null;
+  var request = null;
+  var show = function(query, data) {
+    list.empty().attr("data-query", query);
+    data.results.forEach(function(product) {
+      var link = $("<a>").attr("href", product.url);
+      if (product.image) {
+        link.append($('<img alt="">').attr("src", product.image));
+      }
+      link.append($("<span>").text(product.title));
+      link.append($('<span class="price">').text(product.price));
+      list.append($("<li>").append(link));
+    });
+    if (!data.results.length) {
+      list.append($("<li>").text("No results"));
+    }
+    list.prop("hidden", false);
+  };
+  var search = function() {
+    var query = input.val().trim().toLowerCase();
+    if (request) {
+      request.abort();
+      request = null;
+    }
+    if (query.length < SHOP_CONFIG.get("search_min_chars")) {
+      list.prop("hidden", true);
+      return;
+    }
+    if (cache[query]) {
+      show(query, cache[query]);
+      return;
+    }
+    var current = request = $.getJSON("/search", {view: "json", type: "product", q: query});
+    current.done(function(data) {
+      cache[query] = data;
+      show(query, data);
+    }).always(function() {
+      if (request === current) {
+        request = null;
+      }
+    });
+  };
+  input.attr("autocomplete", "off").on("input", function() {
+    clearTimeout(timer);
+    timer = setTimeout(search, SHOP_CONFIG.get("search_delay"));
+  });
+  input.keydown(function(event) {
+    if (event.key == "Escape") {
+      list.prop("hidden", true);
+    }
+  });
+  $(document).click(function(event) {
+    if (!form.has(event.target).length) {
+      list.prop("hidden", true);
+    }
+  });
+}
@@ -8,10 +8,15 @@ the live theme too, but it's not quite ready yet.  I'd like to let it test the
 alternate testing theme too but I can't see an easy way to do that without
 having the browser authenticate as a site admin.
 
-This package uses Selenium to automate a locally-running web browser (currently
-hardcoded as Chrome).  If the store is password-protected, the environment
+This package uses Selenium to automate a locally-running web browser, made by
+drivers.make_driver from the browser and headless settings (Chrome by default;
+see SHOPIFY_TEST_BROWSER and SHOPIFY_TEST_HEADLESS in util).  If the store is password-protected, the environment
 variable SHOPIFY_STORE_PASSWORD will be used to supply the store password to
 the site.  See the util module for configuration-handling, test_site for the
 actual test case classes, and store_site and store_client for high and low
-level site interfaces without yet defining the tests themselves.
+level site interfaces without yet defining the tests themselves.  The impact
+module maps changed theme files to the tests that exercise them, for running
+just the relevant subset from tools/pre-commit and CI, and the watch module
+uses it to rerun tests with warm browsers as files change (python -m tests
+--watch).
 """
@@ -5,7 +5,8 @@ This just exists so that python -m on the package will run the unittest
 module's command-line interface.  For more info:
 https://docs.python.org/3/library/__main__.html
 util.main uses unittest's test discovery to load the test cases it finds in
-test_site.  See the classes there for the tests.
+test_site.  See the classes there for the tests.  Use --watch to keep running
+and rerun affected tests as theme files change; see the watch module.
 """
 from .util import main
 main()
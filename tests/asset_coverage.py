@@ -0,0 +1,293 @@
+"""
+CSS and JS coverage across the test suite.
+
+With SHOPIFY_TEST_COVERAGE set to a directory, each StoreClient browser
+records which of the theme's style rules and script code the tests actually
+use, and saves that to the directory when its class finishes.  Snapshots are
+taken before every navigation, at each window size a test switches to, and
+at the end of each test, so rules for other viewports and for states a test
+sets up (open menus, zoomed images) count too.  Run the suite once or several
+times, then report on the merged results:
+
+    SHOPIFY_TEST_COVERAGE=coverage python -m tests
+    python -m tests.asset_coverage coverage
+    python -m tests.asset_coverage coverage --prune trimmed
+
+JS coverage comes from the DevTools profiler's precise coverage, so it needs
+Chrome; with Firefox only CSS is recorded.  CSS coverage works like the
+critical module: the stylesheets are cross-origin so they're fetched and
+parsed here, and a rule counts as used if its @media conditions held and one
+of its selectors (minus state pseudo-classes like :hover) matched something
+on the page at some snapshot.
+
+--prune writes trimmed copies of the plain assets (not .liquid ones, and only
+if the store served the same text as the file here) to a separate directory
+for review: stylesheets without the unused rules, one rule per line, and
+scripts without top-level functions that never ran and aren't named anywhere
+else in the theme.
+"""
+
+import os
+import re
+import sys
+import json
+import glob
+import logging
+import argparse
+
+from . import cssrules
+from .util import fetch
+
+LOGGER = logging.getLogger(__name__)
+
+RE_FUNCTION = re.compile(r"^function ([\w$]+)\(.*?^}\n?", re.MULTILINE | re.DOTALL)
+# Ranges of unused JS shorter than this aren't worth listing
+MIN_REPORT_CHARS = 20
+
+
+def asset_name(url, root="."):
+    """Get the theme asset name for a store asset URL, or None."""
+    name = url.split("?")[0].rsplit("/", 1)[-1]
+    path = os.path.join(root, "assets", name)
+    if os.path.exists(path) or os.path.exists(path + ".liquid"):
+        return name
+    return None
+
+
+def intervals(mask, value=0):
+    """List [start, end] intervals where a bytearray mask has value."""
+    found = []
+    start = None
+    for idx, val in enumerate(mask):
+        if val == value and start is None:
+            start = idx
+        elif val != value and start is not None:
+            found.append([start, idx])
+            start = None
+    if start is not None:
+        found.append([start, len(mask)])
+    return found
+
+
+class CoverageRecorder:
+    """Accumulate CSS and JS coverage for one browser session."""
+
+    def __init__(self):
+        self.user_agent = None
+        self.js_enabled = False
+        # URL to {"text": served text, "used": bytearray per character}
+        self.scripts = {}
+        # URL to {"text": served text, "rules": Rules, "used": set of indexes}
+        self.sheets = {}
+
+    def start(self, driver):
+        """Start (or restart, after a navigation) JS coverage if possible."""
+        if not hasattr(driver, "execute_cdp_cmd"):
+            return
+        driver.execute_cdp_cmd("Profiler.enable", {})
+        driver.execute_cdp_cmd(
+            "Profiler.startPreciseCoverage", {"callCount": True, "detailed": True})
+        self.js_enabled = True
+
+    def snapshot(self, driver):
+        """Record what the current page has used so far."""
+        if self.user_agent is None:
+            self.user_agent = driver.execute_script("return navigator.userAgent;")
+        if self.js_enabled:
+            result = driver.execute_cdp_cmd("Profiler.takePreciseCoverage", {})["result"]
+            for script in result:
+                if asset_name(script["url"]):
+                    self._record_script(script)
+        for href in driver.execute_script(cssrules.STYLESHEETS_JS):
+            if asset_name(href):
+                self._record_sheet(driver, href)
+
+    def _record_script(self, script):
+        url = script["url"]
+        if url not in self.scripts:
+            text = fetch(url, self.user_agent)
+            self.scripts[url] = {"text": text, "used": bytearray(len(text))}
+        entry = self.scripts[url]
+        # Ranges nest, with the innermost count applying, so apply the
+        # outermost first.
+        ranges = sorted(
+            (rng for func in script["functions"] for rng in func["ranges"]),
+            key=lambda rng: (rng["startOffset"], -rng["endOffset"]))
+        mask = bytearray(len(entry["text"]))
+        for rng in ranges:
+            start, end = rng["startOffset"], min(rng["endOffset"], len(mask))
+            mask[start:end] = (b"\x01" if rng["count"] else b"\x00") * (end - start)
+        entry["used"] = bytearray(old | new for old, new in zip(entry["used"], mask))
+
+    def _record_sheet(self, driver, href):
+        if href not in self.sheets:
+            text = fetch(href, self.user_agent)
+            rules = cssrules.parse(text)
+            used = {idx for idx, rule in enumerate(rules) if rule.prelude.startswith("@")}
+            self.sheets[href] = {"text": text, "rules": rules, "used": used}
+        entry = self.sheets[href]
+        query = []
+        for idx, rule in enumerate(entry["rules"]):
+            if idx not in entry["used"]:
+                selectors = [cssrules.static_selector(selector)
+                             for selector in cssrules.split_selectors(rule.prelude)]
+                query.append([idx, list(rule.media), selectors])
+        if query:
+            entry["used"].update(driver.execute_script(cssrules.MATCH_RULES_JS, query, False))
+
+    def save(self, path):
+        """Save the recorded coverage as JSON."""
+        LOGGER.info("saving coverage to %s", path)
+        data = {
+            "scripts": {
+                url: {"text": entry["text"], "unused": intervals(entry["used"])}
+                for url, entry in self.scripts.items()},
+            "sheets": {
+                url: {"text": entry["text"], "used": sorted(entry["used"])}
+                for url, entry in self.sheets.items()}}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f_out:
+            json.dump(data, f_out)
+
+
+def load(paths):
+    """Merge saved coverage files.
+
+    Returns dictionaries for scripts and stylesheets keyed on (asset name,
+    served text), so the same file served from different URLs merges but
+    different renderings of a .liquid asset don't.  Scripts map to a
+    bytearray marking characters that ran anywhere, and stylesheets to the
+    set of rule indexes used anywhere.
+    """
+    scripts = {}
+    sheets = {}
+    for path in paths:
+        with open(path) as f_in:
+            data = json.load(f_in)
+        for url, entry in data["scripts"].items():
+            key = (asset_name(url), entry["text"])
+            used = scripts.setdefault(key, bytearray(len(entry["text"])))
+            ran = bytearray(b"\x01" * len(entry["text"]))
+            for start, end in entry["unused"]:
+                ran[start:end] = b"\x00" * (end - start)
+            scripts[key] = bytearray(old | new for old, new in zip(used, ran))
+        for url, entry in data["sheets"].items():
+            key = (asset_name(url), entry["text"])
+            sheets.setdefault(key, set()).update(entry["used"])
+    return scripts, sheets
+
+
+def line_of(text, offset):
+    """Get the 1-based line number of an offset in text."""
+    return text.count("\n", 0, offset) + 1
+
+
+def report(scripts, sheets, root=".", stream=sys.stdout):
+    """Print unused rules and code per asset, and assets never loaded."""
+    seen = set()
+    for (name, text), used in sorted(sheets.items()):
+        seen.add(name)
+        rules = cssrules.parse(text)
+        unused = [rule for idx, rule in enumerate(rules) if idx not in used]
+        unused_bytes = len(cssrules.serialize(unused).encode())
+        stream.write("%s: %d of %d rules unused (about %d of %d bytes)\n" % (
+            name, len(unused), len(rules), unused_bytes, len(text.encode())))
+        for rule in unused:
+            media = "".join(condition + " " for condition in rule.media)
+            stream.write("    %s%s\n" % (media, rule.prelude))
+    for (name, text), used in sorted(scripts.items()):
+        seen.add(name)
+        unused = intervals(used)
+        stream.write("%s: %d of %d characters never ran\n" % (
+            name, sum(end - start for start, end in unused), len(text)))
+        for start, end in unused:
+            if end - start >= MIN_REPORT_CHARS:
+                snippet = text[start:end].strip().splitlines()[0][:60]
+                stream.write("    line %d: %s\n" % (line_of(text, start), snippet))
+    for path in sorted(glob.glob(os.path.join(root, "assets", "*"))):
+        name = os.path.basename(path)
+        if name.endswith(".liquid"):
+            name = name[:-len(".liquid")]
+        kind = name.rsplit(".", 1)[-1]
+        if kind in ("css", "js") and name not in seen and not name.startswith("bundle-"):
+            stream.write("%s: never loaded\n" % name)
+
+
+def theme_text(root="."):
+    """Get all the theme's Liquid and asset text together, for name lookups."""
+    texts = []
+    for pattern in ("layout/*", "templates/*", "snippets/*", "sections/*", "assets/*.js*"):
+        for path in glob.glob(os.path.join(root, pattern)):
+            with open(path) as f_in:
+                texts.append(f_in.read())
+    return "\n".join(texts)
+
+
+def prune_js(text, used, everything):
+    """Remove dead top-level functions from script text.
+
+    A function goes if none of its body ran and its name appears nowhere
+    else in the theme (everything), so nothing could call it.
+    """
+    out = []
+    last = 0
+    for match in RE_FUNCTION.finditer(text):
+        body = used[text.index("{", match.start()) + 1:text.rindex("}", 0, match.end())]
+        name = match.group(1)
+        if not any(body) and len(re.findall(r"\b%s\b" % re.escape(name), everything)) == 1:
+            out.append(text[last:match.start()])
+            last = match.end()
+    out.append(text[last:])
+    return "".join(out)
+
+
+def prune(scripts, sheets, outdir, root=".", stream=sys.stdout):
+    """Write trimmed copies of the plain assets to outdir."""
+    os.makedirs(outdir, exist_ok=True)
+    everything = theme_text(root)
+    total = [0, 0]
+    outputs = []
+    for (name, text), used in sorted(sheets.items()):
+        rules = cssrules.parse(text)
+        outputs.append((name, text, cssrules.serialize(
+            [rule for idx, rule in enumerate(rules) if idx in used], "\n") + "\n"))
+    for (name, text), used in sorted(scripts.items()):
+        if not name.endswith(".min.js"):
+            outputs.append((name, text, prune_js(text, used, everything)))
+    for name, text, trimmed in outputs:
+        path = os.path.join(root, "assets", name)
+        if not os.path.exists(path):
+            continue
+        with open(path) as f_in:
+            if f_in.read() != text:
+                LOGGER.warning("%s: served text differs from %s; skipping", name, path)
+                continue
+        with open(os.path.join(outdir, name), "w") as f_out:
+            f_out.write(trimmed)
+        before, after = len(text.encode()), len(trimmed.encode())
+        total[0] += before
+        total[1] += after
+        stream.write("%-30s %8d -> %8d bytes\n" % (name, before, after))
+    stream.write("%-30s %8d -> %8d bytes\n" % ("total", total[0], total[1]))
+
+
+def main(argv=None):
+    """Report on (and optionally prune by) saved coverage."""
+    parser = argparse.ArgumentParser(
+        prog="python -m tests.asset_coverage",
+        description="Report CSS and JS the test suite never used.")
+    parser.add_argument("coverage_dir", help="directory given as SHOPIFY_TEST_COVERAGE")
+    parser.add_argument("--prune", metavar="DIR", help="write trimmed assets to DIR")
+    args = parser.parse_args(argv)
+    paths = glob.glob(os.path.join(args.coverage_dir, "*.json"))
+    if not paths:
+        parser.error("no coverage files in %s" % args.coverage_dir)
+    scripts, sheets = load(paths)
+    if args.prune:
+        prune(scripts, sheets, args.prune)
+    else:
+        report(scripts, sheets)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
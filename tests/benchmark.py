@@ -0,0 +1,228 @@
+"""
+Small benchmarks for the test harness itself.
+
+    python -m tests.benchmark startup
+    python -m tests.benchmark drivers
+    python -m tests.benchmark gallery
+
+The startup benchmark times importing the lightweight parts of this package
+in fresh interpreters, from a directory with no config.yml and with the
+SHOPIFY_* configuration variables cleared, so any configuration loaded at
+import time fails loudly rather than just slowing things down.  It also
+reports which of the heavy dependencies got imported along the way, and
+flags modules over STARTUP_BUDGET.  test_startup checks just the imports, as
+timings from a unit test would depend on how busy the machine is.
+
+The drivers benchmark launches a browser for each of DRIVER_CONFIGS (on top
+of the usual TESTING_CONFIG driver settings) and times the launch and the
+first page load from the store, so a StoreClient class can pick the fastest
+configuration that still works for it via driver_options.  Configurations
+whose browser isn't available are reported as such.
+
+The gallery benchmark loads the lots-of-photos product at each of the
+WINDOWSIZES and steps through its images with the right arrow, timing each
+swap from the call to the new main image being decoded and painted (two
+animation frames after img.decode() resolves).  GALLERY_DWELL seconds pass
+between swaps, like someone looking at each photo, which is when js-shop.js
+preloads the neighbouring images.
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import tempfile
+import subprocess
+
+# Modules that tools needing just the settings or the theme graph import.
+STARTUP_MODULES = ("tests.util", "tests.impact")
+# Dependencies that should only load once a browser is actually needed.
+HEAVY_MODULES = ("selenium", "yaml", "xvfbwrapper")
+# Seconds allowed for importing each of STARTUP_MODULES (not counting
+# interpreter startup)
+STARTUP_BUDGET = 0.1
+
+# Driver configurations to compare, as overrides for drivers.driver_config
+DRIVER_CONFIGS = {
+    "chrome-plain": {"browser": "chrome", "tuned": False, "cache_dir": None},
+    "chrome-tuned": {"browser": "chrome"},
+    "chrome-noimages": {"browser": "chrome", "load_images": False},
+    "firefox-plain": {"browser": "firefox", "tuned": False, "cache_dir": None},
+    "firefox-tuned": {"browser": "firefox"},
+    "firefox-noimages": {"browser": "firefox", "load_images": False},
+    }
+
+# Seconds to wait on each image before swapping to the next
+GALLERY_DWELL = 1.0
+
+# For execute_async_script: swap to the next product image and give the ms
+# until it's painted.
+GALLERY_SWAP_JS = """
+var done = arguments[arguments.length - 1];
+var start = performance.now();
+_swapProductImage("right");
+var img = document.querySelector('[typeof="Product"] figure > a[typeof="ImageObject"] img');
+var painted = function() {
+    requestAnimationFrame(function() {
+        requestAnimationFrame(function() { done(performance.now() - start); });
+    });
+};
+img.decode().then(painted, painted);
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(" ".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+
+def time_import(module, repeat=5):
+    """Time importing a module in fresh interpreters.
+
+    Returns the best time in seconds over repeat tries along with the list of
+    HEAVY_MODULES that the import pulled in.
+    """
+    env = {key: val for key, val in os.environ.items() if not key.startswith("SHOPIFY_")}
+    env["PYTHONPATH"] = ROOT
+    code = IMPORT_SNIPPET.format(module=module, heavy=HEAVY_MODULES)
+    best = None
+    heavy = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for _ in range(repeat):
+            out = subprocess.run(
+                [sys.executable, "-c", code], cwd=tmpdir, env=env, check=True,
+                stdout=subprocess.PIPE, universal_newlines=True).stdout.splitlines()
+            seconds = float(out[0])
+            best = seconds if best is None else min(best, seconds)
+            heavy = out[1].split() if len(out) > 1 else []
+    return best, heavy
+
+
+def bench_startup(repeat=5):
+    """Print import times for STARTUP_MODULES."""
+    print("%-20s %10s  %s" % ("module", "best (ms)", "heavy imports"))
+    for module in STARTUP_MODULES:
+        seconds, heavy = time_import(module, repeat)
+        print("%-20s %10.1f  %s%s" % (
+            module, seconds*1000, " ".join(heavy) or "-",
+            "  OVER BUDGET" if seconds > STARTUP_BUDGET else ""))
+
+
+def time_driver(overrides, url, repeat=3):
+    """Time launching a browser and loading its first page.
+
+    Returns lists of launch and first-page times in seconds, one per try.
+    """
+    # pylint: disable=import-outside-toplevel
+    from .drivers import (driver_config, make_driver)
+    config = driver_config(overrides, "benchmark")
+    launches = []
+    pages = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        driver = make_driver(config)
+        try:
+            launched = time.perf_counter()
+            driver.get(url)
+            loaded = time.perf_counter()
+        finally:
+            driver.quit()
+        launches.append(launched - start)
+        pages.append(loaded - launched)
+    return launches, pages
+
+
+def bench_drivers(repeat=3, names=None):
+    """Print launch and first-page times for DRIVER_CONFIGS."""
+    # pylint: disable=import-outside-toplevel
+    from selenium.common.exceptions import WebDriverException
+    from .util import TESTING_CONFIG
+    url = "https://" + TESTING_CONFIG["store_site"] + "/"
+    print("%-18s %12s %12s %12s" % ("config", "launch (s)", "page (s)", "total (s)"))
+    for name in names or DRIVER_CONFIGS:
+        try:
+            launches, pages = time_driver(DRIVER_CONFIGS[name], url, repeat)
+        except WebDriverException as exc:
+            print("%-18s unavailable: %s" % (name, str(exc).strip().splitlines()[0]))
+            continue
+        totals = [launch + page for launch, page in zip(launches, pages)]
+        print("%-18s %12.2f %12.2f %12.2f" % (
+            name,
+            statistics.median(launches),
+            statistics.median(pages),
+            statistics.median(totals)))
+
+
+def time_gallery(driver, url, size, dwell=GALLERY_DWELL):
+    """Time swapping through every image of a product once at one window size.
+
+    Returns a list of ms per swap.
+    """
+    driver.set_window_size(size["width"], size["height"])
+    driver.get(url)
+    count = driver.execute_script("return _getProductGallery().thumbnails.length;")
+    times = []
+    for _ in range(count):
+        time.sleep(dwell)
+        times.append(driver.execute_async_script(GALLERY_SWAP_JS))
+    return times
+
+
+def bench_gallery(repeat=3, dwell=GALLERY_DWELL):
+    """Print product image swap-to-paint times per window size."""
+    # pylint: disable=import-outside-toplevel
+    from .store_client import StoreClient
+    from .store_site import WINDOWSIZES
+    from .util import TEST_PRODUCTS
+
+    class GalleryClient(StoreClient):
+        """Browser session for timing the product gallery."""
+
+    # Past the storefront password, if there is one
+    GalleryClient.set_up_site()
+    driver = GalleryClient.get_driver()
+    url = GalleryClient.url + TEST_PRODUCTS["lots-of-photos"]
+    print("%-10s %8s %12s %12s %12s" % ("window", "swaps", "median (ms)", "p90 (ms)", "max (ms)"))
+    try:
+        for name, size in WINDOWSIZES.items():
+            times = []
+            for _ in range(repeat):
+                times.extend(time_gallery(driver, url, size, dwell))
+            times.sort()
+            print("%-10s %8d %12.0f %12.0f %12.0f" % (
+                name, len(times), statistics.median(times),
+                times[int(0.9 * (len(times) - 1))], times[-1]))
+    finally:
+        GalleryClient.tear_down_site()
+
+
+def main(argv=None):
+    """Run the named benchmark."""
+    parser = argparse.ArgumentParser(
+        prog="python -m tests.benchmark",
+        description="Benchmarks for the test harness.")
+    parser.add_argument("benchmark", choices=["startup", "drivers", "gallery"])
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="tries per case")
+    parser.add_argument(
+        "--config", nargs="+", choices=sorted(DRIVER_CONFIGS),
+        help="driver configurations to compare (default all)")
+    parser.add_argument(
+        "--dwell", type=float, default=GALLERY_DWELL,
+        help="seconds on each image before the next swap (gallery)")
+    args = parser.parse_args(argv)
+    if args.benchmark == "startup":
+        bench_startup(args.repeat)
+    elif args.benchmark == "drivers":
+        bench_drivers(args.repeat, args.config)
+    elif args.benchmark == "gallery":
+        bench_gallery(args.repeat, args.dwell)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,551 @@
+"""
+Storefront crawler that checks the schema.org markup and links site-wide.
+
+The Selenium tests check product markup on a few TEST_PRODUCTS only, and a
+browser is a slow way to read static markup anyway.  This starts from the
+home page (whose nav menus come from page_header.liquid) and follows every
+collection, product, and page link, plus pagination, fetching pages
+concurrently over a small pool of keep-alive connections.  On each page it
+reads the RDFa (vocab/typeof/property) structure and checks it:
+ * every Product has a name and at least one offer,
+ * every OfferForPurchase has a decimal price, a three-letter priceCurrency,
+   and a schema.org availability (the product page splits these between the
+   offers span and the priceSpecification div about the same variant URL;
+   they're merged by resource),
+ * every ImageObject has a contentUrl, every PostalAddress a street, city,
+   and postal code,
+ * and each template has the items it should (EXPECTED_TYPES).
+Other links on the same store (the cart, search, policies) are checked with
+HEAD requests but not followed, and any link that doesn't end up at a 2xx
+response is reported as broken, with the pages linking to it.
+
+    python -m tests.crawl [-c CONCURRENCY] [--delay SECONDS] [--json report.json]
+
+The store comes from the testing configuration like the rest of the suite,
+and the store password is used if it's set.  The crawler follows robots.txt,
+including any Crawl-delay or Request-rate, and waits out 429 responses;
+--delay sets a minimum interval between requests on top of that.  Product
+links within a collection are crawled as the plain /products/ URL, since
+Shopify renders the same page for both, which roughly halves a catalog pass.
+
+With aiohttp installed (pip install aiohttp) that handles the connections;
+otherwise a pool of http.client connections is used from threads.  Exits
+nonzero if anything was reported.
+"""
+
+import re
+import sys
+import json
+import asyncio
+import logging
+import argparse
+import collections
+import urllib.parse
+import urllib.robotparser
+from html.parser import HTMLParser
+
+from .impact import template_for_path
+
+LOGGER = logging.getLogger(__name__)
+
+USER_AGENT = "rennes-theme-crawler"
+CONCURRENCY = 8
+MAX_REDIRECTS = 5
+MAX_RETRIES = 3
+# Seconds to wait after a 429 without a Retry-After header
+RETRY_DELAY = 5.0
+
+SCHEMA_VOCABS = ("http://schema.org/", "https://schema.org/")
+# Paths whose links are followed; anything else on the store is only checked
+RE_FOLLOW = re.compile(r"^/(?:$|collections(?:/|$)|products/|pages/)")
+RE_WITHIN = re.compile(r"^/collections/[^/]+(/products/[^/]+)$")
+RE_PRICE = re.compile(r"^\d+(\.\d+)?$")
+RE_CURRENCY = re.compile(r"^[A-Z]{3}$")
+AVAILABILITY = {
+    "InStock", "OutOfStock", "SoldOut", "PreOrder", "PreSale", "BackOrder",
+    "LimitedAvailability", "InStoreOnly", "OnlineOnly", "Discontinued"}
+
+# Properties every item of a type needs
+REQUIRED = {
+    "Product": ["name", "offers"],
+    "OfferForPurchase": ["price", "priceCurrency", "availability"],
+    "ImageObject": ["contentUrl"],
+    "PostalAddress": ["streetAddress", "addressLocality", "postalCode"],
+    "SearchResultsPage": [],
+    }
+# Item types each template's pages should have
+EXPECTED_TYPES = {
+    "templates/index.liquid": ["PostalAddress"],
+    "templates/collection.liquid": ["PostalAddress"],
+    "templates/list-collections.liquid": ["PostalAddress"],
+    "templates/product.liquid": ["Product", "OfferForPurchase", "ImageObject", "PostalAddress"],
+    "templates/page.liquid": ["PostalAddress"],
+    "templates/search.liquid": ["SearchResultsPage"],
+    }
+
+
+class Item:
+    """An RDFa item: its type, resource (if any), and {property: [values]}.
+
+    Values are strings, or Items for nested ones.
+    """
+
+    def __init__(self, typeof, resource=None):
+        self.type = typeof
+        self.resource = resource
+        self.properties = collections.defaultdict(list)
+
+    def __repr__(self):
+        return "Item(%r, %r, %r)" % (self.type, self.resource, dict(self.properties))
+
+
+class PageParser(HTMLParser):
+    """Read the links and RDFa items from a page.
+
+    This covers the subset of RDFa Lite the theme uses: vocab, typeof,
+    property, resource, and about.  An element's property value is its
+    content attribute, else its href or src, else its text; empty values are
+    left out, and property names may have a schema: prefix.  An element
+    with about (and no typeof) makes that resource the subject for what's
+    inside it, so properties from separate parts of the page about the same
+    resource end up on one item.
+    """
+
+    VOID = {"area", "base", "br", "col", "embed", "hr", "img", "input",
+            "link", "meta", "param", "source", "track", "wbr"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+        self.items = []
+        self.outside_vocab = []
+        self._resources = {}
+        # (tag, vocab, subject item, pending text property) per open element
+        self._stack = []
+
+    def item(self, typeof, resource):
+        """Get the item for a resource, or a new one."""
+        if resource and resource in self._resources:
+            item = self._resources[resource]
+            item.type = item.type or typeof
+            return item
+        item = Item(typeof, resource)
+        self.items.append(item)
+        if resource:
+            self._resources[resource] = item
+        return item
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        vocab, subject = (self._stack[-1][1:3] if self._stack else (None, None))
+        vocab = attrs.get("vocab", vocab)
+        if tag in ("a", "link") and attrs.get("href") is not None:
+            if tag == "a" or attrs.get("rel") in ("next", "prev"):
+                self.links.append(attrs["href"])
+        prop = attrs.get("property")
+        prop = prop.split(":", 1)[-1] if prop else None
+        text_prop = None
+        if "typeof" in attrs:
+            if vocab not in SCHEMA_VOCABS:
+                self.outside_vocab.append(attrs["typeof"])
+            item = self.item(attrs["typeof"], attrs.get("resource"))
+            if prop and subject:
+                subject.properties[prop].append(item)
+            subject = item
+        elif "about" in attrs:
+            subject = self.item(None, attrs["about"])
+        elif prop and subject:
+            value = attrs.get("content", attrs.get("href", attrs.get("src")))
+            if value is None:
+                text_prop = (prop, [])
+            elif value.strip():
+                subject.properties[prop].append(value.strip())
+        if tag not in self.VOID:
+            self._stack.append((tag, vocab, subject, text_prop))
+
+    def handle_data(self, data):
+        for _, _, _, text_prop in self._stack:
+            if text_prop:
+                text_prop[1].append(data)
+
+    def handle_endtag(self, tag):
+        if tag in self.VOID or tag not in (entry[0] for entry in self._stack):
+            return
+        while self._stack:
+            open_tag, _, subject, text_prop = self._stack.pop()
+            text = " ".join("".join(text_prop[1]).split()) if text_prop else None
+            if text:
+                subject.properties[text_prop[0]].append(text)
+            if open_tag == tag:
+                break
+
+
+def parse(text):
+    """Parse a page's HTML into (links, items, problems)."""
+    parser = PageParser()
+    parser.feed(text)
+    parser.close()
+    problems = ["%s outside the schema.org vocab" % typeof for typeof in parser.outside_vocab]
+    return parser.links, parser.items, problems
+
+
+def check_item(item):
+    """List the problems with an RDFa item."""
+    if not item.type:
+        return ["no typeof for %s" % item.resource]
+    if item.type not in REQUIRED:
+        return ["unexpected type %s" % item.type]
+    name = "%s %s" % (item.type, item.resource or "")
+    problems = ["%s: missing %s" % (name.strip(), prop)
+                for prop in REQUIRED[item.type] if not item.properties.get(prop)]
+    if item.type == "OfferForPurchase":
+        for price in item.properties.get("price", []):
+            if not RE_PRICE.match(price):
+                problems.append("%s: bad price %r" % (name.strip(), price))
+        for currency in item.properties.get("priceCurrency", []):
+            if not RE_CURRENCY.match(currency):
+                problems.append("%s: bad priceCurrency %r" % (name.strip(), currency))
+        for availability in item.properties.get("availability", []):
+            if availability.split("/")[-1] not in AVAILABILITY or \
+                    not availability.startswith(SCHEMA_VOCABS):
+                problems.append("%s: bad availability %r" % (name.strip(), availability))
+    return problems
+
+
+def check_page(path, items):
+    """List the problems with the items on a page at a store path."""
+    problems = []
+    for item in items:
+        problems.extend(check_item(item))
+    types = {item.type for item in items}
+    for typeof in EXPECTED_TYPES.get(template_for_path(path), []):
+        if typeof not in types:
+            problems.append("no %s" % typeof)
+    return problems
+
+
+def normalize(link, page_url, base):
+    """Get the crawl URL for a link on a page, or None if it's off the store.
+
+    Fragments and query parameters other than page are dropped (sort orders
+    and filters show the same products), and product links within a
+    collection become plain product links.
+    """
+    url = urllib.parse.urljoin(page_url, link.strip())
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https") or parts.netloc != urllib.parse.urlsplit(base).netloc:
+        return None
+    path = parts.path or "/"
+    within = RE_WITHIN.match(path)
+    if within:
+        path = within.group(1)
+    page = urllib.parse.parse_qs(parts.query).get("page")
+    query = "page=%s" % page[0] if page and page[0] != "1" else ""
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc, path, query, ""))
+
+
+def interval(robots, delay=0.0):
+    """Get the minimum seconds between requests allowed by robots.txt."""
+    crawl_delay = robots.crawl_delay(USER_AGENT) or 0
+    rate = robots.request_rate(USER_AGENT)
+    rate_delay = rate.seconds / rate.requests if rate and rate.requests else 0
+    return max(float(crawl_delay), rate_delay, delay)
+
+
+class RateLimiter:
+    """Spaces out request starts by at least an interval of seconds."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self, extra=0.0):
+        """Wait for the next free slot, pushing later ones back by extra."""
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            start = max(loop.time(), self.next_start)
+            self.next_start = start + self.seconds + extra
+        await asyncio.sleep(start - loop.time())
+
+
+class AiohttpFetcher:
+    """Fetches through an aiohttp session with a bounded connection pool."""
+
+    def __init__(self, concurrency):
+        # pylint: disable=import-outside-toplevel
+        import aiohttp
+        self.aiohttp = aiohttp
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=concurrency),
+            headers={"User-Agent": USER_AGENT})
+
+    async def fetch(self, method, url, data=None):
+        """Make a request, giving (status, headers, text), without redirects."""
+        async with self.session.request(method, url, data=data, allow_redirects=False) as resp:
+            text = await resp.text(errors="replace") if method != "HEAD" else ""
+            return resp.status, resp.headers, text
+
+    async def close(self):
+        """Close the connections."""
+        await self.session.close()
+
+
+class ThreadFetcher:
+    """Fetches over a pool of keep-alive http.client connections in threads.
+
+    Cookies the store sets (the password page's, mainly) are sent back on
+    later requests.
+    """
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.pool = None
+        self.cookies = {}
+
+    def _request(self, conn, method, url, data):
+        # pylint: disable=import-outside-toplevel
+        import http.cookies
+        parts = urllib.parse.urlsplit(url)
+        headers = {"User-Agent": USER_AGENT, "Host": parts.netloc}
+        if self.cookies:
+            headers["Cookie"] = "; ".join("%s=%s" % item for item in self.cookies.items())
+        body = None
+        if data is not None:
+            body = urllib.parse.urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        target = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        try:
+            conn.request(method, target, body, headers)
+            resp = conn.getresponse()
+        except (ConnectionError, OSError):
+            # The server closed a kept-alive connection; reconnect once
+            conn.close()
+            conn.request(method, target, body, headers)
+            resp = conn.getresponse()
+        text = resp.read().decode("utf-8", "replace")
+        for header in resp.headers.get_all("Set-Cookie") or []:
+            for morsel in http.cookies.SimpleCookie(header).values():
+                self.cookies[morsel.key] = morsel.value
+        return resp.status, resp.headers, text
+
+    async def fetch(self, method, url, data=None):
+        """Make a request, giving (status, headers, text), without redirects."""
+        # pylint: disable=import-outside-toplevel
+        import http.client
+        if self.pool is None:
+            parts = urllib.parse.urlsplit(url)
+            connection = (http.client.HTTPSConnection if parts.scheme == "https"
+                          else http.client.HTTPConnection)
+            self.pool = asyncio.Queue()
+            for _ in range(self.concurrency):
+                self.pool.put_nowait(connection(parts.netloc, timeout=30))
+        conn = await self.pool.get()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self._request, conn, method, url, data)
+        finally:
+            self.pool.put_nowait(conn)
+
+    async def close(self):
+        """Close the connections."""
+        while self.pool and not self.pool.empty():
+            self.pool.get_nowait().close()
+
+
+def get_fetcher(concurrency):
+    """Get an aiohttp fetcher if aiohttp is installed, else a threaded one."""
+    try:
+        return AiohttpFetcher(concurrency)
+    except ImportError:
+        LOGGER.info("aiohttp not installed; using http.client connections")
+        return ThreadFetcher(concurrency)
+
+
+class Crawler:
+    """Crawls a store from its home page, checking pages and links."""
+
+    def __init__(self, base, fetcher, concurrency=CONCURRENCY, delay=0.0):
+        self.base = base.rstrip("/") + "/"
+        self.fetcher = fetcher
+        self.concurrency = concurrency
+        self.delay = delay
+        self.limiter = RateLimiter(delay)
+        self.robots = urllib.robotparser.RobotFileParser()
+        self.robots.allow_all = True
+        self.queue = asyncio.Queue()
+        self.seen = set()
+        # URL: status, for every URL requested
+        self.status = {}
+        # URL: set of pages linking to it
+        self.referrers = collections.defaultdict(set)
+        # URL: list of problems with its markup
+        self.problems = {}
+        # template: pages crawled
+        self.templates = collections.Counter()
+        self.disallowed = set()
+
+    async def request(self, method, url, data=None):
+        """Request a URL, following redirects and waiting out rate limits.
+
+        Gives (status, final URL, text).
+        """
+        retries = 0
+        for _ in range(MAX_REDIRECTS + 1):
+            await self.limiter.wait()
+            status, headers, text = await self.fetcher.fetch(method, url, data)
+            if status == 429 and retries < MAX_RETRIES:
+                retries += 1
+                retry_after = headers.get("Retry-After", "")
+                wait = float(retry_after) if retry_after.isdigit() else RETRY_DELAY
+                LOGGER.info("429 for %s; waiting %.1fs", url, wait)
+                await self.limiter.wait(wait)
+                continue
+            if status in (301, 302, 303, 307, 308) and headers.get("Location"):
+                url = urllib.parse.urljoin(url, headers["Location"])
+                method, data = ("GET", None) if method == "POST" else (method, data)
+                continue
+            return status, url, text
+        return status, url, text
+
+    async def log_in(self, password):
+        """Get past the storefront password page."""
+        status, url, _ = await self.request(
+            "POST", self.base + "password",
+            {"form_type": "storefront_password", "password": password})
+        if urllib.parse.urlsplit(url).path == "/password" or status >= 400:
+            raise RuntimeError("store password not accepted")
+
+    async def read_robots(self):
+        """Read robots.txt and set the request interval from it."""
+        status, _, text = await self.request("GET", self.base + "robots.txt")
+        if status == 200:
+            self.robots.allow_all = False
+            self.robots.parse(text.splitlines())
+            self.limiter.seconds = interval(self.robots, self.delay)
+            LOGGER.info("at most one request every %.2fs", self.limiter.seconds)
+
+    def add(self, url, referrer=None):
+        """Queue a URL unless it's been seen."""
+        if referrer:
+            self.referrers[url].add(referrer)
+        if url in self.seen:
+            return
+        self.seen.add(url)
+        if not self.robots.can_fetch(USER_AGENT, url):
+            self.disallowed.add(url)
+            return
+        self.queue.put_nowait(url)
+
+    async def visit(self, url):
+        """Fetch a URL, checking it and queueing its links if it's followed."""
+        if not RE_FOLLOW.match(urllib.parse.urlsplit(url).path):
+            self.status[url] = (await self.request("HEAD", url))[0]
+            return
+        status, final_url, text = await self.request("GET", url)
+        self.status[url] = status
+        if status != 200 or urllib.parse.urlsplit(final_url).path == "/password":
+            return
+        links, items, problems = parse(text)
+        store_path = url[len(self.base) - 1:]
+        self.templates[template_for_path(store_path)] += 1
+        problems.extend(check_page(store_path, items))
+        if problems:
+            self.problems[url] = problems
+        for link in links:
+            link_url = normalize(link, final_url, self.base)
+            if link_url:
+                self.add(link_url, url)
+
+    async def worker(self):
+        """Visit queued URLs until cancelled."""
+        while True:
+            url = await self.queue.get()
+            try:
+                await self.visit(url)
+            except Exception as err:  # pylint: disable=broad-except
+                LOGGER.warning("%s: %s", url, err)
+                self.status[url] = None
+            finally:
+                self.queue.task_done()
+
+    async def crawl(self, password=None):
+        """Crawl the store from its home page."""
+        if password:
+            await self.log_in(password)
+        await self.read_robots()
+        self.add(self.base)
+        workers = [asyncio.ensure_future(self.worker()) for _ in range(self.concurrency)]
+        try:
+            await self.queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self.fetcher.close()
+
+    def broken(self):
+        """Get {URL: (status, sorted referrers)} for links that didn't work."""
+        return {url: (status, sorted(self.referrers[url]))
+                for url, status in self.status.items()
+                if status is None or not 200 <= status < 300}
+
+    def report(self, stream=sys.stdout):
+        """Print what was crawled and what's wrong.  Returns True if all is well."""
+        print("%d URLs requested, %d skipped for robots.txt" % (
+            len(self.status), len(self.disallowed)), file=stream)
+        for template, count in sorted(self.templates.items()):
+            print("  %-40s %5d pages" % (template, count), file=stream)
+        broken = self.broken()
+        for url, (status, referrers) in sorted(broken.items()):
+            print("broken: %s (%s) from %s" % (url, status, ", ".join(referrers) or "-"),
+                  file=stream)
+        for url, problems in sorted(self.problems.items()):
+            for problem in problems:
+                print("markup: %s: %s" % (url, problem), file=stream)
+        return not broken and not self.problems
+
+    def results(self):
+        """Get the results as JSON-friendly data."""
+        return {
+            "status": self.status,
+            "broken": self.broken(),
+            "problems": self.problems,
+            "templates": dict(self.templates),
+            "disallowed": sorted(self.disallowed),
+            }
+
+
+async def run(base, concurrency=CONCURRENCY, delay=0.0, password=None):
+    """Crawl a store and get the Crawler with the results."""
+    crawler = Crawler(base, get_fetcher(concurrency), concurrency, delay)
+    await crawler.crawl(password)
+    return crawler
+
+
+def main(argv=None):
+    """Crawl the store, report, and exit nonzero on any problems."""
+    # pylint: disable=import-outside-toplevel
+    from .util import TESTING_CONFIG
+    parser = argparse.ArgumentParser(
+        prog="python -m tests.crawl",
+        description="Check the store's schema.org markup and links.")
+    parser.add_argument("--store", help="store URL (default from the testing configuration)")
+    parser.add_argument("-c", "--concurrency", type=int, default=CONCURRENCY,
+                        help="requests at once (default %d)" % CONCURRENCY)
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="minimum seconds between requests")
+    parser.add_argument("--json", help="save the results to this JSON file")
+    args = parser.parse_args(argv)
+    base = args.store or "https://" + TESTING_CONFIG["store_site"]
+    password = None if args.store else TESTING_CONFIG["store_password"]
+    crawler = asyncio.run(run(base, args.concurrency, args.delay, password))
+    if args.json:
+        with open(args.json, "w") as f_out:
+            json.dump(crawler.results(), f_out, indent=2, sort_keys=True)
+    if not crawler.report():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
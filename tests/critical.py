@@ -0,0 +1,307 @@
+"""
+Critical CSS extraction per template.
+
+Every stylesheet in head.liquid blocks rendering until it's downloaded.  This
+loads pages for each template type at each of the WINDOWSIZES viewports,
+works out which style rules apply to something above the fold, and writes
+snippets/head_critical.liquid with those rules inlined per template.  With
+the "Inline critical CSS" theme setting on, head.liquid includes that and
+loads the full stylesheets without blocking (the media="print" onload swap,
+with a noscript fallback).
+
+    python -m tests.critical build
+    python -m tests.critical verify --save before.json
+    python -m tests.critical verify --baseline before.json
+
+The stylesheets are on Shopify's CDN, a different origin from the store, so
+the page can't read their rules.  Instead each one is fetched and parsed here
+(see cssrules) and the browser is asked which selectors match an element
+starting above the bottom of the window, and which @media conditions hold.
+Rules for hover and other states are kept if the element they'd style is
+above the fold.  The output is gitignored like the asset bundles, since it
+depends on the store's content; rebuild it after stylesheet changes.
+
+verify measures first paint and first contentful paint for each template
+and viewport, optionally saving them or comparing against a saved baseline,
+and runs LAYOUT_TESTS (the product grid wrapping checks from _check_wrap).
+Run it with the setting off and --save, then rebuild, upload, turn the
+setting on, and run it again with --baseline.
+"""
+
+import os
+import re
+import sys
+import json
+import logging
+import argparse
+import statistics
+
+from tools.bundle import (head_entries, minify_css)
+from . import cssrules
+from .impact import (ThemeGraph, template_pages)
+from .store_client import StoreClient
+from .store_site import (WINDOWSIZES, rotate)
+from .util import fetch
+from .watch import run_tests
+
+LOGGER = logging.getLogger(__name__)
+
+OUTPUT_SNIPPET = "snippets/head_critical.liquid"
+
+# Set in each template's branch of the snippet for head.liquid's stylesheets
+CSS_DEFER = """{%- capture css_defer %} media="print" onload="this.media='all'"{% endcapture -%}"""
+
+RE_WHEN = re.compile(r"{%- when '([^']+)' %}")
+
+VIEWPORTS = {
+    "small": WINDOWSIZES["small"],
+    "medium": WINDOWSIZES["medium"],
+    "medium-rotated": rotate(WINDOWSIZES["medium"]),
+    "large": WINDOWSIZES["large"],
+    }
+
+# Tests whose layout checks should still pass with critical CSS inlined
+LAYOUT_TESTS = [
+    "TestSite.test_template_index",
+    "TestSite.test_template_collection",
+    "TestSiteCollections.test_template_collection_submenu",
+    ]
+
+PAINT_JS = """
+var times = {};
+performance.getEntriesByType("paint").forEach(function(entry) {
+    times[entry.name] = entry.startTime;
+});
+return times;
+"""
+
+
+class CriticalClient(StoreClient):
+    """Browser session for critical CSS extraction and timing."""
+
+
+def fetch_rules(href, user_agent):
+    """Fetch and parse a stylesheet, making url() references absolute.
+
+    The user agent matters for the Google Fonts stylesheet, which varies the
+    font formats it lists by browser.
+    """
+    text = fetch(href, user_agent)
+    return [rule._replace(body=cssrules.absolute_urls(rule.body, href)) if rule.body else rule
+            for rule in cssrules.parse(text)]
+
+
+def critical_rules(driver, rules):
+    """Get the indexes of a stylesheet's rules that matter above the fold.
+
+    At-rules other than the conditional ones (@font-face, @keyframes) are
+    always kept.
+    """
+    keep = set()
+    query = []
+    for idx, rule in enumerate(rules):
+        if rule.prelude.startswith("@"):
+            keep.add(idx)
+        else:
+            selectors = [cssrules.static_selector(selector)
+                         for selector in cssrules.split_selectors(rule.prelude)]
+            query.append([idx, list(rule.media), selectors])
+    keep.update(driver.execute_script(cssrules.MATCH_RULES_JS, query, True))
+    return keep
+
+
+def collect(pages, viewports):
+    """Visit pages at each viewport and collect critical rules per template.
+
+    Returns the parsed stylesheets by URL, and per template the stylesheet
+    URLs in page order with the set of (URL, rule index) pairs to inline.
+    """
+    CriticalClient.set_up_site()
+    driver = CriticalClient.get_driver()
+    user_agent = driver.execute_script("return navigator.userAgent;")
+    sheets = {}
+    found = {}
+    try:
+        for key, paths in sorted(pages.items()):
+            order = []
+            keep = set()
+            for path in paths:
+                for name, size in viewports.items():
+                    LOGGER.info("collect: %s: %s at %s", key, path, name)
+                    driver.set_window_size(size["width"], size["height"])
+                    driver.get(CriticalClient.url + path)
+                    for href in driver.execute_script(cssrules.STYLESHEETS_JS):
+                        if href not in sheets:
+                            sheets[href] = fetch_rules(href, user_agent)
+                        if href not in order:
+                            order.append(href)
+                        keep.update(
+                            (href, idx) for idx in critical_rules(driver, sheets[href]))
+            found[key] = (order, keep)
+    finally:
+        CriticalClient.tear_down_site()
+    return sheets, found
+
+
+def critical_css(sheets, order, keep):
+    """Get the minified critical CSS for one template."""
+    rules = []
+    for href in order:
+        rules.extend(rule for idx, rule in enumerate(sheets[href]) if (href, idx) in keep)
+    return minify_css(cssrules.serialize(rules))
+
+
+def read_snippet(root="."):
+    """Get the critical CSS by template key from an existing head_critical."""
+    css_by_template = {}
+    key = None
+    try:
+        with open(os.path.join(root, OUTPUT_SNIPPET)) as f_in:
+            for line in f_in:
+                match = RE_WHEN.match(line)
+                if match:
+                    key = match.group(1)
+                elif key and line.startswith("  <style>"):
+                    css_by_template[key] = line.strip()[len("<style>"):-len("</style>")]
+    except FileNotFoundError:
+        pass
+    return css_by_template
+
+
+def write_snippet(css_by_template, root="."):
+    """Write snippets/head_critical.liquid.
+
+    Only the templates listed get css_defer set, so anything else (customer
+    pages, gift cards...) keeps the blocking stylesheets from head.liquid.
+    """
+    out = [
+        "{%- comment -%}",
+        "Generated by tests/critical.py from the store; don't edit.",
+        "{%- endcomment -%}",
+        "{%- case template -%}"]
+    for key in sorted(css_by_template):
+        out.append("{%%- when '%s' %%}" % key)
+        out.append("  <style>%s</style>" % css_by_template[key])
+        out.append(CSS_DEFER)
+    out.append("{%- endcase %}")
+    # Without scripts the deferred stylesheets never switch to media="all"
+    out.append("{%- if css_defer %}")
+    out.append("  <noscript>")
+    for _, line in head_entries(ThemeGraph(root), root):
+        if 'rel="stylesheet"' in line:
+            out.append("  " + line.replace("{{ css_defer }}", ""))
+    out.append("  </noscript>")
+    out.append("{%- endif %}")
+    with open(os.path.join(root, OUTPUT_SNIPPET), "w") as f_out:
+        f_out.write("\n".join(out) + "\n")
+
+
+def build(templates=None):
+    """Collect critical CSS for the given template keys (default all) and write it.
+
+    Building only some templates keeps what the snippet already has for the
+    others.
+    """
+    pages = template_pages()
+    css_by_template = {}
+    if templates:
+        pages = {key: paths for key, paths in pages.items() if key in templates}
+        css_by_template = read_snippet()
+    sheets, found = collect(pages, VIEWPORTS)
+    print("%-20s %12s %12s" % ("template", "full (B)", "critical (B)"))
+    for key, (order, keep) in sorted(found.items()):
+        css_by_template[key] = critical_css(sheets, order, keep)
+        full = minify_css(cssrules.serialize([rule for href in order for rule in sheets[href]]))
+        print("%-20s %12d %12d" % (key, len(full.encode()), len(css_by_template[key].encode())))
+    write_snippet(css_by_template)
+
+
+def measure(pages, viewports, repeat=3):
+    """Time first paint and first contentful paint for each template.
+
+    Only the first page for each template is loaded, repeat times per
+    viewport.  Returns a nested dictionary of template, viewport, and paint
+    entry name to the median time in ms.
+    """
+    CriticalClient.set_up_site()
+    driver = CriticalClient.get_driver()
+    results = {}
+    try:
+        for key, paths in sorted(pages.items()):
+            for name, size in viewports.items():
+                driver.set_window_size(size["width"], size["height"])
+                times = {}
+                for _ in range(repeat):
+                    driver.get(CriticalClient.url + paths[0])
+                    for entry, msec in driver.execute_script(PAINT_JS).items():
+                        times.setdefault(entry, []).append(msec)
+                results.setdefault(key, {})[name] = {
+                    entry: statistics.median(vals) for entry, vals in times.items()}
+    finally:
+        CriticalClient.tear_down_site()
+    return results
+
+
+def compare(results, baseline, stream=sys.stdout):
+    """Print paint times against a baseline and get whether FCP improved.
+
+    Improved here means the median first contentful paint across every
+    template and viewport measured in both went down.
+    """
+    fmt = "%-20s %-15s %10s %10s %8s\n"
+    stream.write(fmt % ("template", "viewport", "was (ms)", "now (ms)", "change"))
+    deltas = []
+    for key in sorted(results):
+        for name, times in sorted(results[key].items()):
+            was = baseline.get(key, {}).get(name, {}).get("first-contentful-paint")
+            now = times.get("first-contentful-paint")
+            if was is None or now is None:
+                continue
+            deltas.append(now - was)
+            stream.write(fmt % (key, name, "%.0f" % was, "%.0f" % now, "%+.0f" % (now - was)))
+    return bool(deltas) and statistics.median(deltas) < 0
+
+
+def verify(save=None, baseline=None, repeat=3):
+    """Measure paint times, compare with a baseline, and run LAYOUT_TESTS.
+
+    Returns True if everything that was checked passed.
+    """
+    results = measure(template_pages(), VIEWPORTS, repeat)
+    if save:
+        with open(save, "w") as f_out:
+            json.dump(results, f_out, indent=2, sort_keys=True)
+    passed = True
+    if baseline:
+        with open(baseline) as f_in:
+            if not compare(results, json.load(f_in)):
+                print("first contentful paint did not improve")
+                passed = False
+    if not run_tests(LAYOUT_TESTS).wasSuccessful():
+        passed = False
+    return passed
+
+
+def main(argv=None):
+    """Build critical CSS or verify its effect."""
+    parser = argparse.ArgumentParser(
+        prog="python -m tests.critical",
+        description="Extract and check per-template critical CSS.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="write " + OUTPUT_SNIPPET)
+    build_parser.add_argument(
+        "templates", nargs="*", help="template keys like product or page.contact (default all)")
+    verify_parser = subparsers.add_parser(
+        "verify", help="measure paint times and run layout tests")
+    verify_parser.add_argument("--save", help="save paint times to this JSON file")
+    verify_parser.add_argument("--baseline", help="compare paint times against this JSON file")
+    verify_parser.add_argument("-n", "--repeat", type=int, default=3, help="loads per page")
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        build(args.templates)
+    elif not verify(args.save, args.baseline, args.repeat):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
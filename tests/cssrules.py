@@ -0,0 +1,233 @@
+"""
+Minimal CSS rule parsing for tools that look at stylesheets rule by rule.
+
+Stylesheets come from Shopify's CDN, a different origin from the store, so
+the browser won't show their cssRules to scripts on the page.  Instead the
+critical and asset_coverage modules fetch and parse the text here and ask the
+browser about one selector at a time.
+
+This is not a full CSS parser, just enough for the stylesheets in this
+theme: style rules, @media/@supports blocks (nested to any depth), other
+block at-rules like @font-face and @keyframes kept whole, and statement
+at-rules like @import.
+"""
+
+import re
+import collections
+from urllib.parse import urljoin
+
+# One rule.  media is a tuple of the enclosing conditional at-rule preludes
+# (like "@media only screen and (min-width: 800px)"), outermost first.
+# prelude is the selector list or at-rule, and body the text between the
+# braces, or None for statement at-rules.
+Rule = collections.namedtuple("Rule", ["media", "prelude", "body"])
+
+CONDITIONAL_AT_RULES = ("@media", "@supports", "@document")
+
+RE_URL = re.compile(r"url\(\s*(['\"]?)([^'\")]+)\1\s*\)")
+# Pseudo-classes and pseudo-elements that depend on state or aren't
+# elements, so querySelectorAll won't match them on a freshly loaded page
+RE_DYNAMIC_PSEUDO = re.compile(
+    r"::?(?:hover|focus(?:-within|-visible)?|active|visited|link|target|checked|"
+    r"before|after|first-letter|first-line|placeholder|selection|marker|"
+    r"-webkit-[\w-]+|-moz-[\w-]+|-ms-[\w-]+)(?:\([^)]*\))?")
+
+# JavaScript for Selenium's execute_script listing the page's stylesheet URLs
+STYLESHEETS_JS = """
+return Array.from(
+    document.querySelectorAll("link[rel=stylesheet]"),
+    function(link) { return link.href; });
+"""
+
+# JavaScript for Selenium's execute_script taking a list of [index, [media
+# ...], [selector...]] (see static_selector) and whether to only count
+# elements starting above the bottom of the window, and returning the
+# indexes of the rules whose conditions hold and whose selectors match.
+MATCH_RULES_JS = """
+var rules = arguments[0];
+var limit = arguments[1] ? window.innerHeight : Infinity;
+var applies = function(media) {
+    return media.every(function(cond) {
+        if (cond.startsWith("@media")) {
+            return window.matchMedia(cond.slice(6).trim()).matches;
+        }
+        if (cond.startsWith("@supports")) {
+            return CSS.supports(cond.slice(9).trim());
+        }
+        return true;
+    });
+};
+var matches = function(selector) {
+    var elems;
+    try {
+        elems = document.querySelectorAll(selector);
+    } catch (err) {
+        return true;
+    }
+    for (var i = 0; i < elems.length; i++) {
+        if (elems[i].getBoundingClientRect().top < limit) {
+            return true;
+        }
+    }
+    return false;
+};
+return rules.filter(function(rule) {
+    return applies(rule[1]) && rule[2].some(matches);
+}).map(function(rule) { return rule[0]; });
+"""
+
+
+def _skip(text, idx):
+    """Get the index past a comment or string starting at idx, or idx."""
+    if text.startswith("/*", idx):
+        end = text.find("*/", idx + 2)
+        return len(text) if end < 0 else end + 2
+    if text[idx] in "'\"":
+        quote = text[idx]
+        idx += 1
+        while idx < len(text) and text[idx] != quote:
+            idx += 2 if text[idx] == "\\" else 1
+        return idx + 1
+    return idx
+
+
+def _block_end(text, idx):
+    """Get the index of the brace closing the block whose body starts at idx."""
+    depth = 1
+    while idx < len(text):
+        nxt = _skip(text, idx)
+        if nxt != idx:
+            idx = nxt
+            continue
+        if text[idx] == "{":
+            depth += 1
+        elif text[idx] == "}":
+            depth -= 1
+            if not depth:
+                return idx
+        idx += 1
+    return idx
+
+
+def strip_comments(text):
+    """Remove comments from stylesheet text, leaving strings alone."""
+    out = []
+    idx = start = 0
+    while idx < len(text):
+        nxt = _skip(text, idx)
+        if nxt == idx:
+            idx += 1
+            continue
+        if text.startswith("/*", idx):
+            out.append(text[start:idx])
+            start = nxt
+        idx = nxt
+    out.append(text[start:])
+    return "".join(out)
+
+
+def parse(text, media=()):
+    """Parse stylesheet text into a list of Rules in source order."""
+    if not media:
+        text = strip_comments(text)
+    rules = []
+    idx = start = 0
+    while idx < len(text):
+        nxt = _skip(text, idx)
+        if nxt != idx:
+            idx = nxt
+            continue
+        char = text[idx]
+        if char in ";}":
+            # A statement at-rule, or stray punctuation
+            head = _clean(text[start:idx])
+            if char == ";" and head.startswith("@"):
+                rules.append(Rule(media, head, None))
+            start = idx + 1
+        elif char == "{":
+            head = _clean(text[start:idx])
+            end = _block_end(text, idx + 1)
+            body = text[idx+1:end]
+            if head.startswith(CONDITIONAL_AT_RULES):
+                rules.extend(parse(body, media + (head,)))
+            else:
+                rules.append(Rule(media, head, body.strip()))
+            idx = start = end + 1
+            continue
+        idx += 1
+    return rules
+
+
+def _clean(prelude):
+    return " ".join(prelude.split())
+
+
+def split_selectors(prelude):
+    """Split a selector list on its top-level commas."""
+    parts = []
+    depth = 0
+    current = ""
+    idx = 0
+    while idx < len(prelude):
+        nxt = _skip(prelude, idx)
+        if nxt != idx:
+            current += prelude[idx:nxt]
+            idx = nxt
+            continue
+        char = prelude[idx]
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        if char == "," and not depth:
+            parts.append(current.strip())
+            current = ""
+        else:
+            current += char
+        idx += 1
+    parts.append(current.strip())
+    return [part for part in parts if part]
+
+
+def static_selector(selector):
+    """Get a selector querySelectorAll can match on a page at rest.
+
+    State-dependent pseudo-classes and pseudo-elements are dropped, so
+    "a:hover" becomes "a" and "li::before" becomes "li".  A selector that
+    was only those becomes "*".
+    """
+    selector = RE_DYNAMIC_PSEUDO.sub("", selector).strip()
+    if not selector or selector[-1] in ">+~":
+        selector += "*"
+    return selector
+
+
+def absolute_urls(body, base):
+    """Resolve relative url() references in a rule body against base."""
+    return RE_URL.sub(
+        lambda match: "url(%s%s%s)" % (
+            match.group(1), urljoin(base, match.group(2)), match.group(1)),
+        body)
+
+
+def serialize(rules, sep=""):
+    """Write Rules back out as stylesheet text, regrouping media blocks.
+
+    sep goes between rules and blocks, like "\\n" for one per line.
+    """
+    out = []
+    stack = ()
+    for rule in rules:
+        common = 0
+        while (common < len(stack) and common < len(rule.media) and
+               stack[common] == rule.media[common]):
+            common += 1
+        out.extend("}" for _ in stack[common:])
+        out.extend(prelude + "{" for prelude in rule.media[common:])
+        stack = rule.media
+        if rule.body is None:
+            out.append(rule.prelude + ";")
+        else:
+            out.append(rule.prelude + "{" + rule.body + "}")
+    out.extend("}" for _ in stack)
+    return sep.join(out)
@@ -0,0 +1,114 @@
+"""
+Selenium driver factory.
+
+make_driver builds a Chrome or Firefox driver tuned for testing: headless by
+default, with GPU probing, extensions, and background networking turned off,
+a disk cache that persists between runs, and optionally no image loading at
+all for tests that don't look at the page.  The defaults come from
+TESTING_CONFIG (see util) and a StoreClient class can override any of them
+with its driver_options attribute.  Chrome also takes two options there that
+only some tools need: host_rules, for --host-resolver-rules (see throttle,
+which uses it to keep the browser off the network), and performance_log, to
+log DevTools network events for get_log("performance") (see har).  See
+benchmark.bench_drivers for comparing launch times between configurations.
+"""
+
+import os
+import logging
+
+from selenium.webdriver import (Chrome, ChromeOptions, Firefox, FirefoxOptions)
+
+from .util import TESTING_CONFIG
+
+LOGGER = logging.getLogger(__name__)
+
+# Keys in TESTING_CONFIG that make up a driver configuration
+DRIVER_KEYS = ("browser", "headless", "load_images", "cache_dir", "tuned")
+
+CHROME_TUNED_ARGS = [
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--no-first-run",
+    "--mute-audio",
+    ]
+
+FIREFOX_TUNED_PREFS = {
+    "app.update.auto": False,
+    "app.update.enabled": False,
+    "browser.safebrowsing.malware.enabled": False,
+    "browser.safebrowsing.phishing.enabled": False,
+    "datareporting.healthreport.uploadEnabled": False,
+    "datareporting.policy.dataSubmissionEnabled": False,
+    "extensions.update.enabled": False,
+    "toolkit.telemetry.enabled": False,
+    }
+
+
+def driver_config(overrides=None, name=None):
+    """Get a driver configuration from TESTING_CONFIG plus any overrides.
+
+    If name is given (usually a test class name) and a cache directory is
+    configured, the cache goes in a subdirectory of that name, so that
+    browsers running at the same time don't share one cache but each keeps
+    its own from one run to the next.
+    """
+    config = {key: TESTING_CONFIG[key] for key in DRIVER_KEYS}
+    config.update(overrides or {})
+    if config["cache_dir"]:
+        parts = [config["cache_dir"], config["browser"]]
+        if name:
+            parts.append(name)
+        config["cache_dir"] = os.path.join(*parts)
+    return config
+
+
+def make_driver(config):
+    """Start a browser for a configuration from driver_config."""
+    LOGGER.info("make_driver: %s", config)
+    browser = config["browser"]
+    if browser == "chrome":
+        return _make_chrome(config)
+    if browser == "firefox":
+        return _make_firefox(config)
+    raise ValueError("unsupported browser: %s" % browser)
+
+
+def _make_chrome(config):
+    options = ChromeOptions()
+    if config["headless"]:
+        # "new" headless is the full browser, rather than the separate
+        # headless shell, in recent Chrome; older versions ignore the value.
+        options.add_argument("--headless=new")
+    if config["tuned"]:
+        for arg in CHROME_TUNED_ARGS:
+            options.add_argument(arg)
+    if config["cache_dir"]:
+        os.makedirs(config["cache_dir"], exist_ok=True)
+        options.add_argument("--disk-cache-dir=" + config["cache_dir"])
+    if config.get("host_rules"):
+        options.add_argument("--host-resolver-rules=" + config["host_rules"])
+    if config.get("performance_log"):
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    if not config["load_images"]:
+        options.add_experimental_option(
+            "prefs", {"profile.managed_default_content_settings.images": 2})
+    return Chrome(options=options)
+
+
+def _make_firefox(config):
+    options = FirefoxOptions()
+    if config["headless"]:
+        options.add_argument("-headless")
+    if config["tuned"]:
+        for key, val in FIREFOX_TUNED_PREFS.items():
+            options.set_preference(key, val)
+    if config["cache_dir"]:
+        os.makedirs(config["cache_dir"], exist_ok=True)
+        options.set_preference("browser.cache.disk.parent_directory", config["cache_dir"])
+    if not config["load_images"]:
+        options.set_preference("permissions.default.image", 2)
+    return Firefox(options=options)
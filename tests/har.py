@@ -0,0 +1,575 @@
+"""
+Network logs of page loads, and what to fix in them.
+
+capture loads each template's first page (see impact.template_pages) in
+Chrome, one after the other in a single session starting with an empty
+cache, and saves each page's requests as a HAR file, built from the DevTools
+network events in the browser's performance log.  Chrome's extra fields are
+kept with underscores, like Chrome's own HAR exports: _start and _end in ms
+from the page's first request, _initiator, _resourceType, _priority, and
+_renderBlocking where the browser reports it.  The page entry also carries
+the paint times and the size of every image as loaded and as shown.
+
+    python -m tests.har capture DIR
+    python -m tests.har analyze DIR [--json F]
+
+analyze reads the HAR files back and looks for:
+
+ * render-blocking stylesheets and scripts (snippets/head.liquid's, mostly),
+   and what finishing without them would save before first paint,
+ * head scripts held back by a slower one before them (the one from
+   ajax.googleapis.com, say), and new origins on the critical path,
+ * chains of requests, each only found once the one before it loaded,
+ * the same file downloaded again on a later page, or under another URL,
+ * text sent without compression, and files without caching headers, and
+ * images much bigger than they're shown.
+
+It prints the fixes ranked by the time they'd save, summed over templates,
+with the saving per template.  Savings in bytes are converted to time at
+the REFERENCE_NETWORK speed from throttle, so they're rough estimates, and
+fixes for the same requests overlap rather than adding up.
+"""
+
+import os
+import re
+import sys
+import json
+import logging
+import argparse
+import datetime
+import urllib.parse
+
+from .asset_coverage import asset_name
+from .throttle import (NETWORKS, RE_TEXT_TYPE)
+
+LOGGER = logging.getLogger(__name__)
+
+HEAD_SNIPPET = "snippets/head.liquid"
+REFERENCE_NETWORK = "fast-3g"
+# Smallest saving worth listing, in ms
+MIN_SAVING_MS = 10.0
+# Typical gzip output size for text, as a fraction of the input
+GZIP_RATIO = 0.3
+COMPRESS_MIN_BYTES = 1400
+DUPLICATE_MIN_BYTES = 1000
+CACHE_MIN_SECONDS = 86400
+# Images with more than this many times the pixels they're shown at
+OVERSIZE_RATIO = 1.5
+# Kinds of requests a page can wait on through a chain
+CHAIN_TYPES = ("Stylesheet", "Script", "Font")
+# How long to let the page settle after its load event before reading it
+SETTLE_MS = 1000
+RE_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+PAGE_JS = """
+var done = arguments[arguments.length - 1];
+setTimeout(function() {
+    var page = {paint: {}, blocking: {}, images: []};
+    performance.getEntriesByType("paint").forEach(function(entry) {
+        page.paint[entry.name] = entry.startTime;
+    });
+    var nav = performance.getEntriesByType("navigation")[0];
+    page.onContentLoad = nav.domContentLoadedEventEnd;
+    page.onLoad = nav.loadEventEnd;
+    performance.getEntriesByType("resource").forEach(function(entry) {
+        if (entry.renderBlockingStatus) page.blocking[entry.name] = entry.renderBlockingStatus;
+    });
+    var ratio = window.devicePixelRatio || 1;
+    Array.prototype.forEach.call(document.images, function(img) {
+        if (img.currentSrc && img.naturalWidth) {
+            page.images.push({
+                url: img.currentSrc,
+                natural: [img.naturalWidth, img.naturalHeight],
+                shown: [img.clientWidth * ratio, img.clientHeight * ratio]});
+        }
+    });
+    done(page);
+}, arguments[0]);
+"""
+
+
+def header_list(headers):
+    """Convert a DevTools headers object to HAR's list of names and values."""
+    return [{"name": name, "value": value} for name, value in sorted((headers or {}).items())]
+
+
+def header(headers, name):
+    """Get a header value from a HAR list, ignoring case, or None."""
+    for item in headers:
+        if item["name"].lower() == name:
+            return item["value"]
+    return None
+
+
+def initiator_url(initiator):
+    """Get the URL of whatever started a request, from its DevTools initiator."""
+    if initiator.get("url"):
+        return initiator["url"]
+    stack = initiator.get("stack")
+    while stack:
+        for frame in stack.get("callFrames", []):
+            if frame.get("url"):
+                return frame["url"]
+        stack = stack.get("parent")
+    return None
+
+
+def har_timings(start, end, timing):
+    """Get HAR timings in ms from request start and end times and DevTools timing."""
+    if not timing:
+        return {"blocked": 0, "dns": -1, "connect": -1, "ssl": -1, "send": 0, "wait": 0,
+                "receive": max(0, (end - start) * 1000)}
+    span = lambda first, last: timing[last] - timing[first] if timing[first] >= 0 else -1
+    base = timing["requestTime"] * 1000
+    setup = next((timing[key] for key in ("dnsStart", "connectStart", "sendStart")
+                  if timing[key] >= 0), 0)
+    return {
+        "blocked": max(0, base - start * 1000) + setup,
+        "dns": span("dnsStart", "dnsEnd"),
+        "connect": span("connectStart", "connectEnd"),
+        "ssl": span("sslStart", "sslEnd"),
+        "send": timing["sendEnd"] - timing["sendStart"],
+        "wait": timing["receiveHeadersEnd"] - timing["sendEnd"],
+        "receive": max(0, end * 1000 - base - timing["receiveHeadersEnd"])}
+
+
+class EntryBuilder:
+    """One request's HAR entry, put together from its DevTools events."""
+
+    def __init__(self, params, page_id):
+        request = params["request"]
+        self.start = params["timestamp"]
+        self.end = None
+        self.wall = params["wallTime"]
+        self.response = None
+        self.size = 0
+        self.transfer = 0
+        self.cached = False
+        self.error = None
+        self.redirect = ""
+        self.entry = {
+            "pageref": page_id,
+            "request": {
+                "method": request["method"], "url": request["url"], "httpVersion": "",
+                "headers": header_list(request.get("headers")), "queryString": [],
+                "cookies": [], "headersSize": -1, "bodySize": 0},
+            "cache": {},
+            "_initiator": initiator_url(params.get("initiator", {})),
+            "_initiatorType": params.get("initiator", {}).get("type"),
+            "_resourceType": params.get("type"),
+            "_priority": request.get("initialPriority"),
+            }
+
+    def finish(self, t_zero, blocking):
+        """Get the finished entry, timed from t_zero (seconds)."""
+        end = self.end or self.start
+        response = self.response or {}
+        entry = self.entry
+        entry["startedDateTime"] = datetime.datetime.fromtimestamp(
+            self.wall, datetime.timezone.utc).isoformat()
+        entry["time"] = (end - self.start) * 1000
+        entry["timings"] = har_timings(self.start, end, response.get("timing"))
+        entry["response"] = {
+            "status": response.get("status", 0), "statusText": response.get("statusText", ""),
+            "httpVersion": response.get("protocol", ""),
+            "headers": header_list(response.get("headers")), "cookies": [],
+            "content": {"size": self.size, "mimeType": response.get("mimeType", "")},
+            "redirectURL": self.redirect, "headersSize": -1, "bodySize": -1,
+            "_transferSize": self.transfer, "_error": self.error}
+        entry["_fromCache"] = self.cached or bool(response.get("fromDiskCache"))
+        entry["_start"] = (self.start - t_zero) * 1000
+        entry["_end"] = (end - t_zero) * 1000
+        entry["_renderBlocking"] = blocking.get(entry["request"]["url"])
+        return entry
+
+
+def to_har(events, page_id, url, page):
+    """Build a HAR log from one page load's DevTools network events.
+
+    page is what PAGE_JS found: paint and load times, render-blocking status
+    per URL, and the images.
+    """
+    builders = {}
+    done = []
+    for event in events:
+        method, params = event.get("method", ""), event.get("params", {})
+        builder = builders.get(params.get("requestId"))
+        if method == "Network.requestWillBeSent":
+            if params["request"]["url"].startswith("data:"):
+                continue
+            if builder and params.get("redirectResponse"):
+                builder.response = params["redirectResponse"]
+                builder.end = params["timestamp"]
+                builder.redirect = params["request"]["url"]
+                done.append(builder)
+            builders[params["requestId"]] = EntryBuilder(params, page_id)
+        elif builder is None:
+            continue
+        elif method == "Network.responseReceived":
+            builder.response = params["response"]
+        elif method == "Network.requestServedFromCache":
+            builder.cached = True
+        elif method == "Network.dataReceived":
+            builder.size += params.get("dataLength", 0)
+        elif method == "Network.loadingFinished":
+            builder.end = params["timestamp"]
+            builder.transfer = params.get("encodedDataLength", 0)
+            done.append(builders.pop(params["requestId"]))
+        elif method == "Network.loadingFailed":
+            builder.end = params["timestamp"]
+            builder.error = params.get("errorText")
+            done.append(builders.pop(params["requestId"]))
+    done.extend(builders.values())
+    done.sort(key=lambda builder: builder.start)
+    t_zero = done[0].start if done else 0
+    entries = [builder.finish(t_zero, page.get("blocking", {})) for builder in done]
+    started = entries[0]["startedDateTime"] if entries else ""
+    return {"log": {
+        "version": "1.2",
+        "creator": {"name": "tests.har", "version": "1"},
+        "pages": [{
+            "startedDateTime": started, "id": page_id, "title": url,
+            "pageTimings": {"onContentLoad": page.get("onContentLoad", -1),
+                            "onLoad": page.get("onLoad", -1)},
+            "_paint": page.get("paint", {}), "_images": page.get("images", [])}],
+        "entries": entries}}
+
+
+def capture(directory, pages=None):
+    """Load each template's first page and save its HAR file in directory."""
+    # pylint: disable=import-outside-toplevel
+    from .impact import template_pages
+    from .store_client import StoreClient
+
+    class HarClient(StoreClient):
+        """Browser session logging network events."""
+        driver_options = {"browser": "chrome", "performance_log": True}
+
+    pages = pages or {key: paths[0] for key, paths in template_pages().items()}
+    os.makedirs(directory, exist_ok=True)
+    HarClient.set_up_site()
+    driver = HarClient.get_driver()
+    driver.set_script_timeout(30)
+    driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+    try:
+        for key, path in sorted(pages.items()):
+            driver.get_log("performance")
+            driver.get(HarClient.url + path)
+            page = driver.execute_async_script(PAGE_JS, SETTLE_MS)
+            events = [json.loads(entry["message"])["message"]
+                      for entry in driver.get_log("performance")]
+            har = to_har(events, key, HarClient.url + path, page)
+            with open(os.path.join(directory, key + ".har"), "w") as f_out:
+                json.dump(har, f_out, indent=1)
+            LOGGER.info("capture: %s: %d requests", key, len(har["log"]["entries"]))
+    finally:
+        HarClient.tear_down_site()
+
+
+def load(directory):
+    """Read the HAR files in a directory, as (page, entries) in capture order."""
+    found = []
+    for name in os.listdir(directory):
+        if name.endswith(".har"):
+            with open(os.path.join(directory, name)) as f_in:
+                log = json.load(f_in)["log"]
+            for page in log["pages"]:
+                found.append((page, [entry for entry in log["entries"]
+                                     if entry.get("pageref") == page["id"]]))
+    return sorted(found, key=lambda item: item[0]["startedDateTime"])
+
+
+def transfer_ms(nbytes):
+    """Estimate the time to download some bytes at REFERENCE_NETWORK speed."""
+    return nbytes / NETWORKS[REFERENCE_NETWORK]["download"] * 1000
+
+
+def short(url, query=False):
+    """Shorten a URL to its host and file name (and query) for listing."""
+    parts = urllib.parse.urlsplit(url)
+    name = "%s/%s" % (parts.netloc, parts.path.rsplit("/", 1)[-1])
+    return name + "?" + parts.query if query and parts.query else name
+
+
+def origin(url):
+    """Get the scheme and host of a URL."""
+    parts = urllib.parse.urlsplit(url)
+    return "%s://%s" % (parts.scheme, parts.netloc)
+
+
+class Fixes:
+    """Suggested fixes, with their estimated savings per template."""
+
+    def __init__(self, head_text=""):
+        self.head_text = head_text
+        self.found = {}
+
+    def add(self, kind, subject, template, msec, advice):
+        """Record a fix saving msec on a template, if it's worth mentioning."""
+        if msec < MIN_SAVING_MS:
+            return
+        fix = self.found.setdefault((kind, subject), {
+            "kind": kind, "subject": subject, "advice": advice, "templates": {}})
+        fix["templates"][template] = max(fix["templates"].get(template, 0), msec)
+
+    def in_head(self, url):
+        """Where a URL is included in the page head, for advice, or ""."""
+        name = asset_name(url) or urllib.parse.urlsplit(url).path
+        if name and name in self.head_text:
+            return " in " + HEAD_SNIPPET
+        return ""
+
+    def ranked(self):
+        """Get the fixes, biggest total saving first."""
+        fixes = []
+        for fix in self.found.values():
+            fix = dict(fix, total=sum(fix["templates"].values()))
+            fixes.append(fix)
+        return sorted(fixes, key=lambda fix: (-fix["total"], fix["kind"], fix["subject"]))
+
+
+def is_blocking(entry):
+    """Did this request hold up the page's first render?
+
+    Chrome reports this itself (renderBlockingStatus) since version 107.
+    Otherwise it's guessed: stylesheets and scripts the parser found that
+    got the highest priorities, which is how Chrome treats blocking ones.
+    """
+    if entry.get("_renderBlocking"):
+        return entry["_renderBlocking"] == "blocking"
+    return (entry.get("_resourceType") in ("Stylesheet", "Script")
+            and entry.get("_initiatorType") == "parser"
+            and entry.get("_priority") in ("VeryHigh", "High"))
+
+
+def document(entries):
+    """Get the page's own document entry."""
+    for entry in entries:
+        if entry.get("_resourceType") == "Document":
+            return entry
+    return entries[0]
+
+
+def check_render_blocking(fixes, key, entries):
+    """Render-blocking requests, together and alone.
+
+    Without blocking requests of a type, rendering could start when the
+    document arrives (or the last blocking request of the other type
+    finishes), rather than when the last of them finishes.  Each one alone
+    is credited with how much sooner the rest would all be done without it.
+    """
+    doc = document(entries)
+    blocking = [entry for entry in entries if entry is not doc and is_blocking(entry)]
+    for kind in ("Stylesheet", "Script"):
+        group = [entry for entry in blocking if entry["_resourceType"] == kind]
+        if not group:
+            continue
+        rest = max([doc["_end"]] + [entry["_end"] for entry in blocking if entry not in group])
+        fixes.add(
+            "render-blocking", "all %d %ss" % (len(group), kind.lower()), key,
+            max(entry["_end"] for entry in group) - rest,
+            "load them without blocking rendering (%s)" % (
+                "inline critical CSS; see tests/critical.py" if kind == "Stylesheet"
+                else "defer or async them"))
+    for entry in blocking:
+        url = entry["request"]["url"]
+        others = max([doc["_end"]] + [other["_end"] for other in blocking if other is not entry])
+        fixes.add(
+            "render-blocking", short(url), key, entry["_end"] - others,
+            "%s blocks rendering%s and finishes last; load it later or make it smaller" % (
+                entry["_resourceType"].lower(), fixes.in_head(url)))
+
+
+def check_gating(fixes, key, entries):
+    """Blocking scripts held back by a slower one before them.
+
+    Scripts run in document order, so one that's downloaded has to wait for
+    any earlier one still loading.
+    """
+    doc = document(entries)
+    scripts = sorted((entry for entry in entries if entry is not doc and is_blocking(entry)
+                      and entry["_resourceType"] == "Script"), key=lambda entry: entry["_start"])
+    held = {}
+    for idx, script in enumerate(scripts[1:], 1):
+        gate = max(scripts[:idx], key=lambda entry: entry["_end"])
+        if gate["_end"] > script["_end"]:
+            waits = held.setdefault(id(gate), (gate, []))[1]
+            waits.append(gate["_end"] - script["_end"])
+    for gate, waits in held.values():
+        url = gate["request"]["url"]
+        fixes.add(
+            "gating", short(url), key, max(waits),
+            "holds back the %d scripts after it%s; self-host it or preconnect to %s" % (
+                len(waits), fixes.in_head(url), origin(url)))
+
+
+def check_connections(fixes, key, entries):
+    """New origins whose connection setup is on the critical path."""
+    doc = document(entries)
+    critical = [entry for entry in entries if entry is not doc and (
+        is_blocking(entry) or entry.get("_resourceType") in CHAIN_TYPES)]
+    seen = {origin(doc["request"]["url"])}
+    for entry in sorted(critical, key=lambda entry: entry["_start"]):
+        site = origin(entry["request"]["url"])
+        if site in seen:
+            continue
+        seen.add(site)
+        timings = entry["timings"]
+        setup = max(0, timings["dns"]) + max(0, timings["connect"])
+        fixes.add(
+            "connection", site, key, setup,
+            "preconnect to it, or serve %s from the store's CDN" % short(entry["request"]["url"]))
+
+
+def check_chains(fixes, key, entries):
+    """Requests that only started once the one that referenced them loaded.
+
+    Preloading one from the page would let it start with its parent.
+    """
+    doc = document(entries)
+    first = {}
+    for entry in entries:
+        first.setdefault(entry["request"]["url"], entry)
+    for entry in entries:
+        parent = first.get(entry.get("_initiator"))
+        if (parent is None or parent is doc or parent is entry
+                or entry.get("_resourceType") not in CHAIN_TYPES):
+            continue
+        chain = [entry, parent]
+        while chain[-1].get("_initiator") in first and chain[-1] is not doc and len(chain) < 10:
+            chain.append(first[chain[-1]["_initiator"]])
+        fixes.add(
+            "chain", " -> ".join(short(link["request"]["url"]) for link in reversed(chain)),
+            key, entry["_start"] - parent["_start"],
+            "preload %s from the page" % short(entry["request"]["url"]))
+
+
+def check_duplicates(fixes, pages):
+    """Files downloaded again on a later page, or under more than one URL."""
+    seen = {}
+    contents = {}
+    for page, entries in pages:
+        key = page["id"]
+        for entry in entries:
+            url = entry["request"]["url"]
+            response = entry["response"]
+            size = response["content"]["size"]
+            if (entry.get("_fromCache") or response["status"] != 200
+                    or response.get("_transferSize", 0) < DUPLICATE_MIN_BYTES):
+                continue
+            content = (url.split("?")[0], size)
+            if url in seen:
+                fixes.add("duplicate", short(url, True), key, entry["time"],
+                          "downloaded again after the %s page; check its caching" % seen[url])
+            elif contents.get(content, url) != url:
+                fixes.add("duplicate", short(url, True), key, entry["time"],
+                          "same file as %s under another URL" % contents[content])
+            seen.setdefault(url, key)
+            contents.setdefault(content, url)
+
+
+def check_headers(fixes, key, entries):
+    """Text without compression, and files without caching headers."""
+    doc = document(entries)
+    for entry in entries:
+        response = entry["response"]
+        if entry.get("_fromCache") or response["status"] != 200:
+            continue
+        url = entry["request"]["url"]
+        size = response["content"]["size"]
+        mime = response["content"]["mimeType"]
+        if (RE_TEXT_TYPE.match(mime) and size > COMPRESS_MIN_BYTES
+                and not header(response["headers"], "content-encoding")):
+            fixes.add("compression", short(url), key, transfer_ms(size * (1 - GZIP_RATIO)),
+                      "%d bytes of %s sent uncompressed" % (size, mime))
+        if entry is doc or entry["request"]["method"] != "GET":
+            continue
+        control = header(response["headers"], "cache-control") or ""
+        max_age = RE_MAX_AGE.search(control)
+        if "no-store" in control or "no-cache" in control or (
+                max_age and int(max_age.group(1)) < CACHE_MIN_SECONDS) or (
+                    not max_age and "immutable" not in control
+                    and not header(response["headers"], "expires")):
+            fixes.add("caching", short(url), key,
+                      transfer_ms(response.get("_transferSize") or size),
+                      "repeat visits download it again (Cache-Control: %s)" % (control or "none"))
+
+
+def check_images(fixes, key, page, entries):
+    """Images with many more pixels than they're shown with."""
+    sizes = {entry["request"]["url"]: entry["response"].get("_transferSize")
+             or entry["response"]["content"]["size"] for entry in entries}
+    for image in page.get("_images", []):
+        natural = image["natural"][0] * image["natural"][1]
+        shown = image["shown"][0] * image["shown"][1]
+        nbytes = sizes.get(image["url"])
+        if not shown or not nbytes or natural <= shown * OVERSIZE_RATIO:
+            continue
+        fixes.add("oversized-image", short(image["url"]), key,
+                  transfer_ms(nbytes * (1 - shown / natural)),
+                  "%dx%d shown at %dx%d; add a smaller srcset width or sizes" % (
+                      tuple(image["natural"]) + tuple(image["shown"])))
+
+
+def analyze(pages, head_text=""):
+    """Find fixes in (page, entries) pairs from load, ranked."""
+    fixes = Fixes(head_text)
+    for page, entries in pages:
+        if not entries:
+            continue
+        key = page["id"]
+        check_render_blocking(fixes, key, entries)
+        check_gating(fixes, key, entries)
+        check_connections(fixes, key, entries)
+        check_chains(fixes, key, entries)
+        check_headers(fixes, key, entries)
+        check_images(fixes, key, page, entries)
+    check_duplicates(fixes, pages)
+    return fixes.ranked()
+
+
+def report(fixes, stream=sys.stdout):
+    """Print ranked fixes, then the possible savings per template."""
+    stream.write("Estimated savings in ms (bytes at %s speed), summed over templates:\n"
+                 % REFERENCE_NETWORK)
+    per_template = {}
+    for rank, fix in enumerate(fixes, 1):
+        stream.write("%3d. %7.0f  %-16s %s\n" % (rank, fix["total"], fix["kind"], fix["subject"]))
+        stream.write("%s%s\n" % (" " * 15, fix["advice"]))
+        stream.write("%s%s\n" % (" " * 15, ", ".join(
+            "%s %.0f" % item for item in sorted(
+                fix["templates"].items(), key=lambda item: -item[1]))))
+        for key, msec in fix["templates"].items():
+            per_template[key] = per_template.get(key, 0) + msec
+    stream.write("\n%-20s %8s %14s\n" % ("template", "fixes", "up to (ms)"))
+    for key in sorted(per_template, key=lambda key: -per_template[key]):
+        count = sum(1 for fix in fixes if key in fix["templates"])
+        stream.write("%-20s %8d %14.0f\n" % (key, count, per_template[key]))
+
+
+def main(argv=None):
+    """Capture HAR files or analyze them."""
+    parser = argparse.ArgumentParser(
+        prog="python -m tests.har",
+        description="Capture each template's network log and rank what to fix.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    capture_parser = subparsers.add_parser("capture", help="save a HAR file per template")
+    capture_parser.add_argument("directory")
+    analyze_parser = subparsers.add_parser("analyze", help="rank fixes from saved HAR files")
+    analyze_parser.add_argument("directory")
+    analyze_parser.add_argument("--json", help="also save the ranked fixes to this file")
+    args = parser.parse_args(argv)
+    if args.command == "capture":
+        capture(args.directory)
+        return
+    with open(HEAD_SNIPPET) as f_in:
+        head_text = f_in.read()
+    fixes = analyze(load(args.directory), head_text)
+    report(fixes)
+    if args.json:
+        with open(args.json, "w") as f_out:
+            json.dump(fixes, f_out, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,361 @@
+"""
+Test impact selection: map changed theme files to the tests that exercise them.
+
+This builds a static dependency graph of the theme (layout -> templates ->
+snippets -> asset_url references) and combines it with the template each test
+URL renders, so that given a list of changed files (usually from git diff) we
+can pick out just the tests worth re-running.  Nothing here touches the store
+or imports selenium, so it's cheap enough to call from tools/pre-commit.
+
+From the top level of the repo:
+
+    python -m tests.impact            # changes in the working tree vs HEAD
+    python -m tests.impact --cached   # staged changes only
+    python -m tests.impact master     # changes since master
+    python -m tests $(python -m tests.impact --cached)
+
+The output is a list of test names relative to tests.test_site, which is what
+util.main hands to unittest.
+"""
+
+import os
+import re
+import sys
+import fnmatch
+import logging
+import argparse
+import subprocess
+
+LOGGER = logging.getLogger(__name__)
+
+THEME_DIRS = ("layout", "templates", "snippets", "assets", "config")
+
+LAYOUT_DEFAULT = "layout/theme.liquid"
+
+# Stylesheets and scripts that only concern certain parts of the theme, even
+# though head.liquid loads them on every page.  Each entry is a list of file
+# patterns; an asset only counts as a dependency of a template whose include
+# tree contains one of those files.  Assets not listed here (style.css,
+# js-shop.js, and so on) count for every page that references them.
+ASSET_SCOPES = {
+    "assets/style-address.css":           ["snippets/address.liquid"],
+    "assets/style-banner.css.liquid":     ["snippets/page_header.liquid"],
+    "assets/style-cart.css":              ["snippets/cart.liquid"],
+    "assets/style-collection.css":        [
+        "snippets/collection_item.liquid",
+        "snippets/collection_designers.liquid",
+        "snippets/pagenums.liquid"],
+    "assets/style-instafeed.css.liquid":  ["snippets/instafeed.liquid"],
+    "assets/style-mailing-list.css":      ["snippets/mailing_list.liquid"],
+    "assets/style-page.css":              ["templates/page*.liquid"],
+    "assets/style-product.css":           ["snippets/product.liquid"],
+    "assets/style-search.css.liquid":     ["snippets/searchform.liquid"],
+    "assets/js-hammer.min.js":            ["snippets/product.liquid"],
+    "assets/js-jqueryInstagramFeed.min.js": ["snippets/instafeed.liquid"],
+    "assets/js-setup-instafeed.js.liquid": ["snippets/instafeed.liquid"],
+    "assets/js-mlpopup.js":               ["snippets/mailing_list.liquid"],
+    }
+
+# Alternate templates assigned to particular pages in the store admin.  Pages
+# not listed here use templates/page.liquid.
+PAGE_TEMPLATES = {
+    "about": "templates/page.columns.liquid",
+    "contact-us": "templates/page.contact.liquid",
+    }
+
+# Store paths visited by each test, relative to the store URL.  Paths visited
+# in setUpClass are listed under the bare class name and apply to every test
+# in that class.  Keep this in step with the test modules; test_impact checks
+# that every test method has an entry.
+TEST_PATHS = {
+    "TestSite.test_template_404": ["does-not-exist"],
+    "TestSite.test_template_article": [],
+    "TestSite.test_template_blog": [],
+    "TestSite.test_template_cart": ["cart"],
+    "TestSite.test_template_cart_items": [
+        "cart", "collections/testing", "products/variants"],
+    "TestSite.test_template_collection": ["collections/new"],
+    "TestSite.test_template_gift_card": [],
+    "TestSite.test_template_index": [""],
+    "TestSite.test_template_list_collections": ["collections"],
+    "TestSite.test_template_search": ["search"],
+    "TestSite.test_page_about": ["pages/about"],
+    "TestSite.test_page_events": ["pages/events"],
+    "TestSite.test_page_contact": ["pages/contact-us"],
+    "TestSite.test_page_policies": ["pages/policies"],
+    "TestSite.test_page_shipping": ["pages/shipping"],
+    "TestSite.test_page_faq": ["pages/faq"],
+    "TestSite.test_header_search": ["", "search?view=json", "search"],
+    "TestSite.test_image_loading": ["collections/testing", "collections"],
+    "TestSite.test_page_shell_cache_invariant": [
+        "", "collections/testing", "collections/new", "collections/skirts",
+        "products/variants"],
+    "TestSiteCollections.test_template_collection_submenu": ["collections/skirts"],
+    "TestSiteCollections.test_template_collection_designers": ["collections/designers"],
+    "TestSiteCollections.test_template_collection_empty": ["collections/testing-empty"],
+    "TestSiteCollections.test_template_collection_sale": ["collections/testing-sale"],
+    "TestSiteMailingList.test_mailing_list_popup": [""],
+    "TestSiteMailingList.test_mailing_list": [],
+    "TestSiteProducts": ["collections/testing"],
+    "TestSiteProducts.test_template_product_out_of_stock": [
+        "collections/testing/products/out-of-stock"],
+    "TestSiteProducts.test_template_product": [
+        "collections/testing/products/variants"],
+    "TestSiteProducts.test_template_product_variants": [
+        "collections/testing/products/variants"],
+    "TestSiteProducts.test_template_product_variants_select": [
+        "collections/testing/products/variants"],
+    "TestSiteProducts.test_template_product_varying_prices": [
+        "collections/testing/products/varying-prices"],
+    "TestSiteProducts.test_template_product_varying_prices_select": [
+        "collections/testing/products/varying-prices"],
+    "TestSiteProducts.test_template_product_out_of_stock_variant": [
+        "collections/testing/products/running-low"],
+    "TestSiteProducts.test_template_product_out_of_stock_variant_select": [
+        "collections/testing/products/running-low"],
+    "TestSiteProducts.test_template_product_lots_of_photos": [
+        "collections/testing/products/lots-of-photos"],
+    "TestSiteProducts.test_template_product_on_sale": [
+        "collections/testing/products/now-cheaper"],
+    "TestSiteProducts.test_template_product_complex_description": [
+        "collections/testing/products/complex-description"],
+    }
+
+# Test modules and the test case class each one defines.
+TEST_MODULES = {
+    "tests/test_site.py": "TestSite",
+    "tests/test_site_collections.py": "TestSiteCollections",
+    "tests/test_site_mailinglist.py": "TestSiteMailingList",
+    "tests/test_site_products.py": "TestSiteProducts",
+    }
+
+# Harness modules shared by every test.  Changes here select everything.
+HARNESS_FILES = (
+    "tests/store_client.py", "tests/store_site.py", "tests/util.py",
+    "tests/drivers.py", "tests/asset_coverage.py", "tests/cssrules.py",
+    "tests/snapshots.py", "tests/planner.py")
+
+RE_INCLUDE = re.compile(r"{%-?\s*(?:include|render)\s+['\"]([^'\"]+)['\"]")
+RE_LAYOUT = re.compile(r"{%-?\s*layout\s+(none|['\"][^'\"]+['\"])")
+RE_ASSET = re.compile(r"['\"]([^'\"]+)['\"]\s*\|\s*asset_url")
+
+
+def template_for_path(path):
+    """Get the template file rendered for a store path.
+
+    This follows Shopify's URL conventions, so it's only a best guess for
+    paths that depend on the store's data (a missing collection renders the
+    404 template, for example).  A view query parameter picks an alternate
+    template, like templates/search.json.liquid for search?view=json.
+    """
+    view = re.search(r"[?&]view=([\w-]+)", path)
+    template = _base_template_for_path(path)
+    if view:
+        return template[:-len(".liquid")] + "." + view.group(1) + ".liquid"
+    return template
+
+
+def _base_template_for_path(path):
+    path = path.split("?")[0].strip("/")
+    parts = path.split("/") if path else []
+    if not parts:
+        return "templates/index.liquid"
+    if parts == ["cart"]:
+        return "templates/cart.liquid"
+    if parts == ["search"]:
+        return "templates/search.liquid"
+    if parts == ["collections"]:
+        return "templates/list-collections.liquid"
+    if parts[0] == "products" or (len(parts) == 4 and parts[2] == "products"):
+        return "templates/product.liquid"
+    if parts[0] == "collections" and len(parts) == 2:
+        return "templates/collection.liquid"
+    if parts[0] == "pages" and len(parts) == 2:
+        return PAGE_TEMPLATES.get(parts[1], "templates/page.liquid")
+    return "templates/404.liquid"
+
+
+def template_pages(root="."):
+    """Get store paths that render each template with a layout, by key.
+
+    Keys are template names like product or page.contact.  The paths come
+    from TEST_PATHS; an alternate template no test visits (like
+    page.gallery) gets its base template's first path with a view query
+    parameter, which Shopify renders with that template.  Templates without
+    a layout (like the JSON search view) are left out, since they don't
+    render a page.  Raises ValueError for any other template with no path.
+    """
+    graph = ThemeGraph(root)
+    keys = {template: os.path.basename(template)[:-len(".liquid")]
+            for template in graph.templates() if graph.layouts[template]}
+    pages = {key: [] for key in keys.values()}
+    for paths in TEST_PATHS.values():
+        for path in paths:
+            key = keys.get(template_for_path(path))
+            if key and path not in pages[key]:
+                pages[key].append(path)
+    for key in sorted(pages):
+        base, _, view = key.partition(".")
+        if not pages[key] and view and pages.get(base):
+            path = pages[base][0] + "?view=" + view
+            if template_for_path(path) == "templates/%s.liquid" % key:
+                pages[key].append(path)
+    missing = sorted(key for key, paths in pages.items() if not paths)
+    if missing:
+        raise ValueError("no store path for templates: " + ", ".join(missing))
+    return pages
+
+
+class ThemeGraph:
+    """Static include/asset graph for the theme files under a directory."""
+
+    def __init__(self, root="."):
+        self.root = root
+        self.edges = {}
+        self.layouts = {}
+        for dirname in ("layout", "templates", "snippets", "assets"):
+            dirpath = os.path.join(root, dirname)
+            if not os.path.isdir(dirpath):
+                continue
+            for filename in sorted(os.listdir(dirpath)):
+                self._scan(dirname + "/" + filename)
+
+    def _scan(self, relpath):
+        """Record the includes, assets, and layout referenced by one file."""
+        deps = set()
+        self.edges[relpath] = deps
+        if not relpath.endswith(".liquid"):
+            return
+        with open(os.path.join(self.root, relpath)) as f_in:
+            text = f_in.read()
+        for name in RE_INCLUDE.findall(text):
+            deps.add("snippets/" + name + ".liquid")
+        for name in RE_ASSET.findall(text):
+            deps.add(self.asset_path(name))
+        if relpath.startswith("templates/"):
+            match = RE_LAYOUT.search(text)
+            if not match:
+                self.layouts[relpath] = LAYOUT_DEFAULT
+            elif match.group(1) == "none":
+                self.layouts[relpath] = None
+            else:
+                self.layouts[relpath] = "layout/" + match.group(1).strip("'\"") + ".liquid"
+
+    def asset_path(self, name):
+        """Get the path of the file behind an asset_url name.
+
+        Shopify serves assets/x.css.liquid as x.css, so we check for that
+        version first.
+        """
+        liquid = "assets/" + name + ".liquid"
+        if os.path.exists(os.path.join(self.root, liquid)):
+            return liquid
+        return "assets/" + name
+
+    def templates(self):
+        """List the template files in the graph."""
+        return sorted(self.layouts.keys())
+
+    def closure(self, template):
+        """Get every file a template depends on, including itself.
+
+        Scoped assets (see ASSET_SCOPES) are only kept if the template's
+        include tree contains something from their scope.
+        """
+        seen = set()
+        stack = [template]
+        layout = self.layouts.get(template)
+        if layout:
+            stack.append(layout)
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            stack.extend(self.edges.get(node, ()))
+        liquid = {node for node in seen if not node.startswith("assets/")}
+        for node in list(seen):
+            scope = ASSET_SCOPES.get(node)
+            if scope is None:
+                continue
+            if not any(fnmatch.filter(liquid, pattern) for pattern in scope):
+                seen.discard(node)
+        return seen
+
+
+def test_names():
+    """List every test name from TEST_PATHS, skipping class-level entries."""
+    return sorted(key for key in TEST_PATHS if "." in key)
+
+
+def select_tests(changed, root="."):
+    """Get the set of test names affected by a list of changed files.
+
+    changed should hold paths relative to the top of the repo.  Files outside
+    the theme and test harness (README.md, tools/, and so on) select nothing.
+    """
+    graph = ThemeGraph(root)
+    everything = set(test_names())
+    changed = set(changed)
+    selected = set()
+    for path in changed:
+        if path.startswith("config/") or path in HARNESS_FILES:
+            LOGGER.info("%s: affects all tests", path)
+            return everything
+        if path in TEST_MODULES:
+            LOGGER.info("%s: affects class %s", path, TEST_MODULES[path])
+            selected.update(
+                name for name in everything
+                if name.startswith(TEST_MODULES[path] + "."))
+    closures = {}
+    for name in everything:
+        clsname = name.split(".")[0]
+        paths = TEST_PATHS[name] + TEST_PATHS.get(clsname, [])
+        for path in paths:
+            template = template_for_path(path)
+            if template not in closures:
+                closures[template] = graph.closure(template)
+            hits = changed & closures[template]
+            if hits:
+                LOGGER.info("%s: %s via %s", name, ", ".join(sorted(hits)), template)
+                selected.add(name)
+                break
+    return selected
+
+
+def changed_files(rev=None, cached=False):
+    """List files changed according to git diff."""
+    cmd = ["git", "diff", "--name-only"]
+    if cached:
+        cmd.append("--cached")
+    cmd.append(rev or "HEAD")
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    return [line for line in out.stdout.splitlines() if line]
+
+
+def main(argv=None):
+    """Print the tests affected by changed files, one per line."""
+    parser = argparse.ArgumentParser(
+        prog="python -m tests.impact",
+        description="List tests affected by changed theme files.")
+    parser.add_argument(
+        "rev", nargs="?",
+        help="git revision to diff against (default HEAD)")
+    parser.add_argument(
+        "--cached", action="store_true",
+        help="only consider staged changes")
+    parser.add_argument(
+        "--files", nargs="+", metavar="FILE",
+        help="use these changed files instead of asking git")
+    parser.add_argument(
+        "-v", "--verbose", action="store_true",
+        help="explain why each test was selected")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    changed = args.files or changed_files(args.rev, args.cached)
+    for name in sorted(select_tests(changed)):
+        print(name)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,374 @@
+"""
+Load generator replaying shopper journeys.
+
+Each simulated shopper walks the path the product tests take through the
+store: the index, the testing collection (and its second page, if it has
+one), a product from TEST_PRODUCTS, the same product with an available
+variant selected, then add to cart, the cart count, the cart page, and a
+quantity change, with the same requests js-shop.js makes for those (see
+setupAjaxCart).  Each shopper gets its own connection and cookies, so its
+own cart.
+
+    python -m tests.load record DIR [--store URL]
+    python -m tests.load serve DIR [--port PORT]
+    python -m tests.load run [--target URL | --replay DIR] [-c N] [--rate R]
+                             [--duration SECONDS] [--save F] [--baseline F]
+
+record walks every journey once against the store (the testing
+configuration's, with its password, by default) and saves the responses in
+DIR.  serve runs a local stand-in storefront replaying them, and run --replay
+starts one itself.  A stand-in only shows the cost of moving the theme's
+bytes, so for render times point --target at a local development server
+(like the Shopify CLI's http://127.0.0.1:9292) instead; use a live store
+only with care.
+
+run keeps --concurrency shoppers going for --duration seconds, each starting
+a new journey as the last one ends, or with --rate, starts journeys at random
+(Poisson) arrivals at that many per second with at most --concurrency at
+once.  It reports throughput, latency percentiles and median response sizes
+per template (or per cart endpoint), and errors.  --save keeps the results;
+--baseline compares against saved ones and exits nonzero on a regression:
+a p95 more than TOLERANCE slower (and at least MIN_DELTA_MS), a response
+more than SIZE_TOLERANCE bigger, lower throughput, or more errors.
+
+Requests go through tests.crawl's fetchers, so aiohttp is used if it's
+installed (pip install aiohttp); the fallback's threads cap how many
+requests are actually in flight at once.
+"""
+
+import os
+import re
+import sys
+import json
+import random
+import asyncio
+import hashlib
+import logging
+import argparse
+import threading
+import http.server
+
+from . import crawl
+from .impact import template_for_path
+from .util import TEST_PRODUCTS
+
+LOGGER = logging.getLogger(__name__)
+
+COLLECTION = "collections/testing"
+# Products a journey can end on (ones that can be added to the cart)
+JOURNEY_PRODUCTS = sorted(path for name, path in TEST_PRODUCTS.items() if name != "out-of-stock")
+CONCURRENCY = 10
+DURATION = 30.0
+PERCENTILES = (50, 90, 95, 99)
+TOLERANCE = 0.2
+SIZE_TOLERANCE = 0.1
+MIN_DELTA_MS = 5.0
+MANIFEST = "manifest.json"
+
+RE_ID_INPUT = re.compile(r"<input[^>]*\bname=\"id\"[^>]*>")
+RE_VALUE = re.compile(r"\bvalue=\"(\d+)\"")
+
+
+def pick_variant(text):
+    """Get the first available variant ID on a product page, or None.
+
+    That's the one the page selects by default, and always picking it keeps
+    the journeys the same between recording and replaying.
+    """
+    for tag in RE_ID_INPUT.findall(text):
+        value = RE_VALUE.search(tag)
+        if value and "disabled" not in tag:
+            return value.group(1)
+    return None
+
+
+def label(path):
+    """Get what to report a request under: its template, or a cart endpoint."""
+    path = path.split("?")[0].strip("/")
+    if path.endswith(".js"):
+        return path
+    return os.path.basename(template_for_path(path))[:-len(".liquid")]
+
+
+async def journey(fetch, product):
+    """Walk one shopper journey.
+
+    fetch(method, path, data) makes each request and gives the text.
+    """
+    await fetch("GET", "", None)
+    text = await fetch("GET", COLLECTION, None)
+    if re.search(r"rel=\"next\"", text):
+        await fetch("GET", COLLECTION + "?page=2", None)
+    variant = pick_variant(await fetch("GET", product, None))
+    if variant is None:
+        return
+    await fetch("GET", "%s?variant=%s" % (product, variant), None)
+    await fetch("POST", "cart/add.js", {"id": variant, "quantity": "1"})
+    await fetch("GET", "cart.js", None)
+    await fetch("GET", "cart", None)
+    await fetch("POST", "cart/change.js", {"id": variant, "quantity": "2"})
+
+
+def percentile(values, pct):
+    """Get the nearest-rank percentile of some values."""
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * pct // 100) - 1)]
+
+
+class Recorder:
+    """Collects request timings and sizes by label."""
+
+    def __init__(self):
+        self.samples = {}
+        self.journeys = 0
+        self.failed = 0
+
+    def add(self, path, msec, size, ok):
+        """Record one request."""
+        self.samples.setdefault(label(path), []).append((msec, size, ok))
+
+    def results(self, elapsed):
+        """Summarize as JSON-friendly data."""
+        steps = {}
+        requests = 0
+        for name, samples in sorted(self.samples.items()):
+            times = [msec for msec, _, _ in samples]
+            steps[name] = {"count": len(samples),
+                           "errors": sum(1 for _, _, ok in samples if not ok),
+                           "bytes": percentile([size for _, size, _ in samples], 50)}
+            for pct in PERCENTILES:
+                steps[name]["p%d" % pct] = percentile(times, pct)
+            requests += len(samples)
+        return {"elapsed": elapsed, "journeys": self.journeys, "failed": self.failed,
+                "journeys_per_s": self.journeys / elapsed if elapsed else 0,
+                "requests_per_s": requests / elapsed if elapsed else 0,
+                "steps": steps}
+
+
+async def shopper(base, recorder, product, get_fetcher):
+    """Run one journey with its own connection, recording each request."""
+    fetcher = get_fetcher(1)
+    loop = asyncio.get_running_loop()
+
+    async def fetch(method, path, data):
+        start = loop.time()
+        try:
+            status, _, text = await fetcher.fetch(method, base + path, data)
+        except Exception:
+            recorder.add(path, (loop.time() - start) * 1000, 0, False)
+            raise
+        recorder.add(path, (loop.time() - start) * 1000, len(text.encode()), 200 <= status < 400)
+        return text
+
+    try:
+        await journey(fetch, product)
+        recorder.journeys += 1
+    except Exception as err:  # pylint: disable=broad-except
+        LOGGER.info("journey for %s failed: %s", product, err)
+        recorder.failed += 1
+    finally:
+        await fetcher.close()
+
+
+async def run(base, concurrency=CONCURRENCY, rate=0.0, duration=DURATION, seed=0,
+              products=JOURNEY_PRODUCTS, get_fetcher=crawl.get_fetcher):
+    """Replay journeys against a store for a while and get the results.
+
+    With a rate, journeys arrive at random at that many per second (at most
+    concurrency at once, the rest waiting their turn); without, concurrency
+    shoppers each start a new journey when they finish one.
+    """
+    base = base.rstrip("/") + "/"
+    rng = random.Random(seed)
+    recorder = Recorder()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    end = start + duration
+
+    async def closed_loop():
+        while loop.time() < end:
+            await shopper(base, recorder, rng.choice(products), get_fetcher)
+
+    if rate:
+        slots = asyncio.Semaphore(concurrency)
+
+        async def arrival():
+            async with slots:
+                await shopper(base, recorder, rng.choice(products), get_fetcher)
+
+        tasks = []
+        while True:
+            await asyncio.sleep(rng.expovariate(rate))
+            if loop.time() >= end:
+                break
+            tasks.append(asyncio.ensure_future(arrival()))
+        await asyncio.gather(*tasks)
+    else:
+        await asyncio.gather(*(closed_loop() for _ in range(concurrency)))
+    return recorder.results(loop.time() - start)
+
+
+def report(results, stream=sys.stdout):
+    """Print load test results."""
+    stream.write("%d journeys (%d failed) in %.1fs: %.1f journeys/s, %.1f requests/s\n" % (
+        results["journeys"], results["failed"], results["elapsed"],
+        results["journeys_per_s"], results["requests_per_s"]))
+    fmt = "%-16s %7s %7s" + " %8s" * len(PERCENTILES) + " %9s\n"
+    stream.write(fmt % (("step", "count", "errors")
+                        + tuple("p%d (ms)" % pct for pct in PERCENTILES) + ("bytes",)))
+    for name, step in sorted(results["steps"].items()):
+        stream.write(fmt % ((name, step["count"], step["errors"])
+                            + tuple("%.1f" % step["p%d" % pct] for pct in PERCENTILES)
+                            + (step["bytes"],)))
+
+
+def compare(results, baseline, stream=sys.stdout):
+    """Print regressions against a baseline and get whether there were none."""
+    regressions = []
+    for name, step in sorted(results["steps"].items()):
+        was = baseline["steps"].get(name)
+        if not was:
+            continue
+        if step["p95"] > was["p95"] * (1 + TOLERANCE) and step["p95"] - was["p95"] >= MIN_DELTA_MS:
+            regressions.append("%s: p95 %.1fms, was %.1fms" % (name, step["p95"], was["p95"]))
+        if step["bytes"] > was["bytes"] * (1 + SIZE_TOLERANCE):
+            regressions.append("%s: %d bytes, was %d" % (name, step["bytes"], was["bytes"]))
+        if step["errors"] / step["count"] > was["errors"] / was["count"]:
+            regressions.append("%s: %d of %d requests failed, was %d of %d" % (
+                name, step["errors"], step["count"], was["errors"], was["count"]))
+    if results["requests_per_s"] < baseline["requests_per_s"] * (1 - TOLERANCE):
+        regressions.append("throughput %.1f requests/s, was %.1f" % (
+            results["requests_per_s"], baseline["requests_per_s"]))
+    for regression in regressions:
+        stream.write("regression: %s\n" % regression)
+    return not regressions
+
+
+async def record(base, directory, products=JOURNEY_PRODUCTS, password=None,
+                 get_fetcher=crawl.get_fetcher):
+    """Walk each journey once and save the responses for the stand-in."""
+    base = base.rstrip("/") + "/"
+    os.makedirs(directory, exist_ok=True)
+    manifest = {}
+    for product in products:
+        fetcher = get_fetcher(1)
+
+        async def fetch(method, path, data, fetcher=fetcher):
+            status, headers, text = await fetcher.fetch(method, base + path, data)
+            body = text.encode()
+            name = hashlib.sha1(body).hexdigest()
+            with open(os.path.join(directory, name), "wb") as f_out:
+                f_out.write(body)
+            manifest["%s /%s" % (method, path)] = {
+                "status": status, "type": headers.get("Content-Type", "text/html"), "file": name}
+            return text
+
+        try:
+            if password:
+                await fetcher.fetch("POST", base + "password",
+                                    {"form_type": "storefront_password", "password": password})
+            await journey(fetch, product)
+        finally:
+            await fetcher.close()
+    with open(os.path.join(directory, MANIFEST), "w") as f_out:
+        json.dump(manifest, f_out, indent=2, sort_keys=True)
+    return manifest
+
+
+class ReplayHandler(http.server.BaseHTTPRequestHandler):
+    """Serves recorded responses by method and path, over keep-alive."""
+
+    protocol_version = "HTTP/1.1"
+    directory = None
+    manifest = {}
+
+    def replay(self):
+        """Send the recorded response for this request, or a 404."""
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        entry = self.manifest.get("%s %s" % (self.command, self.path))
+        if entry is None:
+            status, content_type, body = 404, "text/plain", b"not recorded"
+        else:
+            with open(os.path.join(self.directory, entry["file"]), "rb") as f_in:
+                status, content_type, body = entry["status"], entry["type"], f_in.read()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_GET = do_POST = do_HEAD = replay
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        LOGGER.debug(format, *args)
+
+
+def serve(directory, port=0):
+    """Start a stand-in storefront for recorded responses in a thread.
+
+    Returns the server; its server_address has the port if port was 0.
+    """
+    with open(os.path.join(directory, MANIFEST)) as f_in:
+        manifest = json.load(f_in)
+    handler = type("Handler", (ReplayHandler,), {"directory": directory, "manifest": manifest})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    """Record journeys, serve them, or run load against a store."""
+    # pylint: disable=import-outside-toplevel
+    from .util import TESTING_CONFIG
+    parser = argparse.ArgumentParser(
+        prog="python -m tests.load",
+        description="Replay shopper journeys against a store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser("record", help="save journey responses")
+    record_parser.add_argument("directory")
+    record_parser.add_argument("--store", help="store URL (default from the testing configuration)")
+    serve_parser = subparsers.add_parser("serve", help="serve saved responses")
+    serve_parser.add_argument("directory")
+    serve_parser.add_argument("--port", type=int, default=9293)
+    run_parser = subparsers.add_parser("run", help="replay journeys under load")
+    target = run_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--target", help="store or local server URL")
+    target.add_argument("--replay", help="directory of saved responses to serve and use")
+    run_parser.add_argument("-c", "--concurrency", type=int, default=CONCURRENCY,
+                            help="shoppers at once (default %d)" % CONCURRENCY)
+    run_parser.add_argument("--rate", type=float, default=0.0,
+                            help="journey arrivals per second (default: back to back)")
+    run_parser.add_argument("--duration", type=float, default=DURATION, help="seconds to run")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--save", help="save the results to this JSON file")
+    run_parser.add_argument("--baseline", help="compare the results against this JSON file")
+    args = parser.parse_args(argv)
+    if args.command == "record":
+        base = args.store or "https://" + TESTING_CONFIG["store_site"]
+        password = None if args.store else TESTING_CONFIG["store_password"]
+        asyncio.run(record(base, args.directory, password=password))
+    elif args.command == "serve":
+        server = serve(args.directory, args.port)
+        print("serving %s at http://127.0.0.1:%d/" % (args.directory, server.server_address[1]))
+        threading.Event().wait()
+    else:
+        base = args.target
+        if args.replay:
+            base = "http://127.0.0.1:%d/" % serve(args.replay).server_address[1]
+        results = asyncio.run(run(base, args.concurrency, args.rate, args.duration, args.seed))
+        report(results)
+        if args.save:
+            with open(args.save, "w") as f_out:
+                json.dump(results, f_out, indent=2, sort_keys=True)
+        if args.baseline:
+            with open(args.baseline) as f_in:
+                if not compare(results, json.load(f_in)):
+                    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,196 @@
+"""
+Planning the browser tests around page loads.
+
+Loading pages is most of what makes the browser tests slow, and many tests
+start on the same few pages.  Test methods can declare the page they start on
+and whether they leave it as they found it:
+
+    @readonly("collections/new")
+    def test_template_collection(self):
+        self.get("collections/new")
+        ...
+
+A readonly test only looks at the page.  Hovering, resizing the window, and
+opening and closing menus are fine as long as things are put back.  The page
+it ends on can be handed as is to the next test that gets the same URL,
+instead of loading it again.  A mutating test clicks through, submits forms,
+or changes the cart.  Its first get can still reuse a clean page, but nothing
+it loads after that is reused.  Undeclared tests count as mutating.  A
+mutating test that only changes its own page (selecting options, say, but not
+the cart) can say so with page_only:
+
+    @mutating("products/variants", page_only=True)
+
+PlannedLoader runs each class's readonly tests first, grouped by page, each
+page's page_only tests right after its readonly ones (so the first of them
+gets the page they leave), then the undeclared tests, then the other mutating
+ones.  PageState, one per browser (see StoreClient.get), decides what can be
+reused and counts the page loads, for each browser and for the whole run.
+"""
+
+import logging
+import unittest
+import functools
+import collections
+
+LOGGER = logging.getLogger(__name__)
+
+Plan = collections.namedtuple("Plan", ["path", "readonly", "page_only"], defaults=[False])
+
+# Order of tests within a class, by plan.
+READONLY, UNDECLARED, MUTATING = range(3)
+
+
+def _declare(path, readonly, page_only=False):
+    """Decorator attaching a Plan to a StoreClient test method.
+
+    If the test fails partway it may have left a menu open or the like, so
+    the page it was on isn't reused.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return func(self, *args, **kwargs)
+            except Exception:
+                self.driver.page_state.discard()
+                raise
+        wrapper.plan = Plan(path, readonly, page_only)
+        return wrapper
+    return decorator
+
+
+def readonly(path=""):
+    """Decorator for a test that starts on path and doesn't change the page."""
+    return _declare(path, True)
+
+
+def mutating(path="", page_only=False):
+    """Decorator for a test that starts on path and then changes things.
+
+    Use page_only if the changes don't outlast the page.
+    """
+    return _declare(path, False, page_only)
+
+
+def plan_for(test):
+    """Get the Plan declared for a TestCase instance's test method, or None."""
+    # pylint: disable=protected-access
+    return getattr(getattr(test, test._testMethodName, None), "plan", None)
+
+
+def sort_key(plan, name):
+    """Sort key for one test method within its class."""
+    if plan is None:
+        return (UNDECLARED, "", False, name)
+    if plan.readonly or plan.page_only:
+        return (READONLY, plan.path, plan.page_only, name)
+    return (MUTATING, plan.path, False, name)
+
+
+def order(tests):
+    """Put a list of TestCase instances in planned order.
+
+    Tests stay together by class, in the order the classes first appear, so
+    each class's setUpClass and tearDownClass still run just once.
+    """
+    classes = {}
+    for test in tests:
+        classes.setdefault(type(test), []).append(test)
+    ordered = []
+    for group in classes.values():
+        group.sort(key=lambda test: sort_key(plan_for(test), test.id()))
+        ordered.extend(group)
+    return ordered
+
+
+def iter_tests(suite):
+    """Yield every TestCase in a possibly nested TestSuite."""
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from iter_tests(test)
+        else:
+            yield test
+
+
+class PlannedLoader(unittest.TestLoader):
+    """TestLoader that puts tests in planned order.  See order."""
+
+    def getTestCaseNames(self, testCaseClass):
+        names = super().getTestCaseNames(testCaseClass)
+        plans = {name: getattr(getattr(testCaseClass, name), "plan", None) for name in names}
+        return sorted(names, key=lambda name: sort_key(plans[name], name))
+
+    def loadTestsFromNames(self, names, module=None):
+        suite = super().loadTestsFromNames(names, module)
+        return self.suiteClass(order(list(iter_tests(suite))))
+
+
+class PageState:
+    """What one browser has loaded, and whether a test can use it as is.
+
+    Call begin and end around each test, reuse before each get, and loaded
+    after each page load.  loads and reused count the page loads made and
+    saved, and run_loads and run_reused the same over every PageState.
+    """
+
+    run_loads = 0
+    run_reused = 0
+
+    def __init__(self):
+        self.url = None
+        self.clean = False
+        self.readonly = False
+        self.first = False
+        self.loads = 0
+        self.reused = 0
+
+    def __str__(self):
+        return "%d page loads, %d reused" % (self.loads, self.reused)
+
+    @classmethod
+    def run_totals(cls):
+        """Describe the page loads so far this run, and what they'd be without reuse."""
+        return "%d page loads in the run so far, %d without reuse" % (
+            cls.run_loads, cls.run_loads + cls.run_reused)
+
+    def begin(self, plan):
+        """Start a test with the given Plan (or None)."""
+        self.readonly = bool(plan and plan.readonly)
+        self.first = True
+
+    def end(self):
+        """Finish a test.  Only a readonly test leaves the page clean."""
+        if not self.readonly:
+            self.clean = False
+        self.readonly = False
+        self.first = False
+
+    def reuse(self, url):
+        """Can a get of url use the page already loaded?"""
+        usable = self.clean and url == self.url and (self.readonly or self.first)
+        self.first = False
+        if usable:
+            self.reused += 1
+            PageState.run_reused += 1
+            if not self.readonly:
+                self.clean = False
+        return usable
+
+    def loaded(self, url):
+        """Record a page load.  The page is clean if the test is readonly."""
+        self.url = url
+        self.loads += 1
+        PageState.run_loads += 1
+        self.clean = self.readonly
+
+    def landed(self, url):
+        """Record a clean page load outside any test, like logging in."""
+        self.url = url
+        self.loads += 1
+        PageState.run_loads += 1
+        self.clean = True
+
+    def discard(self):
+        """Don't reuse the current page."""
+        self.clean = False
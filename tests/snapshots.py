@@ -0,0 +1,396 @@
+"""
+Rendered HTML snapshots of the pages the test suite visits, and diffs.
+
+With SHOPIFY_TEST_SNAPSHOTS set to a directory, each StoreClient browser
+saves the rendered HTML (after the page's scripts have run) of every page it
+loads with get.  The HTML is normalized first so that only theme changes
+show up between runs:
+ * everything content_for_header outputs (between the comments theme.liquid
+   puts around it) and the scripts and frames it injects later are dropped,
+ * token values (authenticity_token inputs, the checkout API token meta,
+   nonces) are blanked,
+ * asset URLs lose their ?v= version parameter and theme ID,
+ * comments go, attributes are sorted, and whitespace is collapsed.
+Snapshots are stored gzipped under objects/ named by the hash of their
+normalized text, so a page that didn't change between runs costs nothing
+more, and each run has a manifest of store path to hashes under runs/.  The
+run is named by SHOPIFY_TEST_SNAPSHOT_RUN, or the time the suite started.
+
+    SHOPIFY_TEST_SNAPSHOTS=snapshots SHOPIFY_TEST_SNAPSHOT_RUN=before python -m tests
+    SHOPIFY_TEST_SNAPSHOTS=snapshots SHOPIFY_TEST_SNAPSHOT_RUN=after python -m tests
+    python -m tests.snapshots diff before after [--dir snapshots]
+    python -m tests.snapshots runs [--dir snapshots]
+
+diff compares the runs' manifests first, so only pages whose hashes differ
+get decompressed and compared, element by element.  It prints which
+templates changed and, for each changed page, the elements added, removed,
+or changed (attributes or text), by their path in the page.  It exits
+nonzero if anything differed.
+"""
+
+import os
+import re
+import sys
+import glob
+import gzip
+import html
+import json
+import difflib
+import hashlib
+import logging
+import argparse
+import urllib.parse
+from html.parser import HTMLParser
+
+from .impact import template_for_path
+
+LOGGER = logging.getLogger(__name__)
+
+HEADER_START = "content_for_header"
+HEADER_END = "/content_for_header"
+VOID = {"area", "base", "br", "col", "embed", "hr", "img", "input",
+        "link", "meta", "param", "source", "track", "wbr"}
+# Elements whose text isn't HTML-escaped
+RAW = {"script", "style"}
+# Scripts, frames, and links Shopify adds (analytics and such) by their URLs
+RE_VOLATILE_URL = re.compile(r"shopifycloud|web-pixels|trekkie|monorail|/wpm@|shop\.app/")
+RE_VOLATILE_ID = re.compile(r"^(?:web-pixels|shopify-|trekkie|wpm-)")
+# Inputs and metas whose values change per session
+TOKEN_NAMES = {"authenticity_token", "_token", "csrf-token", "csrf_token",
+               "shopify-checkout-api-token"}
+DROP_ATTRIBUTES = {"nonce", "integrity"}
+# Store path query parameters that don't change the page
+VOLATILE_PARAMS = {"preview_theme_id", "_pos", "_sid", "_ss", "_ab", "_fd", "_sc", "_psq"}
+RE_VERSION_FIRST = re.compile(r"\?v=\d+&(?:amp;)?")
+RE_VERSION = re.compile(r"(?:\?|&(?:amp;)?)v=\d+(?![\d&])")
+RE_THEME_ID = re.compile(r"/t/\d+/")
+MAX_TEXT = 60
+
+
+def strip_versions(text):
+    """Drop asset version parameters and theme IDs from URLs in text."""
+    text = RE_VERSION_FIRST.sub("?", text)
+    text = RE_VERSION.sub("", text)
+    return RE_THEME_ID.sub("/t/*/", text)
+
+
+def page_key(url):
+    """Get the store path (with its meaningful query) a snapshot is saved under."""
+    parts = urllib.parse.urlsplit(url)
+    query = [(key, value) for key, value in urllib.parse.parse_qsl(parts.query, True)
+             if key not in VOLATILE_PARAMS]
+    path = parts.path.lstrip("/")
+    return path + ("?" + urllib.parse.urlencode(query) if query else "")
+
+
+class Node:
+    """An element in a parsed page: tag, sorted attributes, and children.
+
+    Children are Nodes or strings of text.
+    """
+
+    def __init__(self, tag, attrs=()):
+        self.tag = tag
+        self.attrs = tuple(attrs)
+        self.children = []
+        self._text = None
+
+    def label(self):
+        """Get a short description like div#id or section.class."""
+        attrs = dict(self.attrs)
+        if attrs.get("id"):
+            return "%s#%s" % (self.tag, attrs["id"])
+        if attrs.get("class"):
+            return "%s.%s" % (self.tag, attrs["class"].split()[0])
+        return self.tag
+
+    def text(self):
+        """Serialize the element (once)."""
+        if self._text is None:
+            attrs = "".join(' %s="%s"' % (name, html.escape(value)) if value is not None
+                            else " " + name for name, value in self.attrs)
+            if self.tag in VOID:
+                self._text = "<%s%s>" % (self.tag, attrs)
+            else:
+                self._text = "<%s%s>%s</%s>" % (
+                    self.tag, attrs, "".join(
+                        child.text() if isinstance(child, Node)
+                        else child if self.tag in RAW else html.escape(child, False)
+                        for child in self.children), self.tag)
+        return self._text
+
+
+class Normalizer(HTMLParser):
+    """Parse a page into Nodes, leaving out what changes between loads."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Node("#document")
+        self._stack = [self.root]
+        self._skipping = 0
+        self._in_header = False
+
+    def handle_comment(self, data):
+        if data.strip() == HEADER_START:
+            self._in_header = True
+        elif data.strip() == HEADER_END:
+            self._in_header = False
+
+    def handle_starttag(self, tag, attrs):
+        if self._in_header:
+            return
+        if self._skipping:
+            if tag not in VOID:
+                self._skipping += 1
+            return
+        attrs = dict(attrs)
+        if RE_VOLATILE_URL.search(attrs.get("src") or attrs.get("href") or "") or \
+                RE_VOLATILE_ID.match(attrs.get("id") or ""):
+            if tag not in VOID:
+                self._skipping = 1
+            return
+        if attrs.get("name") in TOKEN_NAMES:
+            for name in ("value", "content"):
+                if name in attrs:
+                    attrs[name] = "*"
+        node = Node(tag, sorted(
+            (name, strip_versions(value) if value is not None else None)
+            for name, value in attrs.items() if name not in DROP_ATTRIBUTES))
+        self._stack[-1].children.append(node)
+        if tag not in VOID:
+            self._stack.append(node)
+
+    def handle_endtag(self, tag):
+        if self._in_header or tag in VOID:
+            return
+        if self._skipping:
+            self._skipping -= 1
+            return
+        if any(node.tag == tag for node in self._stack[1:]):
+            while self._stack.pop().tag != tag:
+                pass
+
+    def handle_data(self, data):
+        if self._in_header or self._skipping:
+            return
+        node = self._stack[-1]
+        text = " ".join(data.split())
+        if node.tag in RAW:
+            text = strip_versions(text)
+        if not text:
+            return
+        if node.children and isinstance(node.children[-1], str):
+            node.children[-1] = " ".join((node.children[-1], text))
+        else:
+            node.children.append(text)
+
+
+def parse(text):
+    """Parse (and normalize) a page's HTML into a Node tree."""
+    parser = Normalizer()
+    parser.feed(text)
+    parser.close()
+    return parser.root
+
+
+def normalize(text):
+    """Get the normalized HTML for a page."""
+    return "".join(child.text() if isinstance(child, Node) else html.escape(child, False)
+                   for child in parse(text).children)
+
+
+def _short(text):
+    text = text if isinstance(text, str) else text.text()
+    return repr(text if len(text) <= MAX_TEXT else text[:MAX_TEXT - 3] + "...")
+
+
+def diff_nodes(old, new, path=""):
+    """List (path, change) for the differences between two Node trees.
+
+    Matching children (by their serialized text) are skipped without looking
+    inside; unmatched elements with the same tag in the same place are
+    compared recursively, and the rest are added or removed.
+    """
+    changes = []
+    here = path + "/" + new.label() if new.tag != "#document" else ""
+    old_attrs, new_attrs = dict(old.attrs), dict(new.attrs)
+    for name in sorted(set(old_attrs) | set(new_attrs)):
+        if old_attrs.get(name) != new_attrs.get(name):
+            changes.append((here, "@%s %s -> %s" % (
+                name, _short(old_attrs.get(name) or ""), _short(new_attrs.get(name) or ""))))
+    keys = lambda node: [child.text() if isinstance(child, Node) else child
+                         for child in node.children]
+    matcher = difflib.SequenceMatcher(None, keys(old), keys(new), autojunk=False)
+    for opcode, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if opcode == "equal":
+            continue
+        olds = old.children[old_start:old_end]
+        news = new.children[new_start:new_end]
+        while olds and news and type(olds[0]) is type(news[0]) and \
+                (isinstance(olds[0], str) or olds[0].tag == news[0].tag):
+            old_child, new_child = olds.pop(0), news.pop(0)
+            if isinstance(new_child, str):
+                changes.append((here, "text %s -> %s" % (_short(old_child), _short(new_child))))
+            else:
+                changes.extend(diff_nodes(old_child, new_child, here))
+        for child in olds:
+            changes.append((here, "removed %s" % _short(child)))
+        for child in news:
+            changes.append((here, "added %s" % _short(child)))
+    return changes
+
+
+def diff_pages(old_text, new_text):
+    """List (path, change) for the differences between two saved snapshots."""
+    return diff_nodes(parse(old_text), parse(new_text))
+
+
+class SnapshotStore:
+    """Content-addressed, gzipped snapshots and run manifests in a directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def object_path(self, digest):
+        """Get the file a snapshot's text is stored in."""
+        return os.path.join(self.directory, "objects", digest[:2], digest[2:] + ".html.gz")
+
+    def put(self, text):
+        """Store normalized text (if it's new) and get its hash."""
+        data = text.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as f_out:
+                f_out.write(gzip.compress(data, mtime=0))
+            os.replace(path + ".tmp", path)
+        return digest
+
+    def get(self, digest):
+        """Get a snapshot's text by its hash."""
+        with gzip.open(self.object_path(digest), "rt", encoding="utf-8") as f_in:
+            return f_in.read()
+
+    def runs(self):
+        """List the runs saved."""
+        return sorted(os.listdir(os.path.join(self.directory, "runs"))) \
+            if os.path.isdir(os.path.join(self.directory, "runs")) else []
+
+    def manifest_path(self, run, name):
+        """Get the file one browser session's manifest for a run is saved in."""
+        return os.path.join(self.directory, "runs", run, name + ".json")
+
+    def manifest(self, run):
+        """Get {store path: [hashes]} merged from every session in a run."""
+        paths = sorted(glob.glob(os.path.join(self.directory, "runs", run, "*.json")))
+        if not paths:
+            raise ValueError("no snapshots for run %s in %s" % (run, self.directory))
+        pages = {}
+        for path in paths:
+            with open(path) as f_in:
+                for key, digests in json.load(f_in).items():
+                    pages.setdefault(key, [])
+                    pages[key].extend(digest for digest in digests if digest not in pages[key])
+        return pages
+
+
+class SnapshotRecorder:
+    """Save normalized snapshots of the pages one browser session loads."""
+
+    PAGE_JS = "return [location.href, document.documentElement.outerHTML];"
+
+    def __init__(self, store, run):
+        self.store = store
+        self.run = run
+        # store path to the distinct snapshot hashes seen, in order
+        self.pages = {}
+
+    def snapshot(self, driver):
+        """Save the current page."""
+        url, text = driver.execute_script(self.PAGE_JS)
+        digest = self.store.put(normalize(text))
+        digests = self.pages.setdefault(page_key(url), [])
+        if digest not in digests:
+            digests.append(digest)
+
+    def save(self, name):
+        """Save the manifest of pages seen under a name for this session."""
+        path = self.store.manifest_path(self.run, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f_out:
+            json.dump(self.pages, f_out, indent=2, sort_keys=True)
+
+
+def compare(store, old_run, new_run):
+    """Compare two runs.
+
+    Returns {store path: changes} for pages in both whose snapshots differ
+    (pages loaded in several states are compared state by state), and the
+    lists of paths only in the old and only in the new run.
+    """
+    old, new = store.manifest(old_run), store.manifest(new_run)
+    changed = {}
+    for key in sorted(set(old) & set(new)):
+        if old[key] == new[key]:
+            continue
+        changes = []
+        for old_digest, new_digest in zip(old[key], new[key]):
+            if old_digest != new_digest:
+                changes.extend(diff_pages(store.get(old_digest), store.get(new_digest)))
+        extra = len(new[key]) - len(old[key])
+        if extra:
+            changes.append(("", "%+d page states" % extra))
+        changed[key] = changes
+    return changed, sorted(set(old) - set(new)), sorted(set(new) - set(old))
+
+
+def report(changed, removed, added, limit=20, stream=sys.stdout):
+    """Print the changes from compare by template, then by page."""
+    templates = {}
+    for key in list(changed) + removed + added:
+        templates.setdefault(template_for_path(key), []).append(key)
+    for template, keys in sorted(templates.items()):
+        stream.write("%s: %d pages changed\n" % (template, len(keys)))
+    for key in removed:
+        stream.write("only in old run: /%s\n" % key)
+    for key in added:
+        stream.write("only in new run: /%s\n" % key)
+    for key, changes in sorted(changed.items()):
+        stream.write("\n/%s: %d changes\n" % (key, len(changes)))
+        for path, change in changes[:limit]:
+            stream.write("    %s %s\n" % (path or "/", change))
+        if len(changes) > limit:
+            stream.write("    ... %d more\n" % (len(changes) - limit))
+
+
+def main(argv=None):
+    """List snapshot runs or diff two of them."""
+    parser = argparse.ArgumentParser(
+        prog="python -m tests.snapshots",
+        description="Compare rendered HTML snapshots between test runs.")
+    parser.add_argument("--dir", default=os.getenv("SHOPIFY_TEST_SNAPSHOTS", "snapshots"),
+                        help="directory given as SHOPIFY_TEST_SNAPSHOTS")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("runs", help="list the saved runs")
+    diff_parser = subparsers.add_parser("diff", help="show what changed between two runs")
+    diff_parser.add_argument("old")
+    diff_parser.add_argument("new")
+    diff_parser.add_argument("--limit", type=int, default=20, help="changes to show per page")
+    args = parser.parse_args(argv)
+    store = SnapshotStore(args.dir)
+    if args.command == "runs":
+        for run in store.runs():
+            print("%s: %d pages" % (run, len(store.manifest(run))))
+        return
+    try:
+        changed, removed, added = compare(store, args.old, args.new)
+    except ValueError as err:
+        parser.error(str(err))
+    report(changed, removed, added, args.limit)
+    if changed or removed or added:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -4,28 +4,130 @@ Low-level handling of development store site using Selenium.
 See the StoreClient class for the main part.
 """
 
+import os
 import time
 import logging
 import unittest
+import functools
 import contextlib
 
 # https://selenium-python.readthedocs.io/getting-started.html
 from selenium import webdriver
-from selenium.webdriver import (Chrome, ChromeOptions)
 from selenium.webdriver.common.keys import Keys
 from selenium.common.exceptions import (
     NoSuchElementException,
     StaleElementReferenceException)
 
 from .util import TESTING_CONFIG
+from .drivers import (driver_config, make_driver)
+from .asset_coverage import CoverageRecorder
+from .snapshots import (SnapshotRecorder, SnapshotStore)
+from .planner import (PageState, plan_for)
 
 LOGGER = logging.getLogger(__name__)
 
 
+def record_coverage(driver, restart=False):
+    """Take a coverage snapshot if the driver is recording coverage.
+
+    Call this before anything that leaves the current page (or its window
+    size), and with restart after a navigation.  See asset_coverage.
+    """
+    recorder = getattr(driver, "coverage", None)
+    if recorder:
+        with uncounted(driver):
+            if restart:
+                recorder.start(driver)
+            else:
+                recorder.snapshot(driver)
+
+
+def record_snapshot(driver):
+    """Save a snapshot of the current page if the driver is recording them.
+
+    See snapshots.
+    """
+    recorder = getattr(driver, "snapshots", None)
+    if recorder:
+        with uncounted(driver):
+            recorder.snapshot(driver)
+
+
 class StoreError(Exception):
     """An Exception for store-related errors."""
 
 
+class TagName:
+    """Stand-in for an element's tag name in log messages.
+
+    Getting tag_name costs a round trip to the browser, so this only does it
+    if a log record actually gets formatted (and then just the once).
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, elem):
+        self.elem = elem
+        self.tag_name = None
+
+    def __str__(self):
+        if self.tag_name is None:
+            self.tag_name = self.elem.tag_name
+        return self.tag_name
+
+
+def count_roundtrips(client):
+    """Keep a running count of WebDriver commands in client.roundtrips.
+
+    Every command, including those made through WebElement objects, goes
+    through the driver's execute method, so we wrap that.  Commands made while
+    client.counting is False (see uncounted) are left out.
+    """
+    execute = client.execute
+    def counted_execute(driver_command, params=None):
+        if client.counting:
+            client.roundtrips += 1
+        return execute(driver_command, params)
+    client.roundtrips = 0
+    client.counting = True
+    client.execute = counted_execute
+    return client
+
+
+@contextlib.contextmanager
+def uncounted(driver):
+    """Leave WebDriver commands out of the round-trip count for a while.
+
+    For instrumentation like coverage, so turning it on doesn't push tests
+    over their max_roundtrips budgets.
+    """
+    counting = getattr(driver, "counting", False)
+    driver.counting = False
+    try:
+        yield
+    finally:
+        driver.counting = counting
+
+
+def max_roundtrips(limit):
+    """Decorator failing a StoreClient test that makes too many WebDriver calls.
+
+    Each call is a round trip to the browser, so this keeps the harness helpers
+    from quietly getting slower.  Use like @max_roundtrips(200) on a test
+    method; see StoreClient.tearDown for the per-test counts in the log.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = self.driver.roundtrips
+            result = func(self, *args, **kwargs)
+            used = self.driver.roundtrips - start
+            if used > limit:
+                self.fail("%d WebDriver calls made, over the limit of %d" % (used, limit))
+            return result
+        return wrapper
+    return decorator
+
+
 class StoreClient(unittest.TestCase):
     """Low-level handling for queries to development store website with Selenium.
 
@@ -34,8 +136,22 @@ class StoreClient(unittest.TestCase):
     cache-handling more manageable with unit testing, since a separate test
     case instance is created for each test but it bogs things down too much to
     let each instance start with an empty cache.)
+
+    Since the browser is shared, a test can start on the page the previous one
+    left if the planner allows it; see the planner module and get.
+
+    Normally each class's browser is closed when its tests finish.  Set
+    keep_browser to leave them running (and logged in) between test runs in
+    the same process, as watch mode does, and call quit_all when done.
     """
 
+    keep_browser = False
+    # Per-class overrides of the driver configuration in TESTING_CONFIG, like
+    # {"load_images": False}.  See the drivers module.
+    driver_options = {}
+    # One shared dictionary of driver objects, keyed on class.  See get_driver.
+    clientmap = {}
+
     @classmethod
     def setUpClass(cls):
         LOGGER.info("Setting up StoreSite: %s", str(cls))
@@ -48,14 +164,34 @@ class StoreClient(unittest.TestCase):
     def tearDownClass(cls):
         cls.tear_down_site()
 
+    def setUp(self):
+        self.roundtrips_start = self.driver.roundtrips
+        self.loads_start = self.driver.page_state.loads
+        self.driver.page_state.begin(plan_for(self))
+
+    def tearDown(self):
+        record_coverage(self.driver)
+        self.driver.page_state.end()
+        LOGGER.info(
+            "%s: %d WebDriver calls, %d page loads", self.id(),
+            self.driver.roundtrips - self.roundtrips_start,
+            self.driver.page_state.loads - self.loads_start)
+
     @classmethod
     def set_up_site(cls):
         """Set up client and authenticate with site if needed.
 
-        Call this before interacting with any pages.
+        Call this before interacting with any pages.  If the class already has
+        a live browser session (see keep_browser) this does nothing.
         """
+        warm = cls in cls.clientmap
         driver = cls.get_driver()
         cls.url = "https://" + TESTING_CONFIG["store_site"] + "/"
+        if warm:
+            LOGGER.info("Setting up StoreSite: %s: reusing browser session", str(cls))
+            # The theme may have changed since, so don't reuse the page itself.
+            driver.page_state.discard()
+            return
         driver.get(cls.url)
         LOGGER.info("Setting up StoreSite: %s: loaded %s", str(cls), cls.url)
         try:
@@ -73,16 +209,57 @@ class StoreClient(unittest.TestCase):
                     raise StoreError("login failed")
             else:
                 raise StoreError("No password found in environment variable SHOPIFY_STORE_PASSWORD")
+        # The first test getting the home page can start on this one.
+        driver.page_state.landed(driver.current_url)
+        record_snapshot(driver)
 
     @classmethod
     def tear_down_site(cls):
-        """Clean up after client."""
-        LOGGER.info("Cleaning up StoreSite: %s", str(cls))
+        """Clean up after client.
+
+        If keep_browser is set the browser session is left running for the
+        next time the class is set up.
+        """
+        if cls.keep_browser:
+            LOGGER.info("Keeping browser for StoreSite: %s", str(cls))
+            return
+        LOGGER.info(
+            "Cleaning up StoreSite: %s: %s (%s)", str(cls), cls.get_driver().page_state,
+            PageState.run_totals())
+        cls.save_coverage()
+        cls.save_snapshots()
         # The close method just closes the window.  quit actually quits the
         # browser.  (Possibly I could just del the object, not sure.)
         cls.get_driver().quit()
         del cls.clientmap[cls]
 
+    @classmethod
+    def quit_all(cls):
+        """Quit every browser session, whether kept or not."""
+        for client_cls in list(cls.clientmap):
+            LOGGER.info(
+                "Cleaning up StoreSite: %s: %s (%s)", str(client_cls),
+                cls.clientmap[client_cls].page_state, PageState.run_totals())
+            client_cls.save_coverage()
+            client_cls.save_snapshots()
+            cls.clientmap.pop(client_cls).quit()
+
+    @classmethod
+    def save_coverage(cls):
+        """Save this class's recorded coverage, if any, to the coverage directory."""
+        recorder = getattr(cls.clientmap.get(cls), "coverage", None)
+        if recorder:
+            recorder.save(os.path.join(
+                TESTING_CONFIG["coverage_dir"],
+                "%s-%d.json" % (cls.__name__, os.getpid())))
+
+    @classmethod
+    def save_snapshots(cls):
+        """Save the manifest of this class's page snapshots, if any."""
+        recorder = getattr(cls.clientmap.get(cls), "snapshots", None)
+        if recorder:
+            recorder.save("%s-%d" % (cls.__name__, os.getpid()))
+
     @classmethod
     def get_driver(cls):
         """Get the Selenium driver object for this class.
@@ -93,17 +270,19 @@ class StoreClient(unittest.TestCase):
         of other classes.  These driver objects are initialized as needed when
         they are first referenced via this function.
         """
-        clientmap = getattr(cls, "clientmap", None) or {}
-        cls.clientmap = clientmap
         try:
             client = cls.clientmap[cls]
         except KeyError:
-            # Why did this start being necessary?  Is our Xvfb still working?
-            # https://stackoverflow.com/questions/50642308
-            options = ChromeOptions()
-            options.add_argument("--headless")
-            client = Chrome(options=options)
+            config = driver_config(cls.driver_options, cls.__name__)
+            client = count_roundtrips(make_driver(config))
             client.set_page_load_timeout(TESTING_CONFIG["page_load_timeout"])
+            client.page_state = PageState()
+            if TESTING_CONFIG["coverage_dir"]:
+                client.coverage = CoverageRecorder()
+                record_coverage(client, restart=True)
+            if TESTING_CONFIG["snapshot_dir"]:
+                client.snapshots = SnapshotRecorder(
+                    SnapshotStore(TESTING_CONFIG["snapshot_dir"]), TESTING_CONFIG["snapshot_run"])
             LOGGER.info("No driver for class %s, initialized %s", str(cls), str(client))
             cls.clientmap[cls] = client
         return client
@@ -144,9 +323,12 @@ class StoreClient(unittest.TestCase):
         #  * is_selected
         #  * is_displayed
         #  * is_enabled
-        prefix = "click: " + elem.tag_name + " %s"
-        log = lambda msg: LOGGER.info(prefix, msg)
+        tag_name = TagName(elem)
+        log = lambda msg: LOGGER.info("click: %s %s", tag_name, msg)
         log("click")
+        # The click might navigate, so take coverage first, and a snapshot of
+        # wherever it went after.  (WebElement's parent is its driver.)
+        record_coverage(elem.parent)
         elem.click()
         while tries:
             if checker:
@@ -166,6 +348,7 @@ class StoreClient(unittest.TestCase):
                     tries -= 1
                 except StaleElementReferenceException:
                     log("stale")
+                    record_snapshot(elem.parent)
                     return True
         log("tries exhausted")
         return False
@@ -203,6 +386,7 @@ class StoreClient(unittest.TestCase):
             delay += 0.02
         try:
             yield
+            record_coverage(self.driver)
         finally:
             LOGGER.debug(
                 "restoring original window size of %dx%d",
@@ -244,15 +428,10 @@ class StoreClient(unittest.TestCase):
     def xp(self, xpath, elem=None):
         """Get a single element by xpath."""
         # pylint: disable=invalid-name
-        log = lambda msg: LOGGER.debug("xp: %s", msg)
         time.sleep(TESTING_CONFIG["elem_delay"])
         if elem:
-            try:
-                log("in %s: %s" % (elem.tag_name, xpath))
-            except AttributeError:
-                raise ValueError(
-                    "given elem has no tag_name; Make sure this is a "
-                    "WebElement (and not an xpath string for example).")
+            self._check_elem(elem)
+            LOGGER.debug("xp: in %s: %s", TagName(elem), xpath)
             # As per the docs,
             #      This will select the first link under this element.
             #      myelement.find_element_by_xpath(".//a")
@@ -261,32 +440,54 @@ class StoreClient(unittest.TestCase):
             # So we'll make sure we have a leading dot!!
             xpath = self._relative(xpath)
             return elem.find_element_by_xpath(xpath)
-        log("in page: %s" % xpath)
+        LOGGER.debug("xp: in page: %s", xpath)
         return self.driver.find_element_by_xpath(xpath)
 
     def xps(self, xpath, elem=None):
         """Get a list of elements by xpath."""
-        log = lambda msg: LOGGER.debug("xps: %s", msg)
         time.sleep(TESTING_CONFIG["elem_delay"])
         if elem:
-            try:
-                log("in %s: %s" % (elem.tag_name, xpath))
-            except AttributeError:
-                raise ValueError(
-                    "given elem has no tag_name; Make sure this is a "
-                    "WebElement (and not an xpath string for example).")
+            self._check_elem(elem)
+            LOGGER.debug("xps: in %s: %s", TagName(elem), xpath)
             xpath = self._relative(xpath)
             return elem.find_elements_by_xpath(xpath)
-        log("in page: %s" % xpath)
+        LOGGER.debug("xps: in page: %s", xpath)
         return self.driver.find_elements_by_xpath(xpath)
 
-    def get(self, path=""):
-        """Get a page"""
+    def get(self, path="", fresh=False):
+        """Get a page.
+
+        If the test's plan allows it and the browser is still on a clean copy
+        of the page, it's used as is.  Use fresh to load it regardless (like
+        after resizing the window, when the load itself is what's checked).
+        """
+        url = path if path.startswith("http") else self.url + path
+        if not fresh and self.driver.page_state.reuse(url):
+            LOGGER.info("get: %s (already loaded)", str(path))
+            return
         LOGGER.info("get: %s", str(path))
-        if path.startswith("http"):
-            self.driver.get(path)
-        else:
-            self.driver.get(self.url + path)
+        self.load_page(url)
+
+    @classmethod
+    def load_page(cls, url):
+        """Load a page, recording it for coverage, snapshots, and the planner.
+
+        This always loads the page; tests should use get instead.
+        """
+        driver = cls.get_driver()
+        record_coverage(driver)
+        driver.get(url)
+        driver.page_state.loaded(url)
+        record_coverage(driver, restart=True)
+        record_snapshot(driver)
+
+    @staticmethod
+    def _check_elem(elem):
+        """Make sure elem looks like a WebElement, without asking the browser."""
+        if not hasattr(elem, "find_element_by_xpath"):
+            raise ValueError(
+                "given elem has no find_element_by_xpath; Make sure this is a "
+                "WebElement (and not an xpath string for example).")
 
     @staticmethod
     def _relative(xpath):
@@ -8,6 +8,7 @@ import logging
 import re
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support.expected_conditions import staleness_of
 from selenium.common.exceptions import TimeoutException
 from .store_client import StoreClient
 from .util import (TESTING_CONFIG, get_setting)
@@ -20,6 +21,123 @@ WINDOWSIZES = {
     "large": {"width": 3840, "height": 2160} # My ASUS ZenBook
     }
 
+# How close (in px) the instafeed section gets to the viewport before it
+# loads; see instafeed_margin in js-shop-vars.js.liquid.
+INSTAFEED_MARGIN = 200
+
+# Whether the given instafeed section starts below the point where it'd load,
+# with its image count and any feed script or Instagram requests so far.
+INSTAFEED_STATE_JS = """
+var section = arguments[0];
+return {
+    below: section.getBoundingClientRect().top > window.innerHeight + arguments[1],
+    images: section.querySelectorAll("img").length,
+    requests: performance.getEntriesByType("resource").map(function(entry) {
+        return entry.name;
+    }).filter(function(name) {
+        return /instagram|setup-instafeed/i.test(name);
+    })
+};
+"""
+
+# Seconds to wait for infinite scrolling to append the next page
+PAGINATION_TIMEOUT = 10
+
+# Override the theme's infinite scrolling setting for the rest of the visit
+# with "true" or "false" (see setupInfiniteScroll in js-shop.js)
+PAGINATION_OVERRIDE_JS = """
+sessionStorage.setItem("infinite", arguments[0]);
+"""
+
+# Drop the override so later pages go by the theme setting again
+PAGINATION_RESET_JS = """
+sessionStorage.removeItem("infinite");
+"""
+
+# For execute_async_script: scroll to the bottom of the page and give the ms
+# until items are added to the paginated list, or null after arguments[0] ms.
+PAGINATION_APPEND_JS = """
+var done = arguments[arguments.length - 1];
+var list = document.querySelector("nav.pagination").parentNode;
+var count = list.querySelectorAll(":scope > section").length;
+var start = performance.now();
+var observer = new MutationObserver(function() {
+    if (list.querySelectorAll(":scope > section").length > count) {
+        observer.disconnect();
+        done(performance.now() - start);
+    }
+});
+observer.observe(list, {childList: true});
+setTimeout(function() { observer.disconnect(); done(null); }, arguments[0]);
+window.scrollTo(0, document.body.scrollHeight);
+"""
+
+# Seconds to wait for predictive search results while typing
+SEARCH_TIMEOUT = 5
+
+# Start timing the predictive search under the given search input: when a key
+# last went down, and when the results list last changed.
+SEARCH_TIMING_JS = """
+var input = arguments[0];
+var list = input.form.querySelector(".predictive-search");
+var timing = window.predictiveSearchTiming = {key: 0, shown: 0};
+input.addEventListener("keydown", function() { timing.key = performance.now(); });
+new MutationObserver(function() { timing.shown = performance.now(); }).observe(
+    list, {childList: true, attributes: true});
+"""
+
+# The ms from the last keystroke to the predictive search results showing for
+# the query in arguments[1], or null if they aren't showing yet.
+SEARCH_LATENCY_JS = """
+var list = arguments[0].form.querySelector(".predictive-search");
+var timing = window.predictiveSearchTiming;
+if (list.hidden || list.getAttribute("data-query") != arguments[1] ||
+        timing.shown <= timing.key) {
+    return null;
+}
+return timing.shown - timing.key;
+"""
+
+# Lazy images further than this (in px) below the window should wait until
+# they're scrolled to.  Chrome starts loading them between 1250 and 2500 px
+# away depending on the connection.
+LAZY_DISTANCE = 3000
+
+# Rough ceilings for image bytes fetched before the load event on a product
+# grid: the first row plus whatever's within lazy loading distance, at the
+# srcset sizes each window picks.
+IMAGE_BYTES_BUDGET = {
+    "small": 1000000,
+    "medium": 2500000,
+    "large": 6000000,
+    }
+
+# Image requests finished before the load event, and the page's product
+# images that broke the lazy loading rules: lazy ones far below the window
+# (more than arguments[0] px) that loaded anyway, and high priority ones that
+# didn't load.  Byte counts are encoded body sizes, so cached images count too.
+IMAGE_LOADING_JS = """
+var distance = arguments[0];
+var loaded = performance.getEntriesByType("navigation")[0].loadEventStart;
+var before = performance.getEntriesByType("resource").filter(function(entry) {
+    return entry.responseEnd <= loaded && (entry.initiatorType == "img" ||
+        /\\.(jpe?g|png|gif|webp|avif)(\\?|$)/i.test(entry.name));
+});
+var names = before.map(function(entry) { return entry.name; });
+var images = Array.from(document.querySelectorAll("img[srcset]"));
+return {
+    count: before.length,
+    bytes: before.reduce(function(sum, entry) { return sum + entry.encodedBodySize; }, 0),
+    far: images.filter(function(img) {
+        return img.loading == "lazy" && names.indexOf(img.currentSrc) != -1 &&
+            img.getBoundingClientRect().top > window.innerHeight + distance;
+    }).map(function(img) { return img.currentSrc; }),
+    missing: images.filter(function(img) {
+        return img.getAttribute("fetchpriority") == "high" && !img.complete;
+    }).map(function(img) { return img.src; })
+};
+"""
+
 def rotate(windowsize):
     """Swap width/height on a windowsize dictionary."""
     return {"width": windowsize["height"], "height": windowsize["width"]}
@@ -32,7 +150,7 @@ class ElemsHaveText:
         self.elements = elements
 
     def __call__(self, driver):
-        texts = [el.text for el in self.elements if el.text]
+        texts = [text for text in (el.text for el in self.elements) if text]
         if len(texts) == len(self.elements):
             return self.elements
         return False
@@ -60,18 +178,42 @@ class StoreSite(StoreClient):
     test functions.
     """
 
+    # Whether each store has the testing collection, keyed on store URL.  The
+    # store's content doesn't change during a run, so this is shared by every
+    # class and only checked once.  See has_testing_collection.
+    testing_collection = {}
+
     def is404(self):
         """Did we get a 404 on the most recent request?"""
         return "Page Not Found" in self.driver.title
 
-    def add_to_cart(self, product, variant=None):
-        """Go to a product page and add it to the cart.
+    @classmethod
+    def has_testing_collection(cls):
+        """Does the store have the testing collection?
+
+        The first call in a run loads the collection page to find out, so
+        don't count on being on any particular page after calling this.
+        """
+        if cls.url not in cls.testing_collection:
+            cls.load_page(cls.url + "collections/testing")
+            cls.testing_collection[cls.url] = "Page Not Found" not in cls.get_driver().title
+        return cls.testing_collection[cls.url]
+
+    def add_to_cart(self, product, variant=None, ajax=True):
+        """Go to a product page and add it to the cart, ending on the cart page.
 
         If variant is given, select that variant.  ValueError is raised if the
         given variant isn't found in the page, or if no variant is given but
         variants are available.
+
+        By default this clicks the button as usual, which adds to the cart in
+        the background (see setupAjaxCart in js-shop.js), waits for the bag
+        count in the header to change, and then goes to the cart.  If ajax is
+        False the form is submitted directly instead, skipping the page's
+        handlers like a browser without javascript would, and Shopify takes
+        us to the cart.
         """
-        LOGGER.info("add_to_cart: %s (%s)", product, variant)
+        LOGGER.info("add_to_cart: %s (%s, ajax: %s)", product, variant, ajax)
         self.get("products/" + product)
         if variant:
             label = None
@@ -88,7 +230,19 @@ class StoreSite(StoreClient):
                 raise ValueError(
                     "product %s: no variant given but variants available")
         button = self.xp("//form[@action='/cart/add']/button[@type='submit']")
-        self.click(button)
+        if ajax:
+            cartlink = self.xp("//body/header//a[@href='/cart']")
+            before = cartlink.text
+            # Just the one click, since every click that works adds another
+            button.click()
+            try:
+                WebDriverWait(self.driver, 10).until(lambda driver: cartlink.text != before)
+            except TimeoutException:
+                self.fail("bag count didn't change after adding to cart")
+            self.get("cart")
+        else:
+            self.driver.execute_script("arguments[0].form.submit();", button)
+            WebDriverWait(self.driver, 10).until(staleness_of(button))
         cartlink = self.xp("//body/header//a[@href='/cart']")
         self.assertNotEqual(cartlink.text, "my bag")
 
@@ -130,11 +284,17 @@ class StoreSite(StoreClient):
         self.check_decoration_on_hover(cartlink)
         self.xp(".//form[@action='/search']", header)
         if bagsize > 1:
-            self.assertEqual(cartlink.text, bagsize + " items in bag")
+            expected = "%d items in bag" % bagsize
         elif bagsize == 1:
-            self.assertEqual(cartlink.text, "1 item in bag")
+            expected = "1 item in bag"
         else:
-            self.assertEqual(cartlink.text, "my bag")
+            expected = "my bag"
+        # The count may still be on its way from an AJAX cart update
+        try:
+            WebDriverWait(self.driver, 5).until(lambda driver: cartlink.text == expected)
+        except TimeoutException:
+            pass
+        self.assertEqual(cartlink.text, expected)
 
     def check_page(self, pagename, pagetitle=None, pageclass="page"):
         """Check one of the free-form pages under /pages/..."""
@@ -143,34 +303,113 @@ class StoreSite(StoreClient):
         self.check_for_elem("/html/body/main/article[@class='%s']" % pageclass)
         self.check_instafeed()
 
-    def check_pagination(self):
-        """Check that pagination links work as expected.
+    def check_predictive_search(self, elem, query):
+        """Type a query into a search input and check the type-ahead results.
 
-        This will verify there's no "previous" link to start with, click the
-        first link (which should be for page 2), and then click the previous
-        link.  behavior with multiple pagination elements on the page is not
-        curently defined.
+        The results are timed from the last keystroke to their showing, once
+        for the new query and once more after a backspace and retyping the
+        last character, which should come from the in-page cache.  Returns
+        the two times in ms.
         """
-        log = lambda msg: LOGGER.info("check_pagination: %s", msg)
-        nav = self.xp("//nav[@class='pagination']")
-        log("try for first link elem")
-        first_link = self.try_for_elem("a", elem=nav)
-        log("check that previous is NOT in first link text (\"%s\")" % first_link.text)
-        self.assertFalse("previous" in first_link.text.lower())
-        log("click first link")
-        self.click(first_link)
-        nav = self.xp("//nav[@class='pagination']")
-        log("try for first link elem again")
-        first_link = self.try_for_elem("a", elem=nav)
-        log("check that previous IS in first link text (\"%s\")" % first_link.text)
-        self.assertTrue("previous" in first_link.text.lower())
-        log("click first link again")
-        self.click(first_link)
-        nav = self.xp("//nav[@class='pagination']")
-        log("try for first link elem #3")
-        first_link = self.try_for_elem("a", elem=nav)
-        log("check that previous is NOT in first link text (\"%s\")" % first_link.text)
-        self.assertFalse("previous" in first_link.text.lower())
+        log = lambda msg, *args: LOGGER.info("check_predictive_search: " + msg, *args)
+        self.driver.execute_script(SEARCH_TIMING_JS, elem)
+        latencies = []
+        for keys in (query, Keys.BACKSPACE + query[-1]):
+            elem.send_keys(keys)
+            latencies.append(WebDriverWait(self.driver, SEARCH_TIMEOUT).until(
+                lambda driver: driver.execute_script(SEARCH_LATENCY_JS, elem, query)))
+        log("\"%s\": %.0f ms, %.0f ms cached", query, *latencies)
+        form = self.xp("./ancestor::form", elem)
+        links = self.check_for_elems("ul[@class='predictive-search']/li/a", form)
+        for link in links:
+            self.assertTrue(link.get_attribute("href").startswith(self.url))
+            self.assertTrue(link.text)
+        return latencies
+
+    def check_image_loading(self, path):
+        """Check which images a page fetches before its load event.
+
+        At each of the WINDOWSIZES, product images further than LAZY_DISTANCE
+        below the window should wait to be scrolled to, the first row (marked
+        fetchpriority="high") should have loaded, and the image bytes fetched
+        before the load event should be within IMAGE_BYTES_BUDGET.
+        """
+        orig_size = self.driver.get_window_size()
+        try:
+            for name, size in WINDOWSIZES.items():
+                self.driver.set_window_size(size["width"], size["height"])
+                self.get(path, fresh=True)
+                state = self.driver.execute_script(IMAGE_LOADING_JS, LAZY_DISTANCE)
+                LOGGER.info(
+                    "check_image_loading: /%s at %s: %d images, %d bytes before load",
+                    path, name, state["count"], state["bytes"])
+                self.assertEqual(state["far"], [], "lazy images loaded early at " + name)
+                self.assertEqual(state["missing"], [], "first row not loaded at " + name)
+                self.assertLessEqual(state["bytes"], IMAGE_BYTES_BUDGET[name], name)
+        finally:
+            self.driver.set_window_size(orig_size["width"], orig_size["height"])
+
+    def check_pagination(self):
+        """Check that pagination works with links and with infinite scrolling.
+
+        With infinite scrolling switched off (see setupInfiniteScroll in
+        js-shop.js; if the theme setting has it on, the current page is
+        reloaded to do that) this will verify there's no "previous" link to
+        start with and that the next page is prefetched, click the first link
+        (which should be for page 2), and then click the previous link.  Then,
+        reloaded with it switched on, scrolling to the bottom should append the
+        second page's items and the address should follow them.  The time from
+        reaching the bottom to the items appearing is logged.  behavior with
+        multiple pagination elements on the page is not curently defined.
+        """
+        log = lambda msg, *args: LOGGER.info("check_pagination: " + msg, *args)
+        xp_nav = "//nav[@class='pagination']"
+        url = self.driver.current_url
+        try:
+            if get_setting("pagination_infinite"):
+                log("reload with infinite scrolling off")
+                self.driver.execute_script(PAGINATION_OVERRIDE_JS, "false")
+                self.get(url, fresh=True)
+            nav = self.xp(xp_nav)
+            log("try for first link elem")
+            first_link = self.try_for_elem("a", elem=nav)
+            text = first_link.text
+            log("check that previous is NOT in first link text (\"%s\")", text)
+            self.assertFalse("previous" in text.lower())
+            log("check that the next page is prefetched")
+            prefetch = self.check_for_elem("//link[@rel='prefetch']")
+            next_link = self.check_for_elem("a[@rel='next']", nav)
+            self.assertEqual(prefetch.get_attribute("href"), next_link.get_attribute("href"))
+            log("click first link")
+            self.click(first_link)
+            nav = self.xp(xp_nav)
+            log("try for first link elem again")
+            first_link = self.try_for_elem("a", elem=nav)
+            text = first_link.text
+            log("check that previous IS in first link text (\"%s\")", text)
+            self.assertTrue("previous" in text.lower())
+            log("click first link again")
+            self.click(first_link)
+            nav = self.xp(xp_nav)
+            log("try for first link elem #3")
+            first_link = self.try_for_elem("a", elem=nav)
+            text = first_link.text
+            log("check that previous is NOT in first link text (\"%s\")", text)
+            self.assertFalse("previous" in text.lower())
+            log("reload and scroll to the bottom with infinite scrolling on")
+            self.driver.execute_script(PAGINATION_OVERRIDE_JS, "true")
+            self.get(url, fresh=True)
+            msec = self.driver.execute_async_script(
+                PAGINATION_APPEND_JS, PAGINATION_TIMEOUT * 1000)
+            self.assertIsNotNone(msec, "next page's items not appended")
+            log("next page's items appended %.0f ms after reaching the bottom", msec)
+            self.check_for_elem(xp_nav + "/a[@rel='prev']")
+            self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            log("check that the address follows the items in view")
+            WebDriverWait(self.driver, PAGINATION_TIMEOUT).until(
+                lambda driver: "page=2" in driver.current_url)
+        finally:
+            self.driver.execute_script(PAGINATION_RESET_JS)
 
     def check_product(self, expected):
         """Check the contents of a single product's page"""
@@ -471,6 +710,12 @@ class StoreSite(StoreClient):
         condition = ElemsHaveText(self.xps("//nav//a[@href='/collections/clothing']/../ul/li/a"))
         WebDriverWait(self.driver, 2).until(condition)
         self._check_menu_links("//nav//a[@href='/collections/clothing']/../ul/li/a", links)
+        # Leave the menu as we found it, so the page can be reused (see
+        # planner).
+        if clothing_menu_starts == "none":
+            menu_list = self.xp("//nav//a[@href='/collections/clothing']/../ul")
+            self.xp("//nav//a[@href='/collections/clothing']").click()
+            WebDriverWait(self.driver, 2).until(HasCSSAttr(menu_list, "display", "none"))
 
     def _check_menu_links(self, xpath, links):
         """Helper for checking nav links."""
@@ -506,10 +751,30 @@ class StoreSite(StoreClient):
             self.fail("menu collapse failed")
 
     def check_instafeed(self):
-        """Check for the instafeed images AJAXd from instagram."""
-        if TESTING_CONFIG["check_instafeed"]:
-            elems = self.xps("//section[@id='instafeed']//img")
-            self.assertEqual(len(elems), get_setting("instafeed_limit"))
+        """Check for the instafeed images AJAXd from instagram.
+
+        The feed should only load once its section nears the viewport.  Unless
+        the page is short enough for that to happen right away, check that
+        nothing has loaded yet, then scroll to it and wait for the images
+        (whether fresh from Instagram or from the browser's cached copy).
+        """
+        if not TESTING_CONFIG["check_instafeed"]:
+            return
+        section = self.xp("//section[@id='instafeed']")
+        state = self.driver.execute_script(INSTAFEED_STATE_JS, section, INSTAFEED_MARGIN)
+        if state["below"]:
+            self.assertEqual(state["images"], 0, "instafeed images loaded before scrolling")
+            self.assertEqual(state["requests"], [], "instafeed requests made before scrolling")
+        self.driver.execute_script("arguments[0].scrollIntoView();", section)
+        limit = get_setting("instafeed_limit")
+        loaded = lambda driver: len(section.find_elements_by_xpath(".//img")) >= limit
+        try:
+            WebDriverWait(self.driver, 10).until(loaded)
+        except TimeoutException:
+            pass
+        elems = self.xps(".//img", section)
+        self.driver.execute_script("window.scrollTo(0, 0);")
+        self.assertEqual(len(elems), limit)
 
     def check_snippet_collection(self, paginate=True):
         """Check a product collection within a page."""
@@ -599,11 +864,12 @@ class StoreSite(StoreClient):
     def check_decoration_on_hover(self, elem, value2="underline ", value1="none ",
                                   attr="text-decoration"):
         """Ensure an element's text-decoration (or other CSS) appears on hover."""
-        css = lambda: elem.value_of_css_property(attr)
+        css = elem.value_of_css_property(attr)
         self.assertTrue(
-            css().startswith(value1),
-            "expected CSS property %s to start with %s but saw %s" % (attr, value1, css()))
+            css.startswith(value1),
+            "expected CSS property %s to start with %s but saw %s" % (attr, value1, css))
         self.hover(elem)
+        css = elem.value_of_css_property(attr)
         self.assertTrue(
-            css().startswith(value2),
-            "expected CSS property %s to start with %s but saw %s" % (attr, value2, css()))
+            css.startswith(value2),
+            "expected CSS property %s to start with %s but saw %s" % (attr, value2, css))
@@ -0,0 +1,72 @@
+"""
+Checks for merging, reporting, and pruning saved asset coverage.
+
+These use made-up coverage files rather than a browser or store.
+"""
+
+import io
+import os
+import json
+import tempfile
+import unittest
+from . import asset_coverage
+
+SHEET = "a {color: red}\nb {color: blue}\n@media (x) {c {color: green}}\n"
+SCRIPT = "function used() {\n  return 1;\n}\nfunction unused() {\n  return 2;\n}\nused();\n"
+URL = "https://example.com/cdn/shop/t/1/assets/%s?v=1"
+
+class TestAssetCoverage(unittest.TestCase):
+    """Test suite for asset_coverage."""
+
+    def setUp(self):
+        unused = SCRIPT.index("{\n  return 2;")
+        run1 = {
+            "scripts": {URL % "js-shop.js": {"text": SCRIPT, "unused": [[unused, unused + 14]]}},
+            "sheets": {URL % "style.css": {"text": SHEET, "used": [0]}}}
+        run2 = {
+            "scripts": {},
+            "sheets": {URL % "style.css": {"text": SHEET, "used": [2]}}}
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for idx, data in enumerate([run1, run2]):
+            path = os.path.join(self.tmpdir.name, "run%d.json" % idx)
+            with open(path, "w") as f_out:
+                json.dump(data, f_out)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_intervals(self):
+        """Intervals should cover each run of the value."""
+        self.assertEqual(
+            asset_coverage.intervals(bytearray(b"\x00\x01\x01\x00\x00")),
+            [[0, 1], [3, 5]])
+
+    def test_load(self):
+        """Coverage should merge across files by asset name and text."""
+        scripts, sheets = asset_coverage.load(self.paths)
+        self.assertEqual(sheets, {("style.css", SHEET): {0, 2}})
+        used = scripts[("js-shop.js", SCRIPT)]
+        self.assertEqual(len(asset_coverage.intervals(used)), 1)
+
+    def test_report(self):
+        """The report should list unused rules and code."""
+        scripts, sheets = asset_coverage.load(self.paths)
+        out = io.StringIO()
+        asset_coverage.report(scripts, sheets, stream=out)
+        text = out.getvalue()
+        self.assertIn("style.css: 1 of 3 rules unused", text)
+        self.assertIn("    b\n", text)
+        self.assertIn("js-shop.js: 14 of %d characters never ran" % len(SCRIPT), text)
+
+    def test_prune_js(self):
+        """Only dead functions named nowhere else should be pruned."""
+        scripts, _ = asset_coverage.load(self.paths)
+        used = scripts[("js-shop.js", SCRIPT)]
+        self.assertEqual(
+            asset_coverage.prune_js(SCRIPT, used, SCRIPT),
+            "function used() {\n  return 1;\n}\nused();\n")
+        self.assertEqual(
+            asset_coverage.prune_js(SCRIPT, used, SCRIPT + "\nunused();"),
+            SCRIPT)
@@ -0,0 +1,70 @@
+"""
+Checks for the per-template asset bundling in tools.bundle.
+
+Like test_impact these only read theme files from disk, so they run without
+a browser or store.
+"""
+
+import re
+import unittest
+from tools import bundle
+
+class TestBundle(unittest.TestCase):
+    """Test suite for asset minification and bundle planning."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bundles, cls.snippet, cls.report = bundle.build()
+
+    def test_minify_css(self):
+        """CSS minification should drop comments and space but not strings."""
+        css = '/* note */\na > b ,\nc:hover {\n  color: red;\n  content: " x , y ";\n}\n'
+        self.assertEqual(
+            bundle.minify_css(css),
+            'a>b,c:hover{color:red;content:" x , y "}')
+
+    def test_minify_js(self):
+        """JS minification should keep each statement on its own line."""
+        js = "// note\nfunction f() {\n    var x = 1 // one\n\n    return x\n}\n"
+        self.assertEqual(
+            bundle.minify_js(js),
+            "function f() {\nvar x = 1 // one\nreturn x\n}")
+
+    def test_plan_order(self):
+        """Plans should keep head.liquid's order and only the needed assets."""
+        graph = bundle.ThemeGraph()
+        entries = bundle.head_entries(graph)
+        order = [path for path, _ in entries if path]
+        plan = bundle.plan_template(graph, entries, "templates/cart.liquid")
+        planned = []
+        for group in plan:
+            if group[0] == "bundle":
+                planned.extend(group[2])
+            else:
+                match = bundle.RE_ASSET.search(group[1])
+                if match and graph.asset_path(match.group(1)) in order:
+                    planned.append(graph.asset_path(match.group(1)))
+        self.assertEqual(planned, [path for path in order if path in planned])
+        self.assertIn("assets/style-cart.css", planned)
+        self.assertNotIn("assets/style-product.css", planned)
+        self.assertNotIn("assets/js-hammer.min.js", planned)
+        # Liquid assets are never bundled
+        for group in plan:
+            if group[0] == "bundle":
+                self.assertFalse([path for path in group[2] if path.endswith(".liquid")])
+
+    def test_snippet(self):
+        """The snippet should cover every template and refer to every bundle."""
+        for key in self.report:
+            self.assertIn("{%%- when '%s' %%}" % key, self.snippet)
+        self.assertIn("{%- else %}", self.snippet)
+        referenced = set(re.findall(r"'(bundle-[0-9a-f]+\.min\.(?:css|js))'", self.snippet))
+        self.assertEqual(referenced, set(self.bundles))
+
+    def test_savings(self):
+        """Every template should need fewer requests and bytes when bundled."""
+        for key, counts in self.report.items():
+            before = counts["before"]
+            after = counts["after"]
+            self.assertLess(after["requests"], before["requests"], key)
+            self.assertLess(after["bytes"], before["bytes"], key)
@@ -0,0 +1,152 @@
+"""
+Checks for the markup checks and crawling in tests.crawl.
+
+These use made-up pages shaped like product.liquid and collection_item.liquid
+render them, and a stand-in for the store, without touching the network.
+"""
+
+import asyncio
+import unittest
+import urllib.robotparser
+from . import crawl
+
+BASE = "https://store.example/"
+
+ADDRESS = """
+<section vocab="http://schema.org/" typeof="PostalAddress">
+  <span property="streetAddress">Rennes</span>
+  <span property="addressLocality">Somewhere</span>,
+  <span property="postalCode">12345</span>
+</section>
+"""
+
+PRODUCT = """
+<article vocab="http://schema.org/" typeof="Product" resource="/products/a">
+  <link property="url" href="/products/a">
+  <figure>
+    <a property="image" typeof="ImageObject" href="//cdn.example/a.jpg">
+      <img property="contentUrl" src="//cdn.example/a.jpg" alt="">
+    </a>
+  </figure>
+  <h2 property="name">Thing &amp; <b>more</b></h2>
+  <div property="priceSpecification" about="/products/a?variant=1">
+    <span property="price" content="%s">$10</span>
+    <span property="priceCurrency" content="USD">USD</span>
+  </div>
+  <span property="offers" resource="/products/a?variant=1" typeof="OfferForPurchase">
+    <link property="availability" href="http://schema.org/InStock">
+  </span>
+  <a href="/pages/contact">contact</a>
+</article>
+""" + ADDRESS
+
+COLLECTION = """
+<section vocab="http://schema.org/" typeof="Product">
+  <header>
+    <div property="name">Thing</div>
+    <p property="offers" typeof="OfferForPurchase">
+      <span property="schema:price" content="10.00">$10</span>
+      <span property="schema:priceCurrency">%s</span>
+      <link property="availability" href="http://schema.org/SoldOut">
+    </p>
+  </header>
+  <a property="url" href="/collections/all/products/a#top"><img property="image" src="a.jpg"></a>
+</section>
+<nav class="pagination"><a rel="next" href="/collections/all?page=2&amp;sort_by=price">2</a></nav>
+<a href="/cart">bag</a> <a href="https://elsewhere.example/">away</a>
+""" + ADDRESS
+
+
+class FakeFetcher:
+    """Serves {url: (status, text)}, recording the requests."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+    async def fetch(self, method, url, data=None):
+        """Give the page for a URL, or a 404."""
+        self.requests.append((method, url))
+        status, text = self.pages.get(url, (404, ""))
+        return status, {}, text
+
+    async def close(self):
+        """Nothing to close."""
+
+
+class TestCrawl(unittest.TestCase):
+    """Test suite for crawl."""
+
+    def test_parse_product(self):
+        """Offers should merge with price specifications about the same variant."""
+        links, items, problems = crawl.parse(PRODUCT % "10.00")
+        self.assertEqual(problems, [])
+        self.assertIn("/pages/contact", links)
+        product = items[0]
+        self.assertEqual(product.type, "Product")
+        self.assertEqual(product.properties["name"], ["Thing & more"])
+        offer = product.properties["offers"][0]
+        self.assertEqual(offer.type, "OfferForPurchase")
+        self.assertEqual(offer.properties["price"], ["10.00"])
+        self.assertEqual(offer.properties["availability"], ["http://schema.org/InStock"])
+        self.assertEqual(product.properties["image"][0].properties["contentUrl"],
+                         ["//cdn.example/a.jpg"])
+        self.assertEqual(crawl.check_page("/products/a", items), [])
+
+    def test_check_offers(self):
+        """Malformed prices and currencies should be reported."""
+        _, items, _ = crawl.parse(PRODUCT % "$10")
+        self.assertEqual(crawl.check_page("/products/a", items),
+                         ["OfferForPurchase /products/a?variant=1: bad price '$10'"])
+        _, items, _ = crawl.parse(COLLECTION % "")
+        self.assertEqual(crawl.check_page("/collections/all", items),
+                         ["OfferForPurchase: missing priceCurrency"])
+        _, items, _ = crawl.parse(COLLECTION % "usd")
+        self.assertEqual(crawl.check_page("/collections/all", items),
+                         ["OfferForPurchase: bad priceCurrency 'usd'"])
+
+    def test_expected_types(self):
+        """A template's pages should have its expected items."""
+        _, items, problems = crawl.parse("<p>nothing</p>")
+        self.assertEqual(problems, [])
+        self.assertEqual(crawl.check_page("/search?q=a", items), ["no SearchResultsPage"])
+        _, _, problems = crawl.parse('<div typeof="Product"></div>')
+        self.assertEqual(problems, ["Product outside the schema.org vocab"])
+
+    def test_normalize(self):
+        """Crawl URLs should drop anything that shows the same content."""
+        page = BASE + "collections/all"
+        self.assertEqual(crawl.normalize("/collections/all/products/a#top", page, BASE),
+                         BASE + "products/a")
+        self.assertEqual(crawl.normalize("?page=2&sort_by=price", page, BASE),
+                         BASE + "collections/all?page=2")
+        self.assertEqual(crawl.normalize("?page=1", page, BASE), page)
+        self.assertIsNone(crawl.normalize("https://elsewhere.example/", page, BASE))
+        self.assertIsNone(crawl.normalize("mailto:a@store.example", page, BASE))
+
+    def test_interval(self):
+        """The request interval should honor robots.txt's delays."""
+        robots = urllib.robotparser.RobotFileParser()
+        robots.parse(["User-agent: *", "Crawl-delay: 2", "Request-rate: 1/4"])
+        self.assertEqual(crawl.interval(robots), 4)
+        self.assertEqual(crawl.interval(robots, 10), 10)
+
+    def test_crawl(self):
+        """The crawl should follow store pages, check others, and skip disallowed ones."""
+        fetcher = FakeFetcher({
+            BASE + "robots.txt": (200, "User-agent: *\nDisallow: /cart\n"),
+            BASE: (200, '<a href="/collections/all">all</a><a href="/pages/gone">x</a>'
+                        + ADDRESS),
+            BASE + "collections/all": (200, COLLECTION % "USD"),
+            BASE + "collections/all?page=2": (200, COLLECTION % "USD"),
+            BASE + "products/a": (200, PRODUCT % "10.00"),
+            BASE + "pages/contact": (200, "<p>hi</p>"),
+            })
+        crawler = crawl.Crawler(BASE, fetcher, concurrency=3)
+        asyncio.run(crawler.crawl())
+        self.assertEqual(crawler.broken(), {BASE + "pages/gone": (404, [BASE])})
+        self.assertEqual(crawler.problems, {BASE + "pages/contact": ["no PostalAddress"]})
+        self.assertEqual(crawler.disallowed, {BASE + "cart"})
+        self.assertEqual(crawler.templates["templates/collection.liquid"], 2)
+        self.assertEqual(len(fetcher.requests), len(set(fetcher.requests)))
+        self.assertNotIn(("GET", "https://elsewhere.example/"), fetcher.requests)
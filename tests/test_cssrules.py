@@ -0,0 +1,45 @@
+"""
+Checks for the CSS rule parsing used by the critical CSS tool.
+
+These run on strings and the stylesheets on disk, without a browser or store.
+"""
+
+import glob
+import unittest
+from . import cssrules
+
+class TestCSSRules(unittest.TestCase):
+    """Test suite for cssrules parsing and serializing."""
+
+    def test_parse(self):
+        """Rules should come out in order with their enclosing conditions."""
+        text = (
+            '@import "a;b.css";\n/* c{ */ a:hover, b > c::before {color: red; content: "}"}\n'
+            '@media (x) { @supports (y) { p {a: b} } q {c: d} }\n@font-face {font-family: x}')
+        self.assertEqual(cssrules.parse(text), [
+            cssrules.Rule((), '@import "a;b.css"', None),
+            cssrules.Rule((), "a:hover, b > c::before", 'color: red; content: "}"'),
+            cssrules.Rule(("@media (x)", "@supports (y)"), "p", "a: b"),
+            cssrules.Rule(("@media (x)",), "q", "c: d"),
+            cssrules.Rule((), "@font-face", "font-family: x")])
+
+    def test_serialize(self):
+        """Serializing and parsing again should give the same rules."""
+        for path in glob.glob("assets/*.css*"):
+            with open(path) as f_in:
+                rules = cssrules.parse(f_in.read())
+            self.assertTrue(rules, path)
+            self.assertEqual(cssrules.parse(cssrules.serialize(rules)), rules, path)
+
+    def test_static_selector(self):
+        """Selectors should lose state-dependent pseudo-classes and elements."""
+        selectors = cssrules.split_selectors('a:hover, b > c::before, :focus, x[a=","]')
+        self.assertEqual(
+            [cssrules.static_selector(selector) for selector in selectors],
+            ["a", "b > c", "*", 'x[a=","]'])
+
+    def test_absolute_urls(self):
+        """Relative url() references should resolve against the stylesheet."""
+        self.assertEqual(
+            cssrules.absolute_urls("background: url('img.svg')", "https://cdn.example/t/a.css?v=1"),
+            "background: url('https://cdn.example/t/img.svg')")
@@ -0,0 +1,62 @@
+"""
+Checks for collecting characters and reading font stylesheets in tools.fonts.
+
+These read theme files and made-up stylesheets, without subsetting anything
+or touching the network.
+"""
+
+import unittest
+from tools import fonts
+
+CSS = """
+/* [0] */
+@font-face {
+  font-family: 'Nanum Myeongjo';
+  src: url(https://fonts.example/a.woff2) format('woff2');
+  unicode-range: U+ac00-ac0f, U+20??;
+}
+/* [1] */
+@font-face {
+  font-family: 'Nanum Myeongjo';
+  src: url(https://fonts.example/b.woff2) format('woff2');
+  unicode-range: U+0000-00FF, U+0131;
+}
+"""
+
+class TestFonts(unittest.TestCase):
+    """Test suite for fonts."""
+
+    def test_markup_text(self):
+        """Only visible text should be left from Liquid and HTML."""
+        text = fonts.markup_text(
+            "{% comment %}zzz{% endcomment %}<p class=\"qqq\">A {{ x.y }}&mdash;B</p>{% if w %}")
+        self.assertEqual(text.split(), ["A", "—B"])
+
+    def test_collect(self):
+        """The theme's own text should be covered, but not its markup."""
+        chars = fonts.collect()
+        self.assertIn("✘", chars)  # the cart's remove link
+        self.assertIn("—", chars)  # &mdash; in the page title
+        self.assertEqual(chars, "".join(sorted(set(chars))))
+
+    def test_unicode_ranges(self):
+        """Ranges, single code points, and wildcards should all parse."""
+        self.assertEqual(
+            fonts.unicode_ranges("U+ac00-ac0f, U+20??, U+0131"),
+            [(0xac00, 0xac0f), (0x2000, 0x20ff), (0x131, 0x131)])
+
+    def test_needed_faces(self):
+        """Only the slices covering some character should be needed."""
+        faces = fonts.font_faces(CSS)
+        self.assertEqual(len(faces), 2)
+        self.assertEqual(fonts.needed_faces(faces, "abc"), ["https://fonts.example/b.woff2"])
+        self.assertEqual(
+            fonts.needed_faces(faces, "a—"),
+            ["https://fonts.example/a.woff2", "https://fonts.example/b.woff2"])
+
+    def test_snippet(self):
+        """The snippet should preload the font it declares."""
+        text = fonts.snippet_text()
+        self.assertIn('rel="preload"', text)
+        self.assertIn("font-display:swap", text)
+        self.assertEqual(text.count("{{ 'font-nanum-myeongjo.woff2' | asset_url }}"), 2)
@@ -0,0 +1,155 @@
+"""
+Checks for building HAR logs and finding fixes in them in tests.har.
+
+These use made-up DevTools events and page loads, without a browser.
+"""
+
+import io
+import unittest
+from . import har
+
+STORE = "https://shop.example/"
+JQUERY = "https://ajax.googleapis.com/ajax/libs/jquery/3.2.1/jquery.min.js"
+HEAD = """<script src="//ajax.googleapis.com/ajax/libs/jquery/3.2.1/jquery.min.js"></script>
+<script src="{{ 'js-shop.js' | asset_url }}"></script>"""
+
+
+def timing(dns=-1, connect=-1):
+    """DevTools timing for a request sent at 0, with optional connection setup."""
+    setup = max(0, dns) + max(0, connect)
+    return {"requestTime": 0, "dnsStart": 0 if dns >= 0 else -1, "dnsEnd": dns,
+            "connectStart": dns if connect >= 0 else -1, "connectEnd": setup,
+            "sslStart": -1, "sslEnd": -1, "sendStart": setup, "sendEnd": setup,
+            "receiveHeadersEnd": setup + 10}
+
+
+def events(request_id, url, start, end, **kwargs):
+    """DevTools events for one request, times in seconds."""
+    response = {"status": 200, "headers": kwargs.get("headers", {}),
+                "mimeType": kwargs.get("mime", "text/html"), "timing": kwargs.get("timing")}
+    return [
+        {"method": "Network.requestWillBeSent", "params": {
+            "requestId": request_id, "timestamp": start, "wallTime": 1e9 + start,
+            "type": kwargs.get("kind", "Document"),
+            "initiator": kwargs.get("initiator", {"type": "other"}),
+            "request": {"url": url, "method": "GET", "headers": {},
+                        "initialPriority": kwargs.get("priority", "VeryHigh")}}},
+        {"method": "Network.responseReceived", "params": {
+            "requestId": request_id, "response": response}},
+        {"method": "Network.dataReceived", "params": {
+            "requestId": request_id, "dataLength": kwargs.get("size", 5000)}},
+        {"method": "Network.loadingFinished", "params": {
+            "requestId": request_id, "timestamp": end,
+            "encodedDataLength": kwargs.get("transfer", 2000)}},
+        ]
+
+
+def entry(url, start, end, kind="Script", **kwargs):
+    """A HAR entry as to_har makes, times in ms."""
+    headers = kwargs.get("headers", {"cache-control": "max-age=31536000",
+                                     "content-encoding": "gzip"})
+    return {
+        "request": {"url": url, "method": "GET"},
+        "response": {
+            "status": 200, "headers": har.header_list(headers),
+            "content": {"size": kwargs.get("size", 5000),
+                        "mimeType": kwargs.get("mime", "application/javascript")},
+            "_transferSize": kwargs.get("transfer", 2000)},
+        "timings": kwargs.get("timings", {"dns": -1, "connect": -1}),
+        "time": end - start, "_start": start, "_end": end, "_resourceType": kind,
+        "_initiator": kwargs.get("initiator", STORE), "_initiatorType": "parser",
+        "_priority": kwargs.get("priority", "High"), "_renderBlocking": None,
+        "_fromCache": False}
+
+
+def page(key, entries, images=()):
+    """A (page, entries) pair as load gives."""
+    return ({"id": key, "startedDateTime": key, "_images": list(images)}, entries)
+
+
+class TestHar(unittest.TestCase):
+    """Test suite for har."""
+
+    def test_to_har(self):
+        """DevTools events should become HAR entries timed from the first request."""
+        log = har.to_har(
+            events("1", STORE, 10.0, 10.2, timing=timing(dns=20, connect=30)) +
+            events("2", STORE + "style.css", 10.25, 10.4, kind="Stylesheet",
+                   initiator={"type": "parser", "url": STORE}) +
+            events("3", "data:image/png;base64,xx", 10.3, 10.3) +
+            events("4", STORE + "font.woff2", 10.45, 10.5, kind="Font", initiator={
+                "type": "script", "stack": {"callFrames": [{"url": ""}], "parent": {
+                    "callFrames": [{"url": STORE + "js-shop.js"}]}}}),
+            "index", STORE, {"paint": {"first-paint": 300}, "blocking": {
+                STORE + "style.css": "blocking"}})["log"]
+        self.assertEqual(log["pages"][0]["_paint"], {"first-paint": 300})
+        doc, style, font = log["entries"]
+        self.assertEqual((doc["_start"], round(doc["_end"])), (0, 200))
+        self.assertEqual((doc["timings"]["dns"], doc["timings"]["connect"]), (20, 30))
+        self.assertEqual(doc["response"]["content"]["size"], 5000)
+        self.assertEqual(doc["response"]["_transferSize"], 2000)
+        self.assertEqual(style["_renderBlocking"], "blocking")
+        self.assertEqual(style["_initiator"], STORE)
+        self.assertEqual(font["_initiator"], STORE + "js-shop.js")
+
+    def test_render_blocking(self):
+        """Blocking requests should be credited with what they hold up."""
+        entries = [
+            entry(STORE, 0, 100, "Document", mime="text/html"),
+            entry(STORE + "style.css", 110, 200, "Stylesheet", mime="text/css",
+                  priority="VeryHigh"),
+            entry(JQUERY, 110, 400, initiator=STORE,
+                  timings={"dns": 40, "connect": 80}),
+            entry(STORE + "js-shop.js", 110, 180),
+            entry(STORE + "js-async.js", 110, 900, priority="Low"),
+            ]
+        fixes = {(fix["kind"], fix["subject"]): fix
+                 for fix in har.analyze([page("index", entries)], HEAD)}
+        self.assertEqual(fixes[("render-blocking", "all 2 scripts")]["total"], 200)
+        # The stylesheet is done before the scripts anyway
+        self.assertNotIn(("render-blocking", "all 1 stylesheets"), fixes)
+        jquery = fixes[("render-blocking", "ajax.googleapis.com/jquery.min.js")]
+        self.assertEqual(jquery["total"], 200)
+        self.assertIn("in snippets/head.liquid", jquery["advice"])
+        self.assertEqual(fixes[("gating", "ajax.googleapis.com/jquery.min.js")]["total"], 220)
+        self.assertEqual(fixes[("connection", "https://ajax.googleapis.com")]["total"], 120)
+        self.assertNotIn(("render-blocking", "shop.example/js-async.js"), fixes)
+
+    def test_other_checks(self):
+        """Chains, duplicates, headers, and oversized images should be found."""
+        css = STORE + "style.css?v=1"
+        font = "https://fonts.example/a.woff2"
+        index = [
+            entry(STORE, 0, 100, "Document", mime="text/html",
+                  headers={"cache-control": "no-cache"}),
+            entry(css, 100, 300, "Stylesheet", mime="text/css", size=50000,
+                  headers={"cache-control": "max-age=60"}),
+            entry(font, 320, 400, "Font", mime="font/woff2", initiator=css),
+            entry(STORE + "big.jpg", 100, 600, "Image", mime="image/jpeg",
+                  transfer=180000, priority="Low"),
+            ]
+        product = [
+            entry(STORE + "products/x", 0, 100, "Document", mime="text/html"),
+            entry(css, 100, 250, "Stylesheet", mime="text/css", size=50000,
+                  headers={"cache-control": "max-age=60"}),
+            entry(STORE + "style.css?v=2", 100, 200, "Stylesheet", mime="text/css", size=50000),
+            ]
+        images = [{"url": STORE + "big.jpg", "natural": [2000, 1000], "shown": [1000, 500]}]
+        fixes = {(fix["kind"], fix["subject"]): fix for fix in har.analyze(
+            [page("index", index, images), page("product", product)])}
+        chain = fixes[(
+            "chain", "shop.example/ -> shop.example/style.css -> fonts.example/a.woff2")]
+        self.assertEqual(chain["templates"], {"index": 220})
+        self.assertEqual(fixes[("duplicate", "shop.example/style.css?v=1")]["templates"],
+                         {"product": 150})
+        self.assertIn("same file as", fixes[("duplicate", "shop.example/style.css?v=2")]["advice"])
+        self.assertAlmostEqual(fixes[("compression", "shop.example/style.css")]["total"],
+                               har.transfer_ms(35000) * 2)
+        self.assertIn("max-age=60", fixes[("caching", "shop.example/style.css")]["advice"])
+        self.assertNotIn(("caching", "shop.example/"), fixes)
+        self.assertAlmostEqual(fixes[("oversized-image", "shop.example/big.jpg")]["total"],
+                               har.transfer_ms(180000 * 0.75))
+        stream = io.StringIO()
+        har.report(har.analyze([page("index", index, images)]), stream)
+        self.assertIn("  1. ", stream.getvalue())
+        self.assertIn("index", stream.getvalue().split("\n\n")[1])
@@ -0,0 +1,76 @@
+"""
+Checks for the product image format benchmark in tools.images.
+
+These use product_img.liquid on disk and made-up measurements, without a
+store.  The metric checks need numpy and are skipped without it.
+"""
+
+import unittest
+from tools import images
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SUMMARY = {
+    ("jpg", 600): {"bytes": 50000, "ssim": 0.98},
+    ("jpg", 1200): {"bytes": 150000, "ssim": 0.98},
+    ("webp", 600): {"bytes": 30000, "ssim": 0.975},
+    ("webp", 1200): {"bytes": 90000, "ssim": 0.96},
+    ("png", 600): {"bytes": 300000, "ssim": 1.0},
+    ("png", 1200): {"bytes": 900000, "ssim": 1.0},
+    }
+
+class TestImages(unittest.TestCase):
+    """Test suite for images."""
+
+    def test_srcset(self):
+        """Widths and sizes should come from product_img.liquid."""
+        self.assertEqual(images.srcset_widths(), [600, 800, 1200, 2400, 4472])
+        sizes = images.sizes_by_context()
+        self.assertEqual(sizes[None], "100vw")
+        self.assertEqual(sizes["cart"], "30vw")
+        self.assertIn("collection", sizes)
+
+    def test_slot_width(self):
+        """The first matching size should apply, like a browser does."""
+        sizes = "(min-width: 1500px) 50vw, (min-width: 800px) 100vw, 200vw"
+        self.assertEqual(images.slot_width(sizes, 3840), 1920)
+        self.assertEqual(images.slot_width(sizes, 1024), 1024)
+        self.assertEqual(images.slot_width(sizes, 320), 640)
+        self.assertEqual(images.pick_width([600, 1200, 2400], 1024), 1200)
+        self.assertEqual(images.pick_width([600, 1200, 2400], 5000), 2400)
+
+    def test_variant_url(self):
+        """Variant URLs should replace any width or format already there."""
+        self.assertEqual(
+            images.variant_url("//cdn.example/a.jpg?v=1&width=100", 600, "webp"),
+            "https://cdn.example/a.jpg?v=1&width=600&format=webp")
+
+    def test_recommend(self):
+        """The smallest format good enough at every width should win."""
+        best, per_width = images.recommend(SUMMARY)
+        self.assertEqual(best, "jpg")
+        self.assertEqual(per_width, {600: "webp", 1200: "jpg"})
+        self.assertEqual(images.recommend(SUMMARY, 0.95)[0], "webp")
+
+    def test_page_weights(self):
+        """Page weights should count each template's images at its picked width."""
+        weights = images.page_weights(SUMMARY, "jpg", per_page=10)
+        self.assertEqual(weights[("product", "small")], 50000)
+        self.assertEqual(weights[("collection", "medium")], 10 * 150000)
+        self.assertEqual(weights[("cart", "large")], 2 * 150000)
+
+    @unittest.skipUnless(numpy, "needs numpy")
+    def test_metrics(self):
+        """Identical images should score perfectly and noise should cost."""
+        rng = numpy.random.default_rng(0)
+        # Smooth gradients, like a photo, where noise shows
+        rows, cols = numpy.mgrid[0:32, 0:48]
+        img = numpy.stack([cols * 5, rows * 7, (cols + rows) * 2.5], -1).astype(float)
+        noisy = numpy.clip(img + rng.normal(0, 20, img.shape), 0, 255)
+        self.assertAlmostEqual(images.ssim(img, img), 1.0)
+        self.assertEqual(images.psnr(img, img), float("inf"))
+        self.assertLess(images.ssim(img, noisy), 0.9)
+        self.assertLess(images.psnr(img, noisy), 30)
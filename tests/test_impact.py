@@ -0,0 +1,100 @@
+"""
+Checks for test impact selection.
+
+These only read the theme files and test modules on disk, so unlike the
+StoreSite-based cases they run without a browser or store.
+"""
+
+import os
+import ast
+import tempfile
+import unittest
+from . import impact
+
+class TestImpact(unittest.TestCase):
+    """Test suite for the theme dependency graph and test selection."""
+
+    def test_template_for_path(self):
+        """Store paths should map to the templates Shopify would render."""
+        cases = {
+            "": "templates/index.liquid",
+            "cart": "templates/cart.liquid",
+            "/search?q=ichi": "templates/search.liquid",
+            "search?view=json&q=ichi": "templates/search.json.liquid",
+            "collections": "templates/list-collections.liquid",
+            "collections/new": "templates/collection.liquid",
+            "collections/testing/products/variants": "templates/product.liquid",
+            "products/variants": "templates/product.liquid",
+            "pages/about": "templates/page.columns.liquid",
+            "pages/faq": "templates/page.liquid",
+            "does-not-exist": "templates/404.liquid"}
+        for path, template in cases.items():
+            self.assertEqual(impact.template_for_path(path), template, path)
+
+    def test_closure(self):
+        """Template closures should follow layout, includes, and scoped assets."""
+        graph = impact.ThemeGraph()
+        cart = graph.closure("templates/cart.liquid")
+        self.assertIn("layout/theme.liquid", cart)
+        self.assertIn("snippets/head.liquid", cart)
+        self.assertIn("snippets/cart_item.liquid", cart)
+        self.assertIn("snippets/product_img.liquid", cart)
+        self.assertIn("assets/style.css", cart)
+        self.assertIn("assets/style-cart.css", cart)
+        self.assertNotIn("assets/style-product.css", cart)
+        self.assertIn("assets/img-search.svg", cart)
+        product = graph.closure("templates/product.liquid")
+        self.assertIn("assets/style-product.css", product)
+        self.assertIn("assets/js-mlpopup.js", product)
+        self.assertNotIn("assets/style-cart.css", product)
+
+    def test_select_tests(self):
+        """Changed files should select just the tests that render them."""
+        self.assertEqual(
+            impact.select_tests(["assets/style-cart.css"]),
+            {"TestSite.test_template_cart", "TestSite.test_template_cart_items"})
+        selected = impact.select_tests(["snippets/product_img.liquid"])
+        self.assertIn("TestSiteProducts.test_template_product_variants", selected)
+        self.assertIn("TestSite.test_template_collection", selected)
+        self.assertNotIn("TestSite.test_page_faq", selected)
+        selected = impact.select_tests(["assets/js-mlpopup.js"])
+        self.assertIn("TestSiteMailingList.test_mailing_list_popup", selected)
+        self.assertNotIn("TestSite.test_template_404", selected)
+        self.assertEqual(impact.select_tests(["README.md"]), set())
+        everything = set(impact.test_names())
+        self.assertEqual(impact.select_tests(["config/settings_schema.json"]), everything)
+        self.assertEqual(impact.select_tests(["tests/store_site.py"]), everything)
+
+    def test_template_pages(self):
+        """Every template with a layout should get a path that renders it."""
+        pages = impact.template_pages()
+        graph = impact.ThemeGraph()
+        for template in graph.templates():
+            key = os.path.basename(template)[:-len(".liquid")]
+            if graph.layouts[template]:
+                for path in pages[key]:
+                    self.assertEqual(impact.template_for_path(path), template, path)
+            else:
+                self.assertNotIn(key, pages)
+        self.assertEqual(pages["page.gallery"], [pages["page"][0] + "?view=gallery"])
+
+    def test_template_pages_missing(self):
+        """Templates with no path should be named in the error."""
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, "templates"))
+            for name in ("index", "gift_card"):
+                with open(os.path.join(root, "templates", name + ".liquid"), "w") as f_out:
+                    f_out.write("")
+            with self.assertRaisesRegex(ValueError, "gift_card"):
+                impact.template_pages(root)
+
+    def test_paths_cover_tests(self):
+        """Every test method in the test modules should have a TEST_PATHS entry."""
+        for path, clsname in impact.TEST_MODULES.items():
+            with open(path) as f_in:
+                tree = ast.parse(f_in.read())
+            for node in ast.walk(tree):
+                if isinstance(node, ast.ClassDef) and node.name == clsname:
+                    for item in node.body:
+                        if isinstance(item, ast.FunctionDef) and item.name.startswith("test"):
+                            self.assertIn(clsname + "." + item.name, impact.TEST_PATHS)
@@ -0,0 +1,110 @@
+"""
+Checks for recording, serving, and replaying journeys in tests.load.
+
+The journeys are recorded from a made-up store and replayed against the
+local stand-in for a moment, so nothing leaves this machine.
+"""
+
+import io
+import asyncio
+import tempfile
+import unittest
+from . import crawl
+from . import load
+from .test_crawl import FakeFetcher
+
+BASE = "https://store.example/"
+
+PRODUCT = """
+<input type="radio" disabled="true" name="id" id="1" value="1">
+<input type="radio" name="id" id="2" value="2" checked>
+<input type="radio" name="id" id="3" value="3">
+"""
+
+RESULTS = {
+    "elapsed": 10, "journeys": 50, "failed": 0, "journeys_per_s": 5, "requests_per_s": 40,
+    "steps": {
+        "product": {"count": 100, "errors": 0, "bytes": 20000, "p50": 20, "p90": 30,
+                    "p95": 40, "p99": 60},
+        "cart/add.js": {"count": 50, "errors": 0, "bytes": 500, "p50": 5, "p90": 8,
+                        "p95": 9, "p99": 12},
+        }}
+
+
+def store_pages(product):
+    """Get the pages of a made-up store for a journey to product."""
+    return {
+        BASE: (200, "<p>index</p>"),
+        BASE + load.COLLECTION: (200, '<a rel="next" href="?page=2">2</a>'),
+        BASE + load.COLLECTION + "?page=2": (200, "<p>page 2</p>"),
+        BASE + product: (200, PRODUCT),
+        BASE + product + "?variant=2": (200, PRODUCT),
+        BASE + "cart/add.js": (200, '{"id": 2}'),
+        BASE + "cart.js": (200, '{"item_count": 1}'),
+        BASE + "cart": (200, "<p>cart</p>"),
+        BASE + "cart/change.js": (200, '{"item_count": 2}'),
+        }
+
+
+class TestLoad(unittest.TestCase):
+    """Test suite for load."""
+
+    def test_pick_variant(self):
+        """The first variant that isn't sold out should be picked."""
+        self.assertEqual(load.pick_variant(PRODUCT), "2")
+        self.assertIsNone(
+            load.pick_variant('<input type="radio" disabled="true" name="id" value="1">'))
+
+    def test_label(self):
+        """Pages should count by template and cart requests by endpoint."""
+        self.assertEqual(load.label(""), "index")
+        self.assertEqual(load.label("collections/testing?page=2"), "collection")
+        self.assertEqual(load.label("collections/testing/products/a?variant=2"), "product")
+        self.assertEqual(load.label("cart/add.js"), "cart/add.js")
+
+    def test_percentile(self):
+        """Percentiles should be nearest-rank."""
+        values = list(range(1, 101))
+        self.assertEqual(load.percentile(values, 50), 50)
+        self.assertEqual(load.percentile(values, 95), 95)
+        self.assertEqual(load.percentile([7], 99), 7)
+
+    def test_compare(self):
+        """Slower, bigger, or failing steps should be regressions, noise shouldn't."""
+        stream = io.StringIO()
+        self.assertTrue(load.compare(RESULTS, RESULTS, stream))
+        slower = {**RESULTS, "steps": {**RESULTS["steps"], "product": {
+            **RESULTS["steps"]["product"], "p95": 60, "bytes": 25000}}}
+        self.assertFalse(load.compare(slower, RESULTS, stream))
+        self.assertIn("product: p95 60.0ms, was 40.0ms", stream.getvalue())
+        self.assertIn("product: 25000 bytes, was 20000", stream.getvalue())
+        # 9 to 12ms is over TOLERANCE but under MIN_DELTA_MS
+        noisy = {**RESULTS, "steps": {**RESULTS["steps"], "cart/add.js": {
+            **RESULTS["steps"]["cart/add.js"], "p95": 12}}}
+        self.assertTrue(load.compare(noisy, RESULTS, io.StringIO()))
+
+    def test_replay(self):
+        """Recorded journeys should replay against the stand-in without errors."""
+        product = load.JOURNEY_PRODUCTS[0]
+        fetcher = FakeFetcher(store_pages(product))
+        with tempfile.TemporaryDirectory() as directory:
+            manifest = asyncio.run(load.record(
+                BASE, directory, [product], get_fetcher=lambda _: fetcher))
+            self.assertEqual(len(manifest), 9)
+            self.assertIn(("POST", BASE + "cart/change.js"), fetcher.requests)
+            server = load.serve(directory)
+            try:
+                base = "http://127.0.0.1:%d/" % server.server_address[1]
+                results = asyncio.run(load.run(
+                    base, concurrency=2, duration=0.2, products=[product],
+                    get_fetcher=crawl.ThreadFetcher))
+            finally:
+                server.shutdown()
+                server.server_close()
+        self.assertGreater(results["journeys"], 0)
+        self.assertEqual(results["failed"], 0)
+        self.assertEqual(set(results["steps"]), {
+            "index", "collection", "product", "cart", "cart.js", "cart/add.js",
+            "cart/change.js"})
+        self.assertTrue(all(step["errors"] == 0 for step in results["steps"].values()))
+        self.assertEqual(results["steps"]["cart.js"]["bytes"], len('{"item_count": 1}'))
@@ -0,0 +1,128 @@
+"""
+Checks for test ordering and page reuse in tests.planner.
+
+These use stand-in test cases and no browser.
+"""
+
+import sys
+import unittest
+from . import planner
+from .planner import (readonly, mutating)
+
+
+class FakeDriver:
+    """Just the page_state of a WebDriver."""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.page_state = planner.PageState()
+
+
+class Planned(unittest.TestCase):
+    """Stand-in browser tests, not run directly."""
+
+    __test__ = False
+    driver = FakeDriver()
+
+    def test_a_cart(self):
+        """Undeclared."""
+
+    @mutating("cart")
+    def test_b_checkout(self):
+        """Mutating."""
+
+    @readonly("pages/faq")
+    def test_c_faq(self):
+        """Readonly, on another page."""
+
+    @readonly()
+    def test_d_index(self):
+        """Readonly."""
+
+    @readonly()
+    def test_e_index_again(self):
+        """Readonly, failing."""
+        raise ValueError("oops")
+
+    @mutating("pages/faq", page_only=True)
+    def test_f_faq_form(self):
+        """Mutating just the page."""
+
+
+class Other(unittest.TestCase):
+    """More stand-in browser tests, not run directly."""
+
+    __test__ = False
+
+    @readonly()
+    def test_index(self):
+        """Readonly."""
+
+
+def load_tests(loader, tests, pattern):
+    """Leave out the stand-in test cases when unittest loads this module.
+
+    (pytest skips them on seeing __test__.)
+    """
+    # pylint: disable=unused-argument
+    return loader.loadTestsFromTestCase(TestPlanner)
+
+
+class TestPlanner(unittest.TestCase):
+    """Test suite for planner."""
+
+    def test_order(self):
+        """Readonly tests should come first by page, and mutating ones last.
+
+        Those only changing their page should follow the readonly tests on it.
+        """
+        names = planner.PlannedLoader().getTestCaseNames(Planned)
+        self.assertEqual(names, [
+            "test_d_index", "test_e_index_again", "test_c_faq", "test_f_faq_form",
+            "test_a_cart", "test_b_checkout"])
+
+    def test_order_names(self):
+        """Tests loaded by name should be ordered but stay together by class."""
+        module = sys.modules[__name__]
+        suite = planner.PlannedLoader().loadTestsFromNames(
+            ["Planned.test_b_checkout", "Other", "Planned.test_d_index"], module)
+        self.assertEqual([test.id().split(".", 2)[2] for test in suite], [
+            "Planned.test_d_index", "Planned.test_b_checkout", "Other.test_index"])
+
+    def test_reuse(self):
+        """Only clean pages should be reused, and only at the start of a mutating test."""
+        run_loads, run_reused = planner.PageState.run_loads, planner.PageState.run_reused
+        state = planner.PageState()
+        state.landed("https://a.example/")
+        # A readonly test can use the landing page and reload as it likes
+        state.begin(planner.Plan("", True))
+        self.assertTrue(state.reuse("https://a.example/"))
+        self.assertFalse(state.reuse("https://a.example/pages/faq"))
+        state.loaded("https://a.example/pages/faq")
+        self.assertTrue(state.reuse("https://a.example/pages/faq"))
+        state.end()
+        # So can the next mutating test, but just the once
+        state.begin(planner.Plan("pages/faq", False))
+        self.assertTrue(state.reuse("https://a.example/pages/faq"))
+        self.assertFalse(state.reuse("https://a.example/pages/faq"))
+        state.loaded("https://a.example/pages/faq")
+        state.end()
+        # After which nothing is clean
+        state.begin(None)
+        self.assertFalse(state.reuse("https://a.example/pages/faq"))
+        self.assertEqual((state.loads, state.reused), (3, 3))
+        self.assertEqual(
+            (planner.PageState.run_loads - run_loads, planner.PageState.run_reused - run_reused),
+            (3, 3))
+
+    def test_failure(self):
+        """A readonly test failing partway shouldn't leave its page for reuse."""
+        state = Planned.driver.page_state
+        state.landed("https://a.example/")
+        test = Planned("test_e_index_again")
+        self.assertEqual(planner.plan_for(test), planner.Plan("", True))
+        state.begin(planner.plan_for(test))
+        with self.assertRaises(ValueError):
+            test.test_e_index_again()
+        state.end()
+        self.assertFalse(state.clean)
@@ -8,11 +8,30 @@ test discovery.  See util.main for that part.
 
 import unittest
 from selenium.webdriver.common.keys import Keys
+from .store_client import max_roundtrips
+from .planner import (readonly, mutating)
 from .store_site import StoreSite
+from .util import fetch
 from .test_site_products import TestSiteProducts
 from .test_site_collections import TestSiteCollections
 from .test_site_mailinglist import TestSiteMailingList
 
+# For execute_async_script: add one of a variant to the cart.
+CART_ADD_JS = """
+var done = arguments[arguments.length - 1];
+fetch("/cart/add.js", {method: "POST", headers: {"Content-Type": "application/json"},
+                       body: JSON.stringify({id: arguments[0], quantity: 1})})
+    .then(function() { done(); });
+"""
+
+# For execute_async_script: empty the cart and give the item count after.
+CART_CLEAR_JS = """
+var done = arguments[arguments.length - 1];
+fetch("/cart/clear.js", {method: "POST"})
+    .then(function(resp) { return resp.json(); })
+    .then(function(cart) { done(cart.item_count); });
+"""
+
 class TestSite(StoreSite):
     """Test suite for store.
 
@@ -22,6 +41,8 @@ class TestSite(StoreSite):
 
     ### Tests - Templates
 
+    @max_roundtrips(30)
+    @readonly("does-not-exist")
     def test_template_404(self):
         """The 404 page should show a message and the search form."""
         self.get("does-not-exist")
@@ -37,11 +58,11 @@ class TestSite(StoreSite):
     def test_template_blog(self):
         """Test blog"""
 
+    @readonly("cart")
     def test_template_cart(self):
-        """Cart should show items and allow checkout.
+        """Cart should show the empty bag message to start with.
 
-        We should be able to add items, remove them, modify the quantity, and
-        go to checkout.
+        See test_template_cart_items for adding and removing things.
         """
         self.get("cart")
         # Basics
@@ -50,16 +71,23 @@ class TestSite(StoreSite):
         self.check_nav_site()
         self.check_nav_product()
         # Specifics
+        elem = self.xp("//main")
+        self.assertIn("You don’t have any goods in your bag", elem.text)
+
+    @mutating("products/variants")
+    def test_template_cart_items(self):
+        """Cart should show items and allow checkout.
+
+        We should be able to add items, remove them, modify the quantity, and
+        go to checkout, both with the in-page AJAX cart and the plain forms
+        and links it falls back to.
+        """
         product = "variants"
         prodid = "31622054412323"
         prodvar = "small"
-        elem = self.xp("//main")
-        self.assertIn("You don’t have any goods in your bag", elem.text)
-        # Features
         # First off, make sure we're on a site that has the the testing
         # collection.  Otherwise we'll stop here.
-        self.get("collections/testing")
-        if self.is404():
+        if not self.has_testing_collection():
             return
 
         # This should add one product to the cart page and bring us back there.
@@ -68,13 +96,22 @@ class TestSite(StoreSite):
         self.check_header(bagsize=1)
         trow = self.get_cart_row(product, prodid)
         self.assertIsNotNone(trow)
+        # The quantity buttons update the cart in place.
+        self.xp(".//label[@class='increment']", trow).click()
+        self.check_header(bagsize=2)
+        self.xp(".//label[@class='decrement']", trow).click()
+        self.check_header(bagsize=1)
+        # So does the remove link, which should leave the empty cart message.
         trow.find_element_by_xpath("//a[@title='Remove Item']").click()
         self.check_header(bagsize=0)
         trow = self.get_cart_row(product, prodid)
         self.assertIsNone(trow)
-        # Let's add it back in, and try to check out.
-        self.add_to_cart(product, prodvar)
+        self.assertIn("You don’t have any goods in your bag", self.xp("//main").text)
+        # The same without javascript: the form posts and takes us to the
+        # cart.  Let's try to check out from there.
+        self.add_to_cart(product, prodvar, ajax=False)
         self.check_header(bagsize=1)
+        self.assertIsNotNone(self.get_cart_row(product, prodid))
         button = self.xp("//button[@title='Checkout']")
         self.assertFalse(
             self.click(button),
@@ -89,26 +126,29 @@ class TestSite(StoreSite):
         # Now we've reached checkout
         self.assertIn("Checkout", self.driver.title, "Not on checkout page.")
 
-        # Back to the cart page, check one more thing: the update button.
-        # Update the quantity field for one row and click the button.  This
-        # should remove the item by setting the quantity to zero, rather than
-        # just clicking the remove link as above.
+        # Back to the cart page, check the rest of the plain form: the update
+        # button and the remove link.  Update the quantity field for the row
+        # and click the button, which should post the new quantity.
         self.get("cart")
         qty = self.xp("//input", self.get_cart_row(product, prodid))
         qty.send_keys(Keys.ARROW_RIGHT)
         qty.send_keys(Keys.BACKSPACE)
-        qty.send_keys("0")
+        qty.send_keys("2")
         button = self.xp("//button[@title='Update your total']")
         self.assertTrue(self.click(button), "Cart update button didn't take effect.")
-        # At this point we should have nothing in the cart (otherwise it'll
-        # throw off other tests since # we're sharing one browser session!)
-        # Probably should handle this more generally to make sure
-        # failures/exceptions in one test are isolated and the cart is still
-        # properly cleared.
+        self.check_header(bagsize=2)
+        # The remove link navigates to take the row away.  At this point we
+        # should have nothing in the cart (otherwise it'll throw off other
+        # tests since # we're sharing one browser session!)  Probably should
+        # handle this more generally to make sure failures/exceptions in one
+        # test are isolated and the cart is still properly cleared.
+        trow = self.get_cart_row(product, prodid)
+        self.get(self.xp(".//a[@title='Remove Item']", trow).get_attribute("href"))
         trow = self.get_cart_row(product, prodid)
         self.assertIsNone(trow, "Product still found in cart when it should be absent.")
         self.check_header(bagsize=0)
 
+    @readonly("collections/new")
     def test_template_collection(self):
         """Collection page"""
         self.get("collections/new")
@@ -119,44 +159,26 @@ class TestSite(StoreSite):
     def test_template_gift_card(self):
         """Cart should show items and allow checkout"""
 
+    @readonly()
     def test_template_index(self):
         """Index page should show a collection"""
         self.get()
         self.check_layout_and_parts()
         self.check_snippet_collection()
 
+    @max_roundtrips(400)
+    @readonly("collections")
     def test_template_list_collections(self):
         """Collections page should show a few products for each collection"""
         self.get("collections")
         self.check_layout_and_parts()
         self.check_for_elem("//article[@class='collections']/section[@class='products']")
 
-    def test_template_product(self):
-        """Product page should show product information"""
-        self.get("collections/testing/products/variants")
-        if self.is404():
-            self.skipTest("testing collection not available")
-        self.assertIn("Variants", self.driver.title)
-        self.check_layout_and_parts()
-        self.check_product({
-            "name": "Variants",
-            "description_blurb": "This one has variants.",
-            "url": "products/variants",
-            "mfg": "rennes-dev",
-            "price": "50.00",
-            "currency": "USD",
-            "condition": "NewCondition",
-            "num_images": 2,
-            "variants": {
-                "small": "31622054412323",
-                "large": "31622054445091",
-                }
-            })
-
+    @mutating("search")
     def test_template_search(self):
         """Test /search"""
         # Basics
-        self.get("/search")
+        self.get("search")
         self.assertIn("Search", self.driver.title)
         self.check_layout()
         self.check_header()
@@ -178,46 +200,59 @@ class TestSite(StoreSite):
 
     ### Tests - Pages
 
+    @max_roundtrips(30)
+    @readonly("pages/about")
     def test_page_about(self):
         "Test /pages/about"
         self.check_page("about", "About", "columns page")
 
+    @max_roundtrips(30)
+    @readonly("pages/events")
     def test_page_events(self):
         "Test /pages/events"
         self.check_page("events")
 
+    @max_roundtrips(30)
+    @readonly("pages/contact-us")
     def test_page_contact(self):
         "Test /pages/contact-us"
         self.check_page("contact-us", "visit us", "contact page")
 
+    @max_roundtrips(30)
+    @readonly("pages/policies")
     def test_page_policies(self):
         "Test /pages/policies"
         self.check_page("policies")
 
+    @max_roundtrips(30)
+    @readonly("pages/shipping")
     def test_page_shipping(self):
         "Test /pages/shipping"
         self.check_page("shipping")
 
+    @max_roundtrips(30)
+    @readonly("pages/faq")
     def test_page_faq(self):
         "Test /pages/faq"
         self.check_page("faq")
 
     ### Tests - Others
 
+    @mutating()
     def test_header_search(self):
         """Test search from the page header."""
         # try with a query that works
+        self.get()
         header_input = "//header//form[@role='search']/input[@type='text']"
         results = "//article[@typeof='SearchResultsPage']/section[@typeof='Product']"
         elem = self.xp(header_input)
         query = "ichi"
-        elem.send_keys(query)
+        self.check_predictive_search(elem, query)
         elem.send_keys(Keys.RETURN)
         self.check_snippet_searchresults('searching for "%s"' % query)
         self.check_for_elems(results)
-        self.check_pagination()
-        # a query with no results
-        self.get()
+        # (test_template_search checks these results' pagination.)  Now a
+        # query with no results, from the header on the results page.
         elem = self.xp(header_input)
         query = "verylongsearchquerywithnoresults"
         elem.send_keys(query)
@@ -229,4 +264,41 @@ class TestSite(StoreSite):
         self.assertEqual(msg_observed, msg_expected)
         self.assertIsNone(self.try_for_elem("//nav[@class='pagination']"))
 
+    @mutating("collections/testing")
+    def test_image_loading(self):
+        """Product grids should only load images near the window up front."""
+        for path in ["collections/testing", "collections"]:
+            self.check_image_loading(path)
+
+    @mutating()
+    def test_page_shell_cache_invariant(self):
+        """Pages should be the same for every visitor, whatever's in their bag.
+
+        Two visitors, one with an item in the bag and one with an empty bag,
+        should get byte-identical page bodies, so pages can be cached.  (The
+        head isn't compared since Shopify's content_for_header varies per
+        request.)  The visitors are this browser's session and the same minus
+        its cart cookies, fetched outside the browser.
+        """
+        if not self.has_testing_collection():
+            return
+        self.get()
+        # Add to the bag in the background like the AJAX cart does, since
+        # the page itself doesn't matter here
+        self.driver.execute_async_script(CART_ADD_JS, "31622054412323")
+        user_agent = self.driver.execute_script("return navigator.userAgent;")
+        cookies = self.driver.get_cookies()
+        no_cart = [cookie for cookie in cookies if not cookie["name"].startswith("cart")]
+        self.assertLess(len(no_cart), len(cookies), "no cart cookie found")
+        body = lambda html: html[html.index("<body"):html.rindex("</body>")]
+        try:
+            for path in ["", "collections/new", "collections/skirts", "products/variants"]:
+                with_item = fetch(self.url + path, user_agent, cookies)
+                without = fetch(self.url + path, user_agent, no_cart)
+                self.assertEqual(body(with_item), body(without), "page differs: /" + path)
+        finally:
+            # Leave the bag empty for the other tests
+            count = self.driver.execute_async_script(CART_CLEAR_JS)
+        self.assertEqual(count, 0, "bag not emptied")
+
     ### Tests - Helpers
@@ -7,6 +7,7 @@ See TestSiteCollections for more details.
 import re
 import unittest
 from .store_site import StoreSite
+from .planner import readonly
 from .util import get_setting
 
 class TestSiteCollections(StoreSite):
@@ -18,6 +19,7 @@ class TestSiteCollections(StoreSite):
     TestSiteProducts for the per-product equivalent.
     """
 
+    @readonly("collections/skirts")
     def test_template_collection_submenu(self):
         """A collection page for a collection that is with in another category."""
         self.get("collections/skirts")
@@ -31,6 +33,7 @@ class TestSiteCollections(StoreSite):
         self.check_layout_and_parts()
         self.check_snippet_collection_designers()
 
+    @readonly("collections/testing-empty")
     def test_template_collection_empty(self):
         """An empty collection should just show some placeholder text."""
         self.get_maybe("testing-empty")
@@ -41,6 +44,7 @@ class TestSiteCollections(StoreSite):
             re.sub(r"\s", "", self.xp("//article[@class='products']").text),
             re.sub(r"\s", "", get_setting("collection_empty_text")))
 
+    @readonly("collections/testing-sale")
     def test_template_collection_sale(self):
         """A collection listing items that are on sale.
 
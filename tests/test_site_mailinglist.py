@@ -10,11 +10,16 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.common.exceptions import TimeoutException
 from .store_site import StoreSite
+from .planner import mutating
 from .util import get_setting
 
 class TestSiteMailingList(StoreSite):
     """Test suite for store - mailing list features"""
 
+    # Nothing here looks at images, so skip loading them.
+    driver_options = {"load_images": False}
+
+    @mutating()
     def test_mailing_list_popup(self):
         """Mailing list should only pop up on first visit
 
@@ -6,6 +6,7 @@ See TestSiteProducts for more details.
 
 import unittest
 from .store_site import StoreSite
+from .planner import (readonly, mutating)
 from .util import TEST_PRODUCTS
 
 class TestSiteProducts(StoreSite):
@@ -16,17 +17,19 @@ class TestSiteProducts(StoreSite):
     present.  (This way we can eventually use the same test suite to check on
     the production site, if we also tease apart the add-to-cart step and
     anything else that actually messes with the site.)
+
+    Each product page is loaded once: its readonly checks share it, and then
+    the test selecting variants takes it over (see the planner module).
     """
 
     @classmethod
     def setUpClass(cls):
         """Set up browser session, but skip unit if collection is missing."""
         super().setUpClass()
-        driver = cls.get_driver()
-        driver.get(cls.url + "collections/testing")
-        if "Page Not Found" in driver.title:
+        if not cls.has_testing_collection():
             raise unittest.SkipTest("testing collection not available")
 
+    @readonly(TEST_PRODUCTS["out-of-stock"])
     def test_template_product_out_of_stock(self):
         """Test product template for a completely out-of-stock product.
 
@@ -38,21 +41,52 @@ class TestSiteProducts(StoreSite):
         # TODO check availability
         self.check_product({"num_images": 1})
 
+    @readonly(TEST_PRODUCTS["variants"])
+    def test_template_product(self):
+        """Product page should show product information"""
+        self.get(TEST_PRODUCTS["variants"])
+        self.assertIn("Variants", self.driver.title)
+        self.check_layout_and_parts()
+        self.check_product({
+            "name": "Variants",
+            "description_blurb": "This one has variants.",
+            "url": "products/variants",
+            "mfg": "rennes-dev",
+            "price": "50.00",
+            "currency": "USD",
+            "condition": "NewCondition",
+            "num_images": 2,
+            "variants": {
+                "small": "31622054412323",
+                "large": "31622054445091",
+                }
+            })
+
+    @readonly(TEST_PRODUCTS["variants"])
     def test_template_product_variants(self):
         """Test product template for a product with multiple variants.
 
-        It should notify us if we try to add to cart without selecting one of
-        the variants.  When one is selected, it should be styled appropriately.
+        None of the variants should be selected to start with.  (The rest of
+        the page is checked in test_template_product.)
         """
         self.get(TEST_PRODUCTS["variants"])
-        self.check_variant_required()
-        # Default situation:
         variants = self.get_variant_details()
         for var in variants.values():
             self.assertFalse(
                 has_border(var["label"]),
                 "No variant should be circled yet")
         self.assertEqual(len(variants), 2, "There should be two variants")
+
+    @mutating(TEST_PRODUCTS["variants"], page_only=True)
+    def test_template_product_variants_select(self):
+        """Test selecting the variants of a product with multiple variants.
+
+        It should notify us if we try to add to cart without selecting one of
+        the variants.  When one is selected, it should be styled appropriately.
+        """
+        self.get(TEST_PRODUCTS["variants"])
+        self.check_variant_required()
+        variants = self.get_variant_details()
         small = variants["small"]
         large = variants["large"]
         # First variant selected:
@@ -71,19 +105,41 @@ class TestSiteProducts(StoreSite):
         self.assertTrue(
             has_border(large["label"]),
             "Second variant label should have border")
+
+    @readonly(TEST_PRODUCTS["varying-prices"])
+    def test_template_product_varying_prices(self):
+        """Test product template for a product with differently-priced variants.
+
+        None of the variants should be selected to start with, and only the
+        first one's price should be shown.
+        """
+        self.get(TEST_PRODUCTS["varying-prices"])
+        variants = self.get_variant_details()
+        for var in variants.values():
+            self.assertFalse(
+                has_border(var["label"]),
+                "No variant should be circled yet")
+        self.assertEqual(len(variants), 2, "There should be two variants")
+        self.assertEqual(
+            variants["small"]["price_spec"].text, "50 USD",
+            "First variant's price should be shown")
+        self.assertEqual(
+            variants["large"]["price_spec"].text, "",
+            "Second variant's price should be hidden")
         # General product check
         self.check_product({
-            "name": "Variants",
-            "description_blurb": "This one has variants.",
-            "url": "products/variants",
+            "name": "Varying Prices",
+            "description_blurb": "This one has variants and the big one costs more.",
+            "url": "products/varying-prices",
             "mfg": "rennes-dev",
             "price": "50.00",
             "currency": "USD",
             "condition": "NewCondition",
             "num_images": 2})
 
-    def test_template_product_varying_prices(self):
-        """Test product template for a product with differently-priced variants.
+    @mutating(TEST_PRODUCTS["varying-prices"], page_only=True)
+    def test_template_product_varying_prices_select(self):
+        """Test selecting the variants of a product with differently-priced variants.
 
         It should notify us if we try to add to cart without selecting one of
         the variants.  When one is selected, it should be styled appropriately,
@@ -91,21 +147,9 @@ class TestSiteProducts(StoreSite):
         """
         self.get(TEST_PRODUCTS["varying-prices"])
         self.check_variant_required()
-        # Default situation:
         variants = self.get_variant_details()
-        for var in variants.values():
-            self.assertFalse(
-                has_border(var["label"]),
-                "No variant should be circled yet")
-        self.assertEqual(len(variants), 2, "There should be two variants")
         small = variants["small"]
         large = variants["large"]
-        self.assertEqual(
-            small["price_spec"].text, "50 USD",
-            "First variant's price should be shown")
-        self.assertEqual(
-            large["price_spec"].text, "",
-            "Second variant's price should be hidden")
         # First variant selected:
         small["label"].click()
         self.assertEqual(
@@ -134,29 +178,16 @@ class TestSiteProducts(StoreSite):
         self.assertTrue(
             has_border(large["label"]),
             "Second variant label should have border")
-        # General product check
-        self.check_product({
-            "name": "Varying Prices",
-            "description_blurb": "This one has variants and the big one costs more.",
-            "url": "products/varying-prices",
-            "mfg": "rennes-dev",
-            "price": "50.00",
-            "currency": "USD",
-            "condition": "NewCondition",
-            "num_images": 2})
 
+    @readonly(TEST_PRODUCTS["running-low"])
     def test_template_product_out_of_stock_variant(self):
         """Test product template for a product with one variant out of stock.
 
         The out of stock variant should have its input element disabled and the
         associated label styled appropriately.  The overall product should be
-        available still and the usual rules should apply for variant selection,
-        for clarity.
+        available still.
         """
         self.get(TEST_PRODUCTS["running-low"])
-        # We still require explicitly selecting a variant, even if only one is
-        # available
-        self.check_variant_required()
         # check that only one of two variants is available
         variants = self.get_variant_details()
         self.assertIn(
@@ -165,9 +196,6 @@ class TestSiteProducts(StoreSite):
         self.assertIn(
             "InStock", variants["smooth"]["availability"],
             "Variant should be in stock")
-        # We can't click the sold out one
-        variants["rough"]["label"].click()
-        self.check_variant_required()
         # The label should be styled correctly
         self.assertIn(
             "line-through",
@@ -182,8 +210,6 @@ class TestSiteProducts(StoreSite):
             variants["rough"]["input"].get_attribute("disabled"),
             "true",
             "Out of stock variant should have disabled input element")
-        # The in stock one should be selectable as usual
-        variants["smooth"]["label"].click()
         self.assertIsNone(
             variants["smooth"]["input"].get_attribute("disabled"),
             "In stock variant should not be disabled")
@@ -198,6 +224,28 @@ class TestSiteProducts(StoreSite):
             "condition": "NewCondition",
             "num_images": 2})
 
+    @mutating(TEST_PRODUCTS["running-low"], page_only=True)
+    def test_template_product_out_of_stock_variant_select(self):
+        """Test selecting the variants of a product with one variant out of stock.
+
+        The usual rules should apply for variant selection, for clarity, and
+        the out of stock one can't be selected.
+        """
+        self.get(TEST_PRODUCTS["running-low"])
+        # We still require explicitly selecting a variant, even if only one is
+        # available
+        self.check_variant_required()
+        variants = self.get_variant_details()
+        # We can't click the sold out one
+        variants["rough"]["label"].click()
+        self.check_variant_required()
+        # The in stock one should be selectable as usual
+        variants["smooth"]["label"].click()
+        self.assertIsNone(
+            variants["smooth"]["input"].get_attribute("disabled"),
+            "In stock variant should not be disabled")
+
+    @readonly(TEST_PRODUCTS["lots-of-photos"])
     def test_template_product_lots_of_photos(self):
         """Test product template for a product with a lot of photos.
 
@@ -210,6 +258,7 @@ class TestSiteProducts(StoreSite):
         # maybe?
         self.skipTest("not yet implemented")
 
+    @readonly(TEST_PRODUCTS["now-cheaper"])
     def test_template_product_on_sale(self):
         """Test product template for a product whose price was lowered.
 
@@ -229,6 +278,7 @@ class TestSiteProducts(StoreSite):
             "condition": "NewCondition",
             "num_images": 1})
 
+    @readonly(TEST_PRODUCTS["complex-description"])
     def test_template_product_complex_description(self):
         """Test product template for a product with weird description content.
 
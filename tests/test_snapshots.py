@@ -0,0 +1,106 @@
+"""
+Checks for normalizing, storing, and diffing page snapshots in tests.snapshots.
+
+These use made-up pages and a temporary snapshot directory, without a
+browser.
+"""
+
+import os
+import io
+import tempfile
+import unittest
+from . import snapshots
+
+PAGE = """<!doctype html>
+<html lang="en-US"><head>
+  <link rel="stylesheet" href="//store.example/cdn/shop/t/12/assets/style.css?v=123">
+  <!-- content_for_header -->
+  <script>var Shopify = {"shop": "x", "session": "%s"};</script>
+  <meta name="shopify-checkout-api-token" content="%s">
+  <!-- /content_for_header -->
+  <script src="https://store.example/cdn/shopifycloud/trekkie.js?v=9"></script>
+</head>
+<body class="template-product">
+  <main>
+    <article typeof="Product">
+      <h2   property="name">%s</h2>
+      <img src="//cdn.example/a.jpg?v=1&amp;width=600" alt="">
+      <form><input type="hidden" name="authenticity_token" value="%s"></form>
+    </article>
+  </main>
+  <iframe id="web-pixels-manager-sandbox-%s"><p>x</p></iframe>
+</body></html>"""
+
+
+def page(name="Thing", token="abc"):
+    """Get a made-up product page with some volatile values."""
+    return PAGE % (token, token, name, token, token)
+
+
+class FakeDriver:
+    """Just enough of a WebDriver for SnapshotRecorder."""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, url, text):
+        self.url = url
+        self.text = text
+
+    def execute_script(self, _):
+        """Give the location and markup."""
+        return [self.url, self.text]
+
+
+class TestSnapshots(unittest.TestCase):
+    """Test suite for snapshots."""
+
+    def test_normalize(self):
+        """Volatile tokens, header output, and versions should be gone."""
+        text = snapshots.normalize(page())
+        self.assertEqual(text, snapshots.normalize(page(token="def")))
+        self.assertNotIn("Shopify", text)
+        self.assertNotIn("trekkie", text)
+        self.assertNotIn("iframe", text)
+        self.assertIn('href="//store.example/cdn/shop/t/*/assets/style.css"', text)
+        self.assertIn('src="//cdn.example/a.jpg?width=600"', text)
+        self.assertIn('<h2 property="name">Thing</h2>', text)
+        self.assertIn('name="authenticity_token" type="hidden" value="*"', text)
+
+    def test_page_key(self):
+        """Snapshots should be keyed by store path without tracking parameters."""
+        self.assertEqual(snapshots.page_key("https://a.example/"), "")
+        self.assertEqual(
+            snapshots.page_key("https://a.example/products/x?variant=2&_pos=1&_sid=abc"),
+            "products/x?variant=2")
+
+    def test_diff(self):
+        """Changes should be reported at the element that changed."""
+        old = snapshots.normalize(page())
+        new = snapshots.normalize(page("Other").replace('alt=""', 'alt="A"').replace(
+            "</article>", "<p>new</p></article>"))
+        self.assertEqual(snapshots.diff_pages(old, old), [])
+        self.assertEqual(snapshots.diff_pages(old, new), [
+            ("/html/body.template-product/main/article/h2", "text 'Thing' -> 'Other'"),
+            ("/html/body.template-product/main/article/img", "@alt '' -> 'A'"),
+            ("/html/body.template-product/main/article", "added '<p>new</p>'"),
+            ])
+
+    def test_compare_runs(self):
+        """Unchanged pages should share objects and compare equal."""
+        with tempfile.TemporaryDirectory() as directory:
+            store = snapshots.SnapshotStore(directory)
+            for run, name in (("before", "Thing"), ("after", "Other")):
+                recorder = snapshots.SnapshotRecorder(store, run)
+                recorder.snapshot(FakeDriver("https://a.example/", "<p>home</p>"))
+                recorder.snapshot(FakeDriver("https://a.example/products/x", page(name, run)))
+                recorder.save("TestSite-1")
+            objects = sum(len(files) for _, _, files in os.walk(os.path.join(directory, "objects")))
+            self.assertEqual(objects, 3)
+            self.assertEqual(store.runs(), ["after", "before"])
+            changed, removed, added = snapshots.compare(store, "before", "after")
+            self.assertEqual(list(changed), ["products/x"])
+            self.assertEqual((removed, added), ([], []))
+            stream = io.StringIO()
+            snapshots.report(changed, removed, added, stream=stream)
+            self.assertIn("templates/product.liquid: 1 pages changed", stream.getvalue())
+            with self.assertRaises(ValueError):
+                store.manifest("missing")
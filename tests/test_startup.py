@@ -0,0 +1,19 @@
+"""
+Checks that importing the lightweight parts of the package stays cheap.
+
+See the benchmark module for the timings, which are left out here as they
+depend on how busy the machine is.  Like test_impact these run without a
+browser or store.
+"""
+
+import unittest
+from . import benchmark
+
+class TestStartup(unittest.TestCase):
+    """Test suite for import-time cost of the tests package."""
+
+    def test_startup_imports(self):
+        """Importing settings-only modules should load no config or heavy deps."""
+        for module in benchmark.STARTUP_MODULES:
+            _, heavy = benchmark.time_import(module, repeat=1)
+            self.assertEqual(heavy, [], "%s imported %s" % (module, heavy))
@@ -0,0 +1,106 @@
+"""
+Checks for the replay server and reports in tests.throttle.
+
+These serve a made-up recording from a temporary directory, without a
+browser.
+"""
+
+import io
+import os
+import gzip
+import json
+import tempfile
+import unittest
+import urllib.request
+import urllib.error
+from . import throttle
+
+PAGE = b"""<html><head>
+<link rel="stylesheet" href="//cdn.example/shop/t/1/assets/style.css?v=1">
+<script>var meta = {"url": "https:\\/\\/shop.example\\/products\\/x"};</script>
+</head><body><a href="https://shop.example/cart">bag</a>
+<a href="https://shop.example.org/">elsewhere</a></body></html>"""
+
+
+def save_recording(directory):
+    """Save a page and its stylesheet like record does."""
+    responses = {}
+    for idx, (url, content_type, body) in enumerate((
+            ("https://shop.example/products/x", "text/html; charset=utf-8", PAGE),
+            ("https://cdn.example/shop/t/1/assets/style.css?v=1", "text/css", b"a{}" * 100),
+            ("https://cdn.example/a.png", "image/png", b"\x89PNG"))):
+        with open(os.path.join(directory, str(idx)), "wb") as f_out:
+            f_out.write(body)
+        responses[url] = {"status": 200, "type": content_type, "file": str(idx)}
+    with open(os.path.join(directory, throttle.MANIFEST), "w") as f_out:
+        json.dump({"store": "shop.example", "pages": {"product": "products/x"},
+                   "responses": responses}, f_out)
+
+
+def get(url, encoding=None):
+    """Get the status, headers, and body of a URL."""
+    headers = {"Accept-Encoding": encoding} if encoding else {}
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as resp:
+            return resp.status, resp.headers, resp.read()
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.headers, exc.read()
+
+
+class TestThrottle(unittest.TestCase):
+    """Test suite for throttle."""
+
+    def test_profiles(self):
+        """Every network should be paired with every CPU rate."""
+        names = [name for name, _, _ in throttle.profiles(["slow-3g", "4g"], [1, 2.5])]
+        self.assertEqual(names, ["slow-3g 1x", "slow-3g 2.5x", "4g 1x", "4g 2.5x"])
+
+    def test_rewrite(self):
+        """Recorded hosts' URLs should point at the replay server, and only those."""
+        rewrite = throttle.url_rewriter(
+            {"shop.example", "cdn.example"}, "shop.example", "http://127.0.0.1:8")
+        text = rewrite(PAGE)
+        self.assertIn(b'href="http://127.0.0.1:8/~cdn.example/shop/t/1/assets/style.css', text)
+        self.assertIn(b'"http://127.0.0.1:8\\/products\\/x"', text)
+        self.assertIn(b'href="http://127.0.0.1:8/cart"', text)
+        self.assertIn(b'href="https://shop.example.org/"', text)
+        self.assertEqual(throttle.original_url("/~cdn.example/a.png", "shop.example"),
+                         "https://cdn.example/a.png")
+
+    def test_serve(self):
+        """Recorded responses should be served rewritten, text gzipped."""
+        with tempfile.TemporaryDirectory() as directory:
+            save_recording(directory)
+            server, base = throttle.serve(directory)
+            try:
+                status, headers, body = get(base + "products/x", "gzip")
+                self.assertEqual((status, headers["Content-Encoding"]), (200, "gzip"))
+                self.assertIn(b"/~cdn.example/shop/", gzip.decompress(body))
+                status, headers, body = get(base + "~cdn.example/a.png", "gzip")
+                self.assertEqual((status, body), (200, b"\x89PNG"))
+                self.assertIsNone(headers["Content-Encoding"])
+                status, _, body = get(base + "~cdn.example/shop/t/1/assets/style.css?v=1")
+                self.assertEqual(body, b"a{}" * 100)
+                self.assertEqual(get(base + "cart")[0], 404)
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    def test_compare(self):
+        """Slower times beyond the tolerance, and missing ones, should fail."""
+        baseline = {"product": {"4g 4x": {
+            "first-paint": 800, "largest-contentful-paint": 2000, "mainShop": 1500}}}
+        faster = {"product": {"4g 4x": {
+            "first-paint": 700, "largest-contentful-paint": 2030, "mainShop": 1500}}}
+        stream = io.StringIO()
+        self.assertTrue(throttle.compare(faster, baseline, stream))
+        self.assertIn("-100", stream.getvalue())
+        self.assertNotIn("LCP", stream.getvalue())
+        slower = {"product": {"4g 4x": {
+            "first-paint": 800, "largest-contentful-paint": 2500, "mainShop": None}}}
+        stream = io.StringIO()
+        self.assertFalse(throttle.compare(slower, baseline, stream))
+        self.assertEqual(stream.getvalue().count("REGRESSED"), 2)
+        stream = io.StringIO()
+        throttle.report(slower, stream)
+        self.assertIn("2500", stream.getvalue())
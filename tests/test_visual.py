@@ -0,0 +1,85 @@
+"""
+Checks for the screenshot comparison in tests.visual.
+
+These compare made-up images in temporary directories, without a browser.
+The image checks need numpy and Pillow and are skipped without them.
+"""
+
+import os
+import json
+import tempfile
+import unittest
+from . import visual
+
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    numpy = None
+
+
+def save_set(directory, images, masks=()):
+    """Save {name: array} like capture does."""
+    index = {}
+    for name, pixels in images.items():
+        Image.fromarray(pixels).save(os.path.join(directory, name + ".png"))
+        index[name] = {"file": name + ".png", "shape": list(pixels.shape[:2]),
+                       "masks": list(masks), "tiles": visual.tile_hashes(pixels)}
+    with open(os.path.join(directory, visual.INDEX), "w") as f_out:
+        json.dump(index, f_out)
+
+
+class TestVisual(unittest.TestCase):
+    """Test suite for visual."""
+
+    def test_tiles(self):
+        """Tiles should cover the image, with smaller ones at the edges."""
+        self.assertEqual(visual.tiles(300, 600, 256), [
+            (0, 256, 0, 256), (0, 256, 256, 512), (0, 256, 512, 600),
+            (256, 300, 0, 256), (256, 300, 256, 512), (256, 300, 512, 600)])
+
+    def test_identical_skipped(self):
+        """Screenshots with the same tile hashes shouldn't be read at all."""
+        entry = {"file": "missing.png", "shape": [10, 10], "masks": [], "tiles": ["a"]}
+        result = visual.compare_one(("x", entry, entry, "nowhere", "nowhere", "nowhere"))
+        self.assertEqual(result["changed"], 0)
+        self.assertIsNone(result["heatmap"])
+
+    @unittest.skipUnless(numpy, "needs numpy and Pillow")
+    def test_diff_images(self):
+        """Real changes should count; lone pixels and masked ones shouldn't."""
+        old = numpy.full((300, 400, 3), 200, dtype="uint8")
+        new = old.copy()
+        new[10:20, 10:30] = 0
+        new[150, 150] = 0
+        new[200:210, 300:310] = 0
+        _, changed, compared = visual.diff_images(old, new, [[290, 190, 50, 50]], size=64)
+        self.assertEqual(int(changed.sum()), 200)
+        self.assertFalse(compared[200, 300])
+        # A taller page counts its extra rows as changed
+        _, changed, _ = visual.diff_images(old, numpy.concatenate([old, old[:5]]))
+        self.assertEqual(int(changed.sum()), 5 * 400)
+
+    @unittest.skipUnless(numpy, "needs numpy and Pillow")
+    def test_compare(self):
+        """Only changed screenshots should get heatmaps and fail."""
+        base = numpy.full((600, 500, 3), 255, dtype="uint8")
+        base[100:200, 50:450] = [40, 80, 120]
+        moved = numpy.roll(base, 30, axis=0)
+        with tempfile.TemporaryDirectory() as directory:
+            old_dir, new_dir, report_dir = (os.path.join(directory, name)
+                                            for name in ("old", "new", "report"))
+            os.makedirs(old_dir)
+            os.makedirs(new_dir)
+            save_set(old_dir, {"index--small": base, "product--small": base, "cart--small": base})
+            save_set(new_dir, {"index--small": base, "product--small": moved})
+            results, missing = visual.compare(old_dir, new_dir, report_dir, processes=2)
+            visual.write_report(results, missing, old_dir, new_dir, report_dir)
+            self.assertEqual(missing, ["cart--small"])
+            self.assertEqual([result["name"] for result in results],
+                             ["product--small", "index--small"])
+            self.assertGreater(results[0]["fraction"], visual.MAX_CHANGED)
+            self.assertEqual(results[1]["changed"], 0)
+            self.assertTrue(os.path.exists(os.path.join(report_dir, "product--small-heat.png")))
+            with open(os.path.join(report_dir, "index.html")) as f_in:
+                self.assertIn("1 of 2 screenshots changed", f_in.read())
@@ -0,0 +1,421 @@
+"""
+Page timings under mobile network and CPU throttling.
+
+WINDOWSIZES["small"] is a phone-sized window, but the browser tests still
+load pages over a fast connection on a fast CPU.  This loads each template's
+first page (see impact.template_pages) at that size under every
+combination of NETWORKS and CPU_RATES, throttling Chrome through the DevTools
+protocol, and tabulates the median of each of METRICS:
+
+ * first paint,
+ * largest contentful paint, and
+ * when mainShop in js-shop.js has set up the page's handlers (it leaves a
+   "mainShop" performance mark for this).
+
+A live store and its CDNs vary too much from one run to the next for these
+numbers to mean much, so pages come from a local development server or a
+recording instead:
+
+    python -m tests.throttle record DIR
+    python -m tests.throttle run --replay DIR [--save F] [--baseline F]
+    python -m tests.throttle run --target http://127.0.0.1:9292
+
+record loads each page once in the browser, logged in to the testing
+configuration's store, then downloads the page along with every resource the
+browser fetched for it.  run --replay serves those from 127.0.0.1 (see
+ReplayHandler).  The store's and CDNs' URLs in the text responses are
+rewritten to point there, text is gzipped as the CDN would, and the browser
+can't reach any other host.  The browser cache is disabled, so every load is
+a first visit.  --save keeps the results, and --baseline compares against
+saved ones, exiting nonzero if any time got more than TOLERANCE slower (and
+at least MIN_DELTA_MS).  Only Chrome can be throttled like this.
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import hashlib
+import logging
+import argparse
+import statistics
+import threading
+import http.server
+import urllib.parse
+import urllib.request
+import urllib.error
+
+LOGGER = logging.getLogger(__name__)
+
+# DevTools' throttling presets: added round trip latency in ms, and
+# throughput in bytes per second.
+NETWORKS = {
+    "slow-3g": {"latency": 2000, "download": 50000, "upload": 50000},
+    "fast-3g": {"latency": 562.5, "download": 180000, "upload": 84375},
+    "4g": {"latency": 165, "download": 1012500, "upload": 168750},
+    }
+# CPU slowdown factors.  4 is about a mid-range phone.
+CPU_RATES = (1, 4)
+METRICS = (
+    ("first-paint", "first paint"),
+    ("largest-contentful-paint", "LCP"),
+    ("mainShop", "mainShop"),
+    )
+TOLERANCE = 0.1
+MIN_DELTA_MS = 50.0
+# How long the largest contentful paint has to stay put to count as final
+QUIET_MS = 1000
+MANIFEST = "manifest.json"
+# Keeps the browser from reaching anything but the replay server
+OFFLINE_RULES = "MAP * ~NOTFOUND, EXCLUDE 127.0.0.1"
+RE_TEXT_TYPE = re.compile(r"^(text/|application/(javascript|json|xml)|image/svg)")
+
+TIMING_JS = """
+var quiet = arguments[0], done = arguments[arguments.length - 1];
+var times = {"first-paint": null, "largest-contentful-paint": null, "mainShop": null};
+var timer = null;
+function finish() {
+    performance.getEntriesByType("paint").forEach(function(entry) {
+        if (entry.name == "first-paint") times["first-paint"] = entry.startTime;
+    });
+    var marks = performance.getEntriesByName("mainShop", "mark");
+    if (marks.length) times.mainShop = marks[0].startTime;
+    done(times);
+}
+function wait() {
+    clearTimeout(timer);
+    timer = setTimeout(finish, quiet);
+}
+try {
+    new PerformanceObserver(function(list) {
+        var entries = list.getEntries();
+        times["largest-contentful-paint"] = entries[entries.length - 1].startTime;
+        wait();
+    }).observe({type: "largest-contentful-paint", buffered: true});
+} catch (err) {
+    // No LCP in this browser
+}
+wait();
+"""
+
+RESOURCES_JS = """
+return performance.getEntriesByType("resource").map(function(entry) { return entry.name; });
+"""
+
+
+def profiles(networks=None, cpu_rates=None):
+    """Get the (name, network conditions, CPU rate) combinations to measure."""
+    networks = networks or list(NETWORKS)
+    return [("%s %gx" % (network, rate), NETWORKS[network], rate)
+            for network in networks for rate in (cpu_rates or CPU_RATES)]
+
+
+def throttle(driver, conditions, rate):
+    """Apply network conditions and a CPU slowdown to a Chrome driver."""
+    driver.execute_cdp_cmd("Network.emulateNetworkConditions", {
+        "offline": False, "latency": conditions["latency"],
+        "downloadThroughput": conditions["download"],
+        "uploadThroughput": conditions["upload"]})
+    driver.execute_cdp_cmd("Emulation.setCPUThrottlingRate", {"rate": rate})
+
+
+def measure(base, pages, profile_list, repeat=3, driver_options=None):
+    """Time each template's page under each profile.
+
+    pages maps template keys to store paths, relative to the base URL.
+    Returns a nested dictionary of template, profile name, and metric to the
+    median time in ms (None if it never happened).
+    """
+    # pylint: disable=import-outside-toplevel
+    from .store_client import StoreClient
+    from .store_site import WINDOWSIZES
+
+    class ThrottleClient(StoreClient):
+        """Browser session for throttled page timings."""
+
+    ThrottleClient.driver_options = driver_options or {}
+    driver = ThrottleClient.get_driver()
+    size = WINDOWSIZES["small"]
+    driver.set_window_size(size["width"], size["height"])
+    # Slow 3G at a quarter speed takes its time
+    driver.set_page_load_timeout(600)
+    driver.set_script_timeout(60)
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setCacheDisabled", {"cacheDisabled": True})
+    results = {}
+    try:
+        for name, conditions, rate in profile_list:
+            throttle(driver, conditions, rate)
+            for key, path in sorted(pages.items()):
+                times = {}
+                for _ in range(repeat):
+                    driver.get(base + path)
+                    for metric, msec in driver.execute_async_script(TIMING_JS, QUIET_MS).items():
+                        times.setdefault(metric, []).append(msec)
+                results.setdefault(key, {})[name] = {
+                    metric: (statistics.median(vals) if None not in vals else None)
+                    for metric, vals in times.items()}
+                LOGGER.info("measure: %s under %s: %s", key, name, results[key][name])
+    finally:
+        ThrottleClient.tear_down_site()
+    return results
+
+
+def report(results, stream=sys.stdout):
+    """Print a table of times per template and profile."""
+    fmt = "%-20s %-14s" + " %12s" * len(METRICS) + "\n"
+    stream.write(fmt % (("template", "profile") + tuple(title for _, title in METRICS)))
+    for key in sorted(results):
+        for name, times in results[key].items():
+            stream.write(fmt % ((key, name) + tuple(
+                "-" if times.get(metric) is None else "%.0f" % times[metric]
+                for metric, _ in METRICS)))
+
+
+def compare(results, baseline, stream=sys.stdout):
+    """Print times that changed against a baseline and get whether none regressed.
+
+    A time regressed if it's more than TOLERANCE and MIN_DELTA_MS slower, or
+    if it went missing (like the mainShop mark after a script error).
+    """
+    fmt = "%-20s %-14s %-12s %10s %10s %8s\n"
+    stream.write(fmt % ("template", "profile", "metric", "was (ms)", "now (ms)", "change"))
+    passed = True
+    for key in sorted(results):
+        for name, times in results[key].items():
+            for metric, title in METRICS:
+                was = baseline.get(key, {}).get(name, {}).get(metric)
+                now = times.get(metric)
+                if was is None:
+                    continue
+                if now is None:
+                    stream.write(fmt % (key, name, title, "%.0f" % was, "-", "REGRESSED"))
+                    passed = False
+                    continue
+                delta = now - was
+                flag = ""
+                if delta > max(was * TOLERANCE, MIN_DELTA_MS):
+                    flag = "REGRESSED"
+                    passed = False
+                elif abs(delta) < MIN_DELTA_MS:
+                    continue
+                stream.write(fmt % (key, name, title, "%.0f" % was, "%.0f" % now,
+                                    "%+.0f%s" % (delta, " " + flag if flag else "")))
+    return passed
+
+
+def download(url, user_agent=None, cookies=None):
+    """Get a URL's status, content type, and body bytes, errors and all."""
+    headers = {"User-Agent": user_agent} if user_agent else {}
+    if cookies:
+        headers["Cookie"] = "; ".join(
+            "%s=%s" % (cookie["name"], cookie["value"]) for cookie in cookies)
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as resp:
+            return resp.status, resp.headers.get("Content-Type"), resp.read()
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.headers.get("Content-Type"), exc.read()
+
+
+def record(directory, pages=None):
+    """Save each template's first page and everything it loads, for replay."""
+    # pylint: disable=import-outside-toplevel
+    from .impact import template_pages
+    from .store_client import StoreClient
+    from .store_site import WINDOWSIZES
+
+    class RecordClient(StoreClient):
+        """Browser session for recording pages to replay throttled."""
+
+    pages = pages or {key: paths[0] for key, paths in template_pages().items()}
+    os.makedirs(directory, exist_ok=True)
+    manifest = {"pages": pages, "responses": {}}
+    RecordClient.set_up_site()
+    driver = RecordClient.get_driver()
+    base = RecordClient.url
+    manifest["store"] = urllib.parse.urlsplit(base).netloc
+    size = WINDOWSIZES["small"]
+    driver.set_window_size(size["width"], size["height"])
+    driver.set_script_timeout(30)
+    user_agent = driver.execute_script("return navigator.userAgent;")
+    try:
+        for key, path in sorted(pages.items()):
+            driver.get(base + path)
+            driver.execute_async_script(TIMING_JS, QUIET_MS)
+            cookies = driver.get_cookies()
+            for url in [base + path] + driver.execute_script(RESOURCES_JS):
+                url = urllib.parse.urldefrag(url)[0]
+                if not url.startswith("https://") or url in manifest["responses"]:
+                    continue
+                mine = urllib.parse.urlsplit(url).netloc == manifest["store"]
+                status, content_type, body = download(url, user_agent, cookies if mine else None)
+                name = hashlib.sha1(body).hexdigest()
+                with open(os.path.join(directory, name), "wb") as f_out:
+                    f_out.write(body)
+                manifest["responses"][url] = {
+                    "status": status, "type": content_type or "application/octet-stream",
+                    "file": name}
+            LOGGER.info("record: %s: %d responses so far", key, len(manifest["responses"]))
+    finally:
+        RecordClient.tear_down_site()
+    with open(os.path.join(directory, MANIFEST), "w") as f_out:
+        json.dump(manifest, f_out, indent=2, sort_keys=True)
+    return manifest
+
+
+def url_rewriter(hosts, store, origin):
+    """Get a function rewriting URLs on the recorded hosts in bytes to origin.
+
+    The store's own URLs go to the root and other hosts' under /~host/, like
+    https://cdn.example/a.css to origin/~cdn.example/a.css.  Protocol-relative
+    and JSON-escaped (https:\\/\\/host) URLs are rewritten too.
+    """
+    names = sorted(hosts, key=len, reverse=True)
+    pattern = re.compile(
+        rb"(?:https?:)?\\?/\\?/(" + b"|".join(re.escape(host.encode()) for host in names) +
+        rb")(?![\w.-])")
+    origin = origin.encode()
+
+    def replace(match):
+        host = match.group(1)
+        return origin if host == store.encode() else origin + b"/~" + host
+
+    return lambda body: pattern.sub(replace, body)
+
+
+def original_url(path, store):
+    """Get the recorded URL a request path on the replay server stands for."""
+    if path.startswith("/~"):
+        return "https://" + path[2:]
+    return "https://" + store + path
+
+
+class ReplayHandler(http.server.BaseHTTPRequestHandler):
+    """Serves recorded responses by URL, rewritten to stay on this server."""
+
+    protocol_version = "HTTP/1.1"
+    directory = None
+    manifest = {}
+    rewrite = None
+    # (file, gzipped) to the body to send
+    bodies = {}
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Send the recorded response for this URL, or a 404."""
+        entry = self.manifest["responses"].get(original_url(self.path, self.manifest["store"]))
+        headers = {}
+        if entry is None:
+            LOGGER.info("not recorded: %s", self.path)
+            status, body = 404, b"not recorded"
+            headers["Content-Type"] = "text/plain"
+        else:
+            status = entry["status"]
+            headers["Content-Type"] = entry["type"]
+            text = bool(RE_TEXT_TYPE.match(entry["type"]))
+            zipped = text and "gzip" in self.headers.get("Accept-Encoding", "")
+            if zipped:
+                headers["Content-Encoding"] = "gzip"
+            body = self.body(entry["file"], text, zipped)
+        headers["Content-Length"] = str(len(body))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body(self, name, text, zipped):
+        """Get a recorded body, rewritten if it's text and maybe gzipped."""
+        key = (name, zipped)
+        if key not in self.bodies:
+            with open(os.path.join(self.directory, name), "rb") as f_in:
+                body = f_in.read()
+            if text:
+                body = self.rewrite(body)
+            if zipped:
+                body = gzip.compress(body, mtime=0)
+            self.bodies[key] = body
+        return self.bodies[key]
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        LOGGER.debug(format, *args)
+
+
+def serve(directory, port=0):
+    """Start serving a recording in a thread.
+
+    Returns the server and the base URL to load pages from.
+    """
+    with open(os.path.join(directory, MANIFEST)) as f_in:
+        manifest = json.load(f_in)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), ReplayHandler)
+    origin = "http://127.0.0.1:%d" % server.server_address[1]
+    hosts = {urllib.parse.urlsplit(url).netloc for url in manifest["responses"]}
+    rewrite = url_rewriter(hosts | {manifest["store"]}, manifest["store"], origin)
+    server.RequestHandlerClass = type("Handler", (ReplayHandler,), {
+        "directory": directory, "manifest": manifest, "bodies": {},
+        "rewrite": staticmethod(rewrite)})
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, origin + "/"
+
+
+def run(replay=None, target=None, networks=None, cpu_rates=None, repeat=3):
+    """Measure every profile against a recording or a local server."""
+    # pylint: disable=import-outside-toplevel
+    from .impact import template_pages
+    if replay:
+        server, base = serve(replay)
+        try:
+            return measure(base, server.RequestHandlerClass.manifest["pages"],
+                           profiles(networks, cpu_rates), repeat,
+                           {"browser": "chrome", "host_rules": OFFLINE_RULES})
+        finally:
+            server.shutdown()
+            server.server_close()
+    pages = {key: paths[0] for key, paths in template_pages().items()}
+    return measure(target.rstrip("/") + "/", pages, profiles(networks, cpu_rates), repeat,
+                   {"browser": "chrome"})
+
+
+def main(argv=None):
+    """Record pages or time them under throttling."""
+    parser = argparse.ArgumentParser(
+        prog="python -m tests.throttle",
+        description="Time templates under mobile network and CPU throttling.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser(
+        "record", help="save each template's page and its resources from the store")
+    record_parser.add_argument("directory")
+    run_parser = subparsers.add_parser("run", help="time every template under every profile")
+    source = run_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--replay", metavar="DIR", help="serve pages saved by record")
+    source.add_argument("--target", metavar="URL", help="a local development server")
+    run_parser.add_argument(
+        "--network", action="append", choices=sorted(NETWORKS),
+        help="network profile (repeatable; default all)")
+    run_parser.add_argument(
+        "--cpu", action="append", type=float,
+        help="CPU slowdown (repeatable; default %s)" % ", ".join(map(str, CPU_RATES)))
+    run_parser.add_argument("-n", "--repeat", type=int, default=3, help="loads per page")
+    run_parser.add_argument("--save", help="save times to this JSON file")
+    run_parser.add_argument("--baseline", help="compare times against this JSON file")
+    args = parser.parse_args(argv)
+    if args.command == "record":
+        manifest = record(args.directory)
+        print("%d responses saved for %d pages" % (
+            len(manifest["responses"]), len(manifest["pages"])))
+        return
+    results = run(args.replay, args.target, args.network, args.cpu, args.repeat)
+    report(results)
+    if args.save:
+        with open(args.save, "w") as f_out:
+            json.dump(results, f_out, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f_in:
+            if not compare(results, json.load(f_in)):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
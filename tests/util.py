@@ -1,17 +1,27 @@
 """
 Various configuration and utilities used elsewhere in the package.
+
+Configuration is loaded lazily: CONFIG, SETTINGS, and TESTING_CONFIG read
+config.yml, config/settings_data.json, and the environment the first time
+something is looked up in them, and then keep what they loaded.  That keeps
+importing this module cheap for tools that never touch the store.
 """
 
 import os
+import sys
+import time
 import logging
 import json
-import unittest
 import base64
-import yaml
-# https://stackoverflow.com/a/8910326/4499968
-from xvfbwrapper import Xvfb
+import tempfile
+import functools
+import collections.abc
+
+LOGGER = logging.getLogger(__name__)
 
 def __load_theme_config():
+    # pylint: disable=import-outside-toplevel
+    import yaml
     try:
         with open("config.yml") as f_in:
             config = yaml.safe_load(f_in)
@@ -40,34 +50,89 @@ def __load_settings_data():
     return settings
 
 def __setup_testing_config(config):
+    real_x11 = os.getenv("SHOPIFY_TEST_SHOW") is not None
     testing_config = {
         # TODO unify this around the environment variables themekit uses
         "store_site": config.get("development", {}).get("store") or os.getenv("SHOPIFY_STORE"),
         "store_password": os.getenv("SHOPIFY_STORE_PASSWORD"),
         "elem_delay": float(os.getenv("SHOPIFY_TEST_DELAY", "0")),
-        "real_x11": os.getenv("SHOPIFY_TEST_SHOW") is not None,
+        "real_x11": real_x11,
+        # Browsers run headless unless we're showing them on a real display,
+        # and only a non-headless browser without one needs Xvfb.
+        "headless": os.getenv("SHOPIFY_TEST_HEADLESS", str(not real_x11)).title() == "True",
+        # Driver setup; see the drivers module.  StoreClient classes can
+        # override these with their driver_options attribute.
+        "browser": os.getenv("SHOPIFY_TEST_BROWSER", "chrome").lower(),
+        "load_images": os.getenv("SHOPIFY_TEST_IMAGES", "True").title() == "True",
+        "cache_dir": os.getenv(
+            "SHOPIFY_TEST_CACHE_DIR",
+            os.path.join(tempfile.gettempdir(), "rennes-theme-tests", "cache")),
+        "tuned": os.getenv("SHOPIFY_TEST_TUNED", "True").title() == "True",
         "log_level": int(os.getenv("SHOPIFY_TEST_LOGLEVEL", "30")),
         # Seems like we sometimes get banned temporarily, probably from hammering
         # instagram's server too hard.
         "check_instafeed": os.getenv("SHOPIFY_CHECK_INSTA", "True").title() == "True",
-        "page_load_timeout": 90000 # ms?
+        "page_load_timeout": 90000, # ms?
+        # Seconds of quiet after a change before watch mode reruns tests
+        "watch_debounce": float(os.getenv("SHOPIFY_TEST_DEBOUNCE", "2")),
+        # Directory to save CSS/JS coverage in, if any; see asset_coverage.
+        "coverage_dir": os.getenv("SHOPIFY_TEST_COVERAGE"),
+        # Directory to save rendered page snapshots in, if any, and the name
+        # to save this run's under; see snapshots.
+        "snapshot_dir": os.getenv("SHOPIFY_TEST_SNAPSHOTS"),
+        "snapshot_run": os.getenv("SHOPIFY_TEST_SNAPSHOT_RUN", time.strftime("%Y%m%d-%H%M%S")),
         }
     return testing_config
 
-def __log_testing_config():
-    for key in TESTING_CONFIG:
-        val = TESTING_CONFIG[key]
+def __log_testing_config(testing_config):
+    for key in testing_config:
+        val = testing_config[key]
         if key == "store_password" and val:
             val = "********"
         LOGGER.info("config: %s=%s", key, val)
 
-CONFIG = __load_theme_config()
-SETTINGS = __load_settings_data()
-TESTING_CONFIG = __setup_testing_config(CONFIG)
+@functools.lru_cache(maxsize=None)
+def get_config():
+    """Get the themekit configuration from config.yml (loaded once)."""
+    return __load_theme_config()
 
-logging.basicConfig(level=TESTING_CONFIG["log_level"])
-LOGGER = logging.getLogger(__name__)
-__log_testing_config()
+@functools.lru_cache(maxsize=None)
+def get_settings():
+    """Get the theme settings data from config/settings_data.json (loaded once)."""
+    return __load_settings_data()
+
+@functools.lru_cache(maxsize=None)
+def get_testing_config():
+    """Get the test suite configuration (set up once).
+
+    Logging is configured here too, the first time, since the log level is
+    part of the testing configuration.
+    """
+    testing_config = __setup_testing_config(get_config())
+    logging.basicConfig(level=testing_config["log_level"])
+    __log_testing_config(testing_config)
+    return testing_config
+
+
+class LazyConfig(collections.abc.Mapping):
+    """Read-only dictionary view that calls a loader on first lookup."""
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __getitem__(self, key):
+        return self.loader()[key]
+
+    def __iter__(self):
+        return iter(self.loader())
+
+    def __len__(self):
+        return len(self.loader())
+
+
+CONFIG = LazyConfig(get_config)
+SETTINGS = LazyConfig(get_settings)
+TESTING_CONFIG = LazyConfig(get_testing_config)
 
 TEST_PRODUCTS = {
     "out-of-stock":        "collections/testing/products/out-of-stock",
@@ -86,11 +151,43 @@ def get_setting(key):
     except TypeError:
         return SETTINGS["current"].get(key)
 
-def main():
-    """Run unit tests within virtual X display."""
-    unittest_main = lambda: unittest.main(module="tests.test_site")
-    if TESTING_CONFIG["real_x11"]:
+def fetch(url, user_agent=None, cookies=None):
+    """Get the text at a URL, optionally asking as a particular browser.
+
+    cookies can be a list of cookie dictionaries like Selenium's get_cookies
+    gives, to send along.
+    """
+    # pylint: disable=import-outside-toplevel
+    import urllib.request
+    headers = {"User-Agent": user_agent} if user_agent else {}
+    if cookies:
+        headers["Cookie"] = "; ".join(
+            "%s=%s" % (cookie["name"], cookie["value"]) for cookie in cookies)
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as resp:
+        return resp.read().decode("utf-8")
+
+def main(argv=None):
+    """Run unit tests, within a virtual X display if needed.
+
+    Xvfb is only started for a non-headless browser when SHOPIFY_TEST_SHOW
+    isn't set (so there's no real display to use).  With --watch, keep
+    running and rerun affected tests as theme files change instead (see the
+    watch module).
+    """
+    # pylint: disable=import-outside-toplevel
+    import unittest
+    from .planner import PlannedLoader
+    argv = sys.argv if argv is None else argv
+    if "--watch" in argv[1:]:
+        from . import watch
+        unittest_main = lambda: watch.main([arg for arg in argv[1:] if arg != "--watch"])
+    else:
+        unittest_main = lambda: unittest.main(
+            module="tests.test_site", argv=argv, testLoader=PlannedLoader())
+    if TESTING_CONFIG["real_x11"] or TESTING_CONFIG["headless"]:
         unittest_main()
     else:
+        # https://stackoverflow.com/a/8910326/4499968
+        from xvfbwrapper import Xvfb
         with Xvfb():
             unittest_main()
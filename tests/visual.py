@@ -0,0 +1,369 @@
+"""
+Visual regression screenshots across the viewport matrix.
+
+The layout checks (_check_wrap, check_decoration_on_hover, and so on) only
+look at what they were written for.  This takes a full-page screenshot of
+the first page the suite visits for each template at each of the
+WINDOWSIZES, upright and rotated, and compares two sets of them:
+
+    python -m tests.visual capture before
+    (change the theme)
+    python -m tests.visual capture after
+    python -m tests.visual compare before after [--report visual-report] [-j 8]
+
+Animations and transitions are turned off, lazy images are loaded, and the
+regions of MASK_SELECTORS (the instafeed and the banner, whose content comes
+from elsewhere) are recorded so they're left out of the comparison.  Chrome
+captures the whole page through DevTools; other browsers only the window.
+
+Pixels are compared by their difference in YIQ color (which weighs
+brightness over hue roughly like the eye does), and a pixel counts as changed
+if that's over THRESHOLD with at least MIN_NEIGHBOURS changed pixels around
+it, so single-pixel antialiasing differences don't count.  capture saves a
+hash of every TILE x TILE tile of each screenshot, so compare skips tiles,
+and whole screenshots, that are identical without decoding them, and only
+diffs the rest, in parallel processes.  The report directory gets a heatmap
+per changed screenshot (changes in red over a faded copy of the new one,
+masked regions in blue) and an index.html listing them.  compare exits
+nonzero if any screenshot has more than MAX_CHANGED of its pixels changed.
+
+Needs numpy and Pillow (pip install numpy pillow).
+"""
+
+import os
+import sys
+import json
+import base64
+import hashlib
+import logging
+import argparse
+import multiprocessing
+
+from tools.images import (box_mean, have_metrics)
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX = "index.json"
+TILE = 256
+# Normalized YIQ difference for a pixel to count as changed (0 to 1)
+THRESHOLD = 0.01
+# Changed pixels in a pixel's 3x3 neighbourhood (itself included) for it to count
+MIN_NEIGHBOURS = 3
+# Fraction of a screenshot's compared pixels that can change before it fails
+MAX_CHANGED = 0.0005
+# Regions whose content isn't the theme's
+MASK_SELECTORS = ["#instafeed", ".banner"]
+# Largest possible YIQ difference, for normalizing
+MAX_YIQ = 35215.0
+
+# Settle the page for a screenshot: no animation, lazy images loaded, fonts
+# ready, scrolled to the top.  Gives the page size and mask rectangles in
+# screenshot pixels.
+SETTLE_JS = """
+var selectors = arguments[0], done = arguments[arguments.length - 1];
+var style = document.createElement("style");
+style.textContent = "*, *::before, *::after { animation: none !important; " +
+  "transition: none !important; caret-color: transparent !important; }";
+document.head.appendChild(style);
+Array.prototype.forEach.call(document.querySelectorAll("img[loading=lazy]"), function(img) {
+  img.loading = "eager";
+});
+var images = Array.prototype.map.call(document.images, function(img) {
+  return img.complete ? null : new Promise(function(resolve) {
+    img.addEventListener("load", resolve);
+    img.addEventListener("error", resolve);
+  });
+});
+Promise.all(images.concat([document.fonts.ready])).then(function() {
+  window.scrollTo(0, 0);
+  requestAnimationFrame(function() { requestAnimationFrame(function() {
+    var scale = window.devicePixelRatio;
+    var masks = [];
+    selectors.forEach(function(selector) {
+      Array.prototype.forEach.call(document.querySelectorAll(selector), function(elem) {
+        var rect = elem.getBoundingClientRect();
+        if (rect.width && rect.height) {
+          masks.push([rect.left + scrollX, rect.top + scrollY, rect.width, rect.height].map(
+            function(value) { return Math.round(value * scale); }));
+        }
+      });
+    });
+    done({width: document.documentElement.scrollWidth,
+          height: document.documentElement.scrollHeight, masks: masks});
+  }); });
+});
+"""
+
+
+def viewports():
+    """Get every WINDOWSIZES entry and its rotation, by name."""
+    # pylint: disable=import-outside-toplevel
+    from .store_site import (WINDOWSIZES, rotate)
+    sizes = {}
+    for name, size in WINDOWSIZES.items():
+        sizes[name] = size
+        sizes[name + "-rotated"] = rotate(size)
+    return sizes
+
+
+def tiles(height, width, size=TILE):
+    """List (top, bottom, left, right) for the tiles covering an image."""
+    return [(top, min(top + size, height), left, min(left + size, width))
+            for top in range(0, height, size) for left in range(0, width, size)]
+
+
+def tile_hashes(pixels, size=TILE):
+    """Hash each tile of an image array, in the order tiles gives them."""
+    return [hashlib.blake2b(pixels[top:bottom, left:right].tobytes(), digest_size=8).hexdigest()
+            for top, bottom, left, right in tiles(pixels.shape[0], pixels.shape[1], size)]
+
+
+def load(path):
+    """Read an image file as an RGB uint8 array."""
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    from PIL import Image
+    with Image.open(path) as img:
+        return np.asarray(img.convert("RGB"))
+
+
+def yiq_delta(first, second):
+    """Get the normalized perceptual difference of each pixel in two RGB arrays."""
+    # pylint: disable=invalid-name
+    diff = first.astype("float32") - second.astype("float32")
+    r, g, b = diff[..., 0], diff[..., 1], diff[..., 2]
+    y = r * 0.29889531 + g * 0.58662247 + b * 0.11448223
+    i = r * 0.59597799 - g * 0.27417610 - b * 0.32180189
+    q = r * 0.21147017 - g * 0.52261711 + b * 0.31114694
+    return (0.5053 * y * y + 0.299 * i * i + 0.1957 * q * q) / MAX_YIQ
+
+
+def mask_array(height, width, rects):
+    """Get a boolean array that's False inside any of the rectangles."""
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    compared = np.ones((height, width), dtype=bool)
+    for left, top, rect_width, rect_height in rects:
+        rows = slice(max(top, 0), max(top + rect_height, 0))
+        cols = slice(max(left, 0), max(left + rect_width, 0))
+        compared[rows, cols] = False
+    return compared
+
+
+def diff_images(old, new, masks=(), old_hashes=None, new_hashes=None, size=TILE):
+    """Compare two RGB uint8 arrays.
+
+    Returns the per-pixel difference (0 to 1, and 1 where only one image
+    has pixels), a boolean array of changed pixels, and the array of pixels
+    compared (outside masks).  Tiles whose hashes match are skipped.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    height, width = max(old.shape[0], new.shape[0]), max(old.shape[1], new.shape[1])
+    common_height, common_width = min(old.shape[0], new.shape[0]), min(old.shape[1], new.shape[1])
+    heat = np.ones((height, width), dtype="float32")
+    heat[:common_height, :common_width] = 0
+    changed = heat > 0
+    same_shape = old.shape == new.shape and old_hashes and new_hashes
+    for index, (top, bottom, left, right) in enumerate(tiles(common_height, common_width, size)):
+        if same_shape and old_hashes[index] == new_hashes[index]:
+            continue
+        # One pixel more around the tile for the neighbour counts at its edges
+        pad_top, pad_left = max(top - 1, 0), max(left - 1, 0)
+        pad_bottom, pad_right = min(bottom + 1, common_height), min(right + 1, common_width)
+        delta = yiq_delta(old[pad_top:pad_bottom, pad_left:pad_right],
+                          new[pad_top:pad_bottom, pad_left:pad_right])
+        over = (delta > THRESHOLD).astype("float32")
+        neighbours = box_mean(np.pad(over, 1), 3) * 9 >= MIN_NEIGHBOURS
+        inner = (slice(top - pad_top, bottom - pad_top), slice(left - pad_left, right - pad_left))
+        heat[top:bottom, left:right] = delta[inner]
+        changed[top:bottom, left:right] = (over[inner] > 0) & neighbours[inner]
+    compared = mask_array(height, width, masks)
+    return heat, changed & compared, compared
+
+
+def heatmap(new, heat, changed, compared):
+    """Draw changes in red over a faded copy of an image, masked parts in blue."""
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    height, width = heat.shape
+    faded = np.full((height, width, 3), 255, dtype="float32")
+    gray = new.astype("float32") @ np.array([0.299, 0.587, 0.114], dtype="float32")
+    faded[:new.shape[0], :new.shape[1]] = (160 + gray * 0.37)[..., None]
+    strength = np.where(changed, 0.4 + 0.6 * np.minimum(heat / (THRESHOLD * 20), 1), 0)[..., None]
+    out = faded * (1 - strength) + np.array([255, 0, 0], dtype="float32") * strength
+    out[~compared] = out[~compared] * 0.6 + np.array([0, 0, 255], dtype="float32") * 0.4
+    return out.astype("uint8")
+
+
+def compare_one(job):
+    """Compare one screenshot between two capture directories.
+
+    job is (name, old entry, new entry, old directory, new directory,
+    report directory), with entries from the directories' index files.
+    Returns a dictionary of results; identical screenshots (by tile hashes)
+    aren't even read.
+    """
+    # pylint: disable=import-outside-toplevel
+    name, old_entry, new_entry, old_dir, new_dir, report_dir = job
+    result = {"name": name, "tiles": len(new_entry["tiles"])}
+    if old_entry["shape"] == new_entry["shape"] and old_entry["tiles"] == new_entry["tiles"]:
+        result.update(changed=0, fraction=0.0, tiles_changed=0, heatmap=None)
+        return result
+    from PIL import Image
+    old = load(os.path.join(old_dir, old_entry["file"]))
+    new = load(os.path.join(new_dir, new_entry["file"]))
+    heat, changed, compared = diff_images(
+        old, new, old_entry["masks"] + new_entry["masks"], old_entry["tiles"], new_entry["tiles"])
+    count = int(changed.sum())
+    if old.shape == new.shape:
+        tiles_changed = sum(1 for old_hash, new_hash in zip(old_entry["tiles"], new_entry["tiles"])
+                            if old_hash != new_hash)
+    else:
+        tiles_changed = len(new_entry["tiles"])
+    result.update(
+        changed=count, fraction=count / max(int(compared.sum()), 1),
+        tiles_changed=tiles_changed, heatmap=None)
+    if count:
+        result["heatmap"] = name + "-heat.png"
+        Image.fromarray(heatmap(new, heat, changed, compared)).save(
+            os.path.join(report_dir, result["heatmap"]))
+    return result
+
+
+def compare(old_dir, new_dir, report_dir, processes=None):
+    """Compare every screenshot in two capture directories, in parallel.
+
+    Returns the results from compare_one sorted with the most changed first,
+    and the names only in one directory or the other.
+    """
+    with open(os.path.join(old_dir, INDEX)) as f_in:
+        old_index = json.load(f_in)
+    with open(os.path.join(new_dir, INDEX)) as f_in:
+        new_index = json.load(f_in)
+    os.makedirs(report_dir, exist_ok=True)
+    jobs = [(name, old_index[name], new_index[name], old_dir, new_dir, report_dir)
+            for name in sorted(set(old_index) & set(new_index))]
+    with multiprocessing.Pool(processes) as pool:
+        results = list(pool.imap_unordered(compare_one, jobs))
+    results.sort(key=lambda result: (-result["fraction"], result["name"]))
+    missing = sorted(set(old_index) ^ set(new_index))
+    return results, missing
+
+
+def write_report(results, missing, old_dir, new_dir, report_dir):
+    """Write index.html in the report directory."""
+    # pylint: disable=import-outside-toplevel
+    import html
+    rel = lambda path: html.escape(os.path.relpath(path, report_dir))
+    rows = []
+    for result in results:
+        if not result["changed"]:
+            continue
+        image = result["name"] + ".png"
+        rows.append(
+            "<tr><td>%s</td><td>%.3f%%</td><td>%d of %d</td>"
+            "<td><a href=\"%s\">before</a></td><td><a href=\"%s\">after</a></td>"
+            "<td><a href=\"%s\"><img src=\"%s\" width=\"240\"></a></td></tr>" % (
+                html.escape(result["name"]), result["fraction"] * 100,
+                result["tiles_changed"], result["tiles"],
+                rel(os.path.join(old_dir, image)), rel(os.path.join(new_dir, image)),
+                html.escape(result["heatmap"]), html.escape(result["heatmap"])))
+    with open(os.path.join(report_dir, "index.html"), "w") as f_out:
+        f_out.write("<!doctype html>\n<title>Visual changes</title>\n")
+        f_out.write("<p>%d of %d screenshots changed.</p>\n" % (len(rows), len(results)))
+        if missing:
+            f_out.write("<p>Only in one set: %s</p>\n" % html.escape(", ".join(missing)))
+        f_out.write("<table>\n<tr><th>screenshot</th><th>pixels changed</th>"
+                    "<th>tiles changed</th><th></th><th></th><th>heatmap</th></tr>\n")
+        f_out.write("\n".join(rows))
+        f_out.write("\n</table>\n")
+
+
+def screenshot(driver, size):
+    """Get a PNG of the whole page (size from SETTLE_JS), or the window."""
+    if hasattr(driver, "execute_cdp_cmd"):
+        result = driver.execute_cdp_cmd("Page.captureScreenshot", {
+            "format": "png", "captureBeyondViewport": True,
+            "clip": {"x": 0, "y": 0, "width": size["width"], "height": size["height"], "scale": 1}})
+        return base64.b64decode(result["data"])
+    return driver.get_screenshot_as_png()
+
+
+def capture(directory, pages=None):
+    """Screenshot each template's first page at every viewport into a directory."""
+    # pylint: disable=import-outside-toplevel
+    import io
+    import numpy as np
+    from PIL import Image
+    from .impact import template_pages
+    from .store_client import StoreClient
+
+    class VisualClient(StoreClient):
+        """Browser session for visual regression screenshots."""
+
+    pages = pages or template_pages()
+    os.makedirs(directory, exist_ok=True)
+    index = {}
+    VisualClient.set_up_site()
+    driver = VisualClient.get_driver()
+    driver.set_script_timeout(30)
+    try:
+        for key, paths in sorted(pages.items()):
+            for viewport, size in viewports().items():
+                driver.set_window_size(size["width"], size["height"])
+                driver.get(VisualClient.url + paths[0])
+                page = driver.execute_async_script(SETTLE_JS, MASK_SELECTORS)
+                data = screenshot(driver, page)
+                name = "%s--%s" % (key, viewport)
+                with open(os.path.join(directory, name + ".png"), "wb") as f_out:
+                    f_out.write(data)
+                with Image.open(io.BytesIO(data)) as img:
+                    pixels = np.asarray(img.convert("RGB"))
+                index[name] = {"file": name + ".png", "path": paths[0], "viewport": viewport,
+                               "shape": list(pixels.shape[:2]), "masks": page["masks"],
+                               "tiles": tile_hashes(pixels)}
+                LOGGER.info("captured %s", name)
+    finally:
+        VisualClient.tear_down_site()
+    with open(os.path.join(directory, INDEX), "w") as f_out:
+        json.dump(index, f_out, indent=1, sort_keys=True)
+    return index
+
+
+def main(argv=None):
+    """Capture screenshots or compare two sets of them."""
+    parser = argparse.ArgumentParser(
+        prog="python -m tests.visual",
+        description="Screenshot templates at every viewport and compare them.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    capture_parser = subparsers.add_parser("capture", help="take screenshots")
+    capture_parser.add_argument("directory")
+    compare_parser = subparsers.add_parser("compare", help="compare two sets of screenshots")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--report", default="visual-report", help="directory for heatmaps")
+    compare_parser.add_argument("-j", "--processes", type=int, help="processes (default all cores)")
+    args = parser.parse_args(argv)
+    if not have_metrics():
+        sys.exit("screenshot comparison needs numpy and Pillow: pip install numpy pillow")
+    if args.command == "capture":
+        capture(args.directory)
+        return
+    results, missing = compare(args.old, args.new, args.report, args.processes)
+    write_report(results, missing, args.old, args.new, args.report)
+    failed = [result for result in results if result["fraction"] > MAX_CHANGED]
+    for result in results:
+        if result["changed"]:
+            print("%-50s %8.3f%% %5d of %d tiles" % (
+                result["name"], result["fraction"] * 100, result["tiles_changed"], result["tiles"]))
+    print("%d of %d screenshots changed; report in %s" % (
+        sum(1 for result in results if result["changed"]), len(results), args.report))
+    for name in missing:
+        print("only in one set: %s" % name)
+    if failed or missing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,186 @@
+"""
+Watch mode: rerun affected tests as theme files change, with warm browsers.
+
+This is meant to run alongside `theme watch`.  Instead of paying for browser
+startup and the storefront login on every run, the StoreClient browser
+sessions are set up once and kept alive (see StoreClient.keep_browser).  The
+theme directories are watched with inotify (or by polling file modification
+times where inotify isn't available); once changes have been quiet for a
+moment, to give themekit time to finish uploading them, the tests selected by
+the impact module are run with results streamed as each one finishes.
+
+    python -m tests --watch
+
+Any test names given on the command line are run once at startup.  Set
+SHOPIFY_TEST_DEBOUNCE to change how many seconds of quiet to wait for.
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import logging
+import unittest
+import ctypes
+import ctypes.util
+
+from . import impact
+from .planner import PlannedLoader
+from .util import TESTING_CONFIG
+
+LOGGER = logging.getLogger(__name__)
+
+# From sys/inotify.h
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_theme_file(path):
+    """Should a change to this path count?  Skips editor temp files and such."""
+    name = os.path.basename(path)
+    return not (name.startswith(".") or name.endswith(("~", ".swp", ".swx")) or
+                name.isdigit())
+
+
+class InotifyWatcher:
+    """Watch directories with Linux inotify, via ctypes."""
+
+    def __init__(self, dirs):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wds = {}
+        for dirname in dirs:
+            wd = libc.inotify_add_watch(self.fd, dirname.encode(), IN_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed", dirname)
+            self.wds[wd] = dirname
+
+    def wait(self, timeout=None):
+        """Get the set of changed paths, waiting up to timeout seconds."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as exc:
+            if exc.errno == errno.EAGAIN:
+                return set()
+            raise
+        paths = set()
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset+length].rstrip(b"\0").decode()
+            offset += length
+            if name:
+                paths.add(self.wds[wd] + "/" + name)
+        return {path for path in paths if is_theme_file(path)}
+
+    def close(self):
+        """Stop watching."""
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Watch directories by checking file modification times."""
+
+    def __init__(self, dirs, interval=0.5):
+        self.dirs = dirs
+        self.interval = interval
+        self.mtimes = self._scan()
+
+    def _scan(self):
+        mtimes = {}
+        for dirname in self.dirs:
+            for name in os.listdir(dirname):
+                path = dirname + "/" + name
+                if is_theme_file(path):
+                    mtimes[path] = os.stat(path).st_mtime
+        return mtimes
+
+    def wait(self, timeout=None):
+        """Get the set of changed paths, waiting up to timeout seconds."""
+        start = time.monotonic()
+        while True:
+            mtimes = self._scan()
+            paths = {path for path in set(mtimes) | set(self.mtimes)
+                     if mtimes.get(path) != self.mtimes.get(path)}
+            self.mtimes = mtimes
+            if paths:
+                return paths
+            if timeout is not None and time.monotonic() - start >= timeout:
+                return set()
+            time.sleep(self.interval)
+
+    def close(self):
+        """Stop watching."""
+
+
+def make_watcher(dirs):
+    """Get an inotify watcher if we can, or a polling one otherwise."""
+    try:
+        return InotifyWatcher(dirs)
+    except (OSError, AttributeError) as exc:
+        LOGGER.warning("inotify not available (%s); polling instead", exc)
+        return PollingWatcher(dirs)
+
+
+def settled_changes(watcher, debounce):
+    """Yield sets of changed paths once each burst of changes goes quiet."""
+    while True:
+        changed = watcher.wait()
+        while changed:
+            more = watcher.wait(debounce)
+            if not more:
+                break
+            changed |= more
+        if changed:
+            yield changed
+
+
+def run_tests(names, stream=sys.stderr):
+    """Run the named tests (relative to tests.test_site), streaming results."""
+    # pylint: disable=import-outside-toplevel
+    # Imported here since this is what pulls in selenium and the rest.
+    from . import test_site
+    suite = PlannedLoader().loadTestsFromNames(sorted(names), module=test_site)
+    return unittest.TextTestRunner(stream=stream, verbosity=2).run(suite)
+
+
+def main(argv):
+    """Watch the theme directories and rerun affected tests until interrupted."""
+    # pylint: disable=import-outside-toplevel
+    from .store_client import StoreClient
+    from . import test_site
+    StoreClient.keep_browser = True
+    dirs = [dirname for dirname in impact.THEME_DIRS if os.path.isdir(dirname)]
+    watcher = make_watcher(dirs)
+    try:
+        # Log in up front so even the first run after a change is warm.
+        for cls in {getattr(test_site, name) for name in impact.TEST_MODULES.values()}:
+            cls.set_up_site()
+        if argv:
+            run_tests(argv)
+        LOGGER.warning("watching %s", ", ".join(dirs))
+        for changed in settled_changes(watcher, TESTING_CONFIG["watch_debounce"]):
+            names = impact.select_tests(changed)
+            LOGGER.warning(
+                "changed: %s; running %d tests", ", ".join(sorted(changed)), len(names))
+            if names:
+                run_tests(names)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        StoreClient.quit_all()
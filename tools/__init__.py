@@ -0,0 +1,6 @@
+"""
+Build and maintenance tools for the theme.
+
+The Python tools here are run as modules from the top level of the repo, like
+`python -m tools.bundle`, alongside the shell scripts in this directory.
+"""
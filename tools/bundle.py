@@ -0,0 +1,252 @@
+"""
+Per-template CSS/JS bundling.
+
+head.liquid loads every stylesheet and script on every page.  This tool works
+out which of them each template actually needs (using the theme graph and
+asset scopes from tests.impact), concatenates and minifies each run of
+consecutive plain assets into a content-hashed bundle, and writes
+snippets/head_assets.liquid with a set of tags per template.  head.liquid
+includes that instead of its own list when the "Bundle stylesheets and
+scripts" theme setting is on.
+
+Assets rendered with Liquid (.css.liquid and .js.liquid) can't be bundled
+ahead of time, so they keep their own tags, and a bundle never spans one so
+the original order is kept.  Bundles are named by their content alone, so
+templates that end up with the same bundle share one cached file.
+
+    python -m tools.bundle            # write bundles and report savings
+    python -m tools.bundle --dry-run  # just report
+
+The outputs (assets/bundle-*, snippets/head_assets.liquid) are generated, so
+they're left out of git; tools/post-commit rebuilds them.
+"""
+
+import os
+import re
+import sys
+import glob
+import hashlib
+import argparse
+
+from tests.impact import ThemeGraph, RE_ASSET
+
+HEAD = "snippets/head.liquid"
+OUTPUT_SNIPPET = "snippets/head_assets.liquid"
+BUNDLE_PREFIX = "assets/bundle-"
+
+RE_STRING = re.compile(r"(\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*')")
+RE_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+RE_CSS_SPACE = re.compile(r"\s+")
+RE_CSS_PUNCT = re.compile(r"\s*([{};,>])\s*")
+RE_CSS_COLON = re.compile(r":\s+")
+
+
+def minify_css(text):
+    """Strip comments and needless whitespace from a stylesheet.
+
+    Quoted strings are left alone.  This only removes space that can't
+    matter (around braces, semicolons, commas, child combinators, and after
+    colons) so it's safe for the plain CSS we write by hand.
+    """
+    text = RE_CSS_COMMENT.sub("", text)
+    chunks = RE_STRING.split(text)
+    for idx in range(0, len(chunks), 2):
+        chunk = RE_CSS_SPACE.sub(" ", chunks[idx])
+        chunk = RE_CSS_PUNCT.sub(r"\1", chunk)
+        chunk = RE_CSS_COLON.sub(":", chunk)
+        chunks[idx] = chunk
+    return "".join(chunks).replace(";}", "}").strip()
+
+
+def minify_js(text):
+    """Strip whole-line comments, indentation, and blank lines from a script.
+
+    Line breaks are kept so automatic semicolon insertion still works the
+    same, and nothing inside a line is touched, so this can't change what the
+    code does.
+    """
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith("//"):
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def minify(path, text):
+    """Minify an asset's text according to its type."""
+    if path.endswith(".min.js") or path.endswith(".min.css"):
+        return text.strip()
+    if path.endswith(".css"):
+        return minify_css(text)
+    return minify_js(text)
+
+
+def asset_kind(path):
+    """Get "css" or "js" for an asset path, or None for anything else."""
+    name = path[:-len(".liquid")] if path.endswith(".liquid") else path
+    for kind in ("css", "js"):
+        if name.endswith("." + kind):
+            return kind
+    return None
+
+
+def head_entries(graph, root="."):
+    """List head.liquid's tag lines as (asset path or None, line) pairs.
+
+    Lines for stylesheets and scripts from assets/ get their path; other tags
+    (external stylesheets and scripts, the icon) get None.  Liquid-only
+    lines are skipped.
+    """
+    entries = []
+    with open(os.path.join(root, HEAD)) as f_in:
+        for line in f_in:
+            line = line.rstrip("\n")
+            if not re.search(r"<(link|script)\b", line):
+                continue
+            match = RE_ASSET.search(line)
+            path = graph.asset_path(match.group(1)) if match else None
+            if path and not asset_kind(path):
+                path = None
+            entries.append((path, line))
+    return entries
+
+
+def plan_template(graph, entries, template):
+    """Group the head entries one template needs into tags and bundles.
+
+    Returns a list of ("line", text) for tags kept as they are and ("bundle",
+    kind, [paths]) for runs of plain assets to concatenate.
+    """
+    closure = graph.closure(template)
+    groups = []
+    for path, line in entries:
+        if path is None:
+            groups.append(("line", line))
+            continue
+        if path not in closure:
+            continue
+        if path.endswith(".liquid"):
+            groups.append(("line", line))
+            continue
+        kind = asset_kind(path)
+        last = groups[-1] if groups else None
+        if last and last[0] == "bundle" and last[1] == kind:
+            last[2].append(path)
+        else:
+            groups.append(("bundle", kind, [path]))
+    return groups
+
+
+def build_bundle(kind, paths, root="."):
+    """Get the file name and text for a bundle of assets."""
+    texts = []
+    for path in paths:
+        with open(os.path.join(root, path)) as f_in:
+            texts.append(minify(path, f_in.read()))
+    # The semicolon guards against a script that doesn't end with one.
+    text = ("\n" if kind == "css" else ";\n").join(texts) + "\n"
+    digest = hashlib.sha256(text.encode()).hexdigest()[:12]
+    return "bundle-%s.min.%s" % (digest, kind), text
+
+
+def bundle_tag(kind, name):
+    """Get the HTML tag loading a bundle."""
+    if kind == "css":
+        return '  <link rel="stylesheet" href="{{ \'%s\' | asset_url }}"{{ css_defer }}>' % name
+    return '  <script src="{{ \'%s\' | asset_url }}"></script>' % name
+
+
+def template_key(template):
+    """Get the Liquid template value for a template file."""
+    return os.path.basename(template)[:-len(".liquid")]
+
+
+def build(root="."):
+    """Plan and build bundles for every template.
+
+    Returns a dictionary of bundle file name to text, the generated snippet
+    text, and a report dictionary per template with request and byte counts
+    before and after.
+    """
+    graph = ThemeGraph(root)
+    entries = head_entries(graph, root)
+    size = lambda path: os.path.getsize(os.path.join(root, path))
+    local = [path for path, _ in entries if path]
+    before = {"requests": len(entries), "bytes": sum(size(path) for path in local)}
+    bundles = {}
+    report = {}
+    out = [
+        "{%- comment -%}",
+        "Generated by tools/bundle.py from snippets/head.liquid; don't edit.",
+        "{%- endcomment -%}",
+        "{%- case template -%}"]
+    for template in graph.templates():
+        if not graph.layouts[template]:
+            # No layout, so no head (like the JSON search view)
+            continue
+        out.append("{%%- when '%s' %%}" % template_key(template))
+        after = {"requests": 0, "bytes": 0}
+        for group in plan_template(graph, entries, template):
+            after["requests"] += 1
+            if group[0] == "line":
+                out.append(group[1])
+                path = RE_ASSET.search(group[1])
+                if path:
+                    path = graph.asset_path(path.group(1))
+                    after["bytes"] += size(path) if asset_kind(path) else 0
+                continue
+            name, text = build_bundle(group[1], group[2], root)
+            bundles[name] = text
+            after["bytes"] += len(text.encode())
+            out.append(bundle_tag(group[1], name))
+        report[template_key(template)] = {"before": before, "after": after}
+    # Anything else (customer pages, gift cards...) gets the full list.
+    out.append("{%- else %}")
+    out.extend(line for _, line in entries)
+    out.append("{%- endcase %}")
+    return bundles, "\n".join(out) + "\n", report
+
+
+def write(bundles, snippet, root="."):
+    """Write bundles and the snippet, removing bundles no longer used."""
+    for path in glob.glob(os.path.join(root, BUNDLE_PREFIX + "*")):
+        if os.path.basename(path) not in bundles:
+            os.remove(path)
+    for name, text in bundles.items():
+        with open(os.path.join(root, "assets", name), "w") as f_out:
+            f_out.write(text)
+    with open(os.path.join(root, OUTPUT_SNIPPET), "w") as f_out:
+        f_out.write(snippet)
+
+
+def print_report(report, stream=sys.stdout):
+    """Print request and byte counts per template."""
+    fmt = "%-20s %8s %8s %10s %10s %7s\n"
+    stream.write(fmt % ("template", "req was", "req now", "bytes was", "bytes now", "saved"))
+    for key in sorted(report):
+        before = report[key]["before"]
+        after = report[key]["after"]
+        saved = 1 - after["bytes"] / before["bytes"] if before["bytes"] else 0
+        stream.write(fmt % (
+            key, before["requests"], after["requests"],
+            before["bytes"], after["bytes"], "%d%%" % round(saved*100)))
+
+
+def main(argv=None):
+    """Build bundles and report savings."""
+    parser = argparse.ArgumentParser(
+        prog="python -m tools.bundle",
+        description="Build per-template CSS/JS bundles for head.liquid.")
+    parser.add_argument(
+        "-n", "--dry-run", action="store_true",
+        help="report savings without writing anything")
+    args = parser.parse_args(argv)
+    bundles, snippet, report = build()
+    if not args.dry_run:
+        write(bundles, snippet)
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
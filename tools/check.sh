@@ -41,10 +41,20 @@ function check_liquid_all {
 	fi
 }
 
+# Browser tests affected by staged changes, as selected by tests/impact.py.
+# Nothing runs if the staged changes don't touch the theme or test harness.
+function check_tests_impacted {
+	tests=$(python -m tests.impact --cached) || return $?
+	if [[ $tests != "" ]]; then
+		python -m tests $tests
+	fi
+}
+
 function check_main {
 	check_javascript_all || retval=$?
 	check_css_all || retval=$?
 	#check_liquid_all || retval=$?
+	check_tests_impacted || retval=$?
 	return $retval
 }
 
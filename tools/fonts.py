@@ -0,0 +1,286 @@
+"""
+Self-hosted, subsetted copy of the theme's web font.
+
+head.liquid normally gets Nanum Myeongjo from Google Fonts, which costs a
+render-blocking stylesheet from one origin before the font files from
+another.  The family covers Korean, so it's big, and Google slices it by
+unicode-range so a page only downloads the slices it uses.  That still
+takes many requests for text that's almost all Latin.
+
+This tool collects the characters the store can actually show:
+ * the text in the theme's layouts, templates, snippets, and the strings in
+   its scripts,
+ * the strings in config/settings_data.json, if there is one,
+ * optionally a catalog sample (--sample files, or --catalog for a store's
+   public /products.json),
+ * and printable ASCII plus common punctuation, always.
+It subsets the font to just those characters as WOFF2 and writes
+snippets/head_fonts.liquid with a preload and an @font-face rule using
+font-display: swap.  With the "Self-host fonts" theme setting on,
+head.liquid includes that instead of the Google Fonts stylesheet.
+
+    python -m tools.fonts build [--sample FILE...] [--catalog https://STORE]
+    python -m tools.fonts verify --save before.json
+    python -m tools.fonts verify --baseline before.json
+
+Subsetting needs fontTools and brotli (pip install fonttools brotli).  build
+reports the subset's size against the full font and against the Google Fonts
+slices the same characters would need.  verify times first contentful paint
+(the first text painted) per template like tests/critical.py; run it with the
+setting off and --save, then upload, turn the setting on, and run it with
+--baseline.  The outputs are generated from store content like the bundles,
+so they're left out of git.
+"""
+
+import io
+import os
+import re
+import sys
+import glob
+import html
+import json
+import argparse
+
+from tests import cssrules
+
+FAMILY = "Nanum Myeongjo"
+GOOGLE_CSS = "https://fonts.googleapis.com/css?family=" + FAMILY.replace(" ", "+")
+OUTPUT_FONT = "assets/font-nanum-myeongjo.woff2"
+OUTPUT_SNIPPET = "snippets/head_fonts.liquid"
+
+# Google Fonts picks the font format by user agent: WOFF2 slices with
+# unicode-range for a current browser, one whole TrueType file otherwise.
+BROWSER_UA = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0.0.0 Safari/537.36")
+PLAIN_UA = "Mozilla/5.0"
+
+# Always kept: printable ASCII and punctuation that turns up in pasted text
+BASE_CHARS = ("".join(chr(code) for code in range(0x20, 0x7f))
+              + "\xa0–—‘’“”…•·×©®™€£°")
+
+RE_LIQUID_COMMENT = re.compile(
+    r"{%-?\s*comment\s*-?%}.*?{%-?\s*endcomment\s*-?%}", re.DOTALL)
+RE_LIQUID = re.compile(r"{%.*?%}|{{.*?}}", re.DOTALL)
+RE_HTML_TAG = re.compile(r"<[^>]*>")
+RE_JS_STRING = re.compile(r"\"((?:\\.|[^\"\\\n])*)\"|'((?:\\.|[^'\\\n])*)'")
+RE_URL = re.compile(r"url\(\s*['\"]?([^'\")]+)")
+RE_RANGE = re.compile(r"U\+([0-9A-Fa-f?]+)(?:-([0-9A-Fa-f]+))?")
+
+
+def markup_text(text):
+    """Get the visible text from Liquid/HTML markup."""
+    text = RE_LIQUID_COMMENT.sub(" ", text)
+    text = RE_LIQUID.sub(" ", text)
+    return html.unescape(RE_HTML_TAG.sub(" ", text))
+
+
+def theme_chars(root="."):
+    """Get the characters in the theme's markup and script strings."""
+    chars = set()
+    for pattern in ("layout/*.liquid", "templates/*.liquid", "snippets/*.liquid",
+                    "sections/*.liquid"):
+        for path in glob.glob(os.path.join(root, pattern)):
+            with open(path) as f_in:
+                chars.update(markup_text(f_in.read()))
+    for path in glob.glob(os.path.join(root, "assets", "js-*.js*")):
+        if ".min." in path:
+            continue
+        with open(path) as f_in:
+            for match in RE_JS_STRING.finditer(f_in.read()):
+                chars.update(match.group(1) or match.group(2) or "")
+    return chars
+
+
+def json_strings(data):
+    """Yield every string in a JSON value."""
+    if isinstance(data, str):
+        yield data
+    elif isinstance(data, dict):
+        for value in data.values():
+            yield from json_strings(value)
+    elif isinstance(data, list):
+        for value in data:
+            yield from json_strings(value)
+
+
+def settings_chars(root="."):
+    """Get the characters in config/settings_data.json's strings, if present."""
+    path = os.path.join(root, "config", "settings_data.json")
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f_in:
+        return set("".join(markup_text(text) for text in json_strings(json.load(f_in))))
+
+
+def fetch_bytes(url, user_agent=PLAIN_UA):
+    """Get the raw bytes at a URL."""
+    # pylint: disable=import-outside-toplevel
+    import urllib.request
+    if url.startswith("//"):
+        url = "https:" + url
+    request = urllib.request.Request(url, headers={"User-Agent": user_agent})
+    with urllib.request.urlopen(request) as response:
+        return response.read()
+
+
+def catalog_chars(store, limit=250):
+    """Get the characters in a store's product listings from /products.json.
+
+    This is the public storefront endpoint, so it won't work on a
+    password-protected store; use --sample with an exported catalog instead.
+    """
+    chars = set()
+    page = 1
+    while True:
+        url = "%s/products.json?limit=%d&page=%d" % (store.rstrip("/"), limit, page)
+        products = json.loads(fetch_bytes(url, BROWSER_UA))["products"]
+        if not products:
+            return chars
+        for product in products:
+            chars.update("".join(markup_text(text) for text in json_strings(product)))
+        page += 1
+
+
+def collect(root=".", samples=(), catalog=None):
+    """Get the sorted string of characters the font needs to cover."""
+    chars = set(BASE_CHARS) | theme_chars(root) | settings_chars(root)
+    for path in samples:
+        with open(path) as f_in:
+            chars.update(f_in.read())
+    if catalog:
+        chars |= catalog_chars(catalog)
+    return "".join(sorted(char for char in chars if char.isprintable()))
+
+
+def unicode_ranges(text):
+    """Parse a unicode-range value into a list of (first, last) code points."""
+    ranges = []
+    for match in RE_RANGE.finditer(text):
+        start, end = match.group(1), match.group(2)
+        if "?" in start:
+            ranges.append((int(start.replace("?", "0"), 16), int(start.replace("?", "F"), 16)))
+        else:
+            ranges.append((int(start, 16), int(end or start, 16)))
+    return ranges
+
+
+def font_faces(css):
+    """List (font URL, unicode ranges or None) for each @font-face in css."""
+    faces = []
+    for rule in cssrules.parse(css):
+        if rule.prelude != "@font-face":
+            continue
+        url = RE_URL.search(rule.body)
+        match = re.search(r"unicode-range\s*:\s*([^;]+)", rule.body)
+        faces.append((url.group(1), unicode_ranges(match.group(1)) if match else None))
+    return faces
+
+
+def needed_faces(faces, chars):
+    """Get the font URLs a browser would download to show chars."""
+    codes = [ord(char) for char in chars]
+    return [url for url, ranges in faces
+            if ranges is None or any(first <= code <= last
+                                     for code in codes for first, last in ranges)]
+
+
+def subset(font_data, chars):
+    """Subset font file bytes to chars, giving WOFF2 bytes."""
+    # pylint: disable=import-outside-toplevel
+    try:
+        from fontTools import subset as ft_subset
+    except ImportError:
+        sys.exit("subsetting needs fontTools and brotli: pip install fonttools brotli")
+    options = ft_subset.Options()
+    options.flavor = "woff2"
+    font = ft_subset.load_font(io.BytesIO(font_data), options)
+    subsetter = ft_subset.Subsetter(options)
+    subsetter.populate(text=chars)
+    subsetter.subset(font)
+    out = io.BytesIO()
+    ft_subset.save_font(font, out, options)
+    return out.getvalue()
+
+
+def snippet_text(name=os.path.basename(OUTPUT_FONT)):
+    """Get the text for snippets/head_fonts.liquid."""
+    url = "{{ '%s' | asset_url }}" % name
+    return "\n".join([
+        "{%- comment -%}",
+        "Generated by tools/fonts.py; don't edit.",
+        "{%- endcomment %}",
+        '  <link rel="preload" href="%s" as="font" type="font/woff2" crossorigin>' % url,
+        "  <style>@font-face{font-family:\"%s\";font-style:normal;font-weight:400;"
+        "font-display:swap;src:url(%s) format(\"woff2\")}</style>" % (FAMILY, url),
+        ""])
+
+
+def build(root=".", samples=(), catalog=None, font=None):
+    """Subset the font, write it and the snippet, and report the savings."""
+    chars = collect(root, samples, catalog)
+    if font:
+        with open(font, "rb") as f_in:
+            font_data = f_in.read()
+    else:
+        css = fetch_bytes(GOOGLE_CSS, PLAIN_UA).decode()
+        font_data = fetch_bytes(font_faces(css)[0][0])
+    woff2 = subset(font_data, chars)
+    slices = needed_faces(font_faces(fetch_bytes(GOOGLE_CSS, BROWSER_UA).decode()), chars)
+    google = sum(len(fetch_bytes(url, BROWSER_UA)) for url in slices)
+    with open(os.path.join(root, OUTPUT_FONT), "wb") as f_out:
+        f_out.write(woff2)
+    with open(os.path.join(root, OUTPUT_SNIPPET), "w") as f_out:
+        f_out.write(snippet_text())
+    print("%d characters" % len(chars))
+    print("%-32s %10s %9s" % ("font", "bytes", "requests"))
+    print("%-32s %10d %9d" % ("full font", len(font_data), 1))
+    print("%-32s %10d %9d" % ("Google Fonts slices needed", google, len(slices) + 1))
+    print("%-32s %10d %9d" % ("subset", len(woff2), 1))
+    print("saved %d bytes against Google Fonts" % (google - len(woff2)))
+
+
+def verify(save=None, baseline=None, repeat=3):
+    """Measure first contentful paint per template and compare with a baseline.
+
+    Returns False if a baseline was given and paint times didn't improve.
+    """
+    # pylint: disable=import-outside-toplevel
+    from tests.critical import (measure, compare, template_pages, VIEWPORTS)
+    results = measure(template_pages(), VIEWPORTS, repeat)
+    if save:
+        with open(save, "w") as f_out:
+            json.dump(results, f_out, indent=2, sort_keys=True)
+    if baseline:
+        with open(baseline) as f_in:
+            if not compare(results, json.load(f_in)):
+                print("first contentful paint did not improve")
+                return False
+    return True
+
+
+def main(argv=None):
+    """Build the subsetted font or verify its effect."""
+    parser = argparse.ArgumentParser(
+        prog="python -m tools.fonts",
+        description="Self-host a subset of the theme's web font.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser(
+        "build", help="write %s and %s" % (OUTPUT_FONT, OUTPUT_SNIPPET))
+    build_parser.add_argument(
+        "--sample", nargs="+", default=[], help="text files of catalog content to cover")
+    build_parser.add_argument("--catalog", help="store URL to read /products.json from")
+    build_parser.add_argument("--font", help="font file to subset (default from Google Fonts)")
+    verify_parser = subparsers.add_parser("verify", help="measure first text paint times")
+    verify_parser.add_argument("--save", help="save paint times to this JSON file")
+    verify_parser.add_argument("--baseline", help="compare paint times against this JSON file")
+    verify_parser.add_argument("-n", "--repeat", type=int, default=3, help="loads per page")
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        build(samples=args.sample, catalog=args.catalog, font=args.font)
+    elif not verify(args.save, args.baseline, args.repeat):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,344 @@
+"""
+Image format and quality benchmark for product images.
+
+product_img.liquid asks Shopify's CDN for every srcset width in the format
+from the theme settings.  This measures what each format costs and how close
+it stays to the original, for a sample of the store's product images:
+
+    python -m tools.images record https://STORE images/ -n 10
+    python -m tools.images report images/
+
+record fetches the original of each product's first image plus every srcset
+width (read from product_img.liquid) in each of FORMATS, and saves them under
+the given directory with a manifest.json.  report works only from that
+directory, so it can be rerun offline or against a store recorded earlier.
+It lists bytes, SSIM (on luma, 7x7 windows) and PSNR (on RGB) per format and
+width against the original scaled to the same size, recommends a format,
+and estimates the product image weight of each template at the test
+viewports.
+
+The CDN has no quality setting, so "quality" here is the measured SSIM and
+PSNR each format gives at each width rather than an encoder setting.  The
+recommendation is the format with the fewest bytes whose mean SSIM stays at
+or above --min-ssim at every width.
+
+The metrics need numpy and Pillow (pip install numpy pillow).  Without them,
+report lists bytes only.
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+from urllib.parse import (urlsplit, urlunsplit, parse_qsl, urlencode)
+
+from tools.fonts import fetch_bytes
+
+PRODUCT_IMG = "snippets/product_img.liquid"
+MANIFEST = "manifest.json"
+FORMATS = ("jpg", "pjpg", "png", "webp")
+MIN_SSIM = 0.97
+
+# Widths of the test viewports (WINDOWSIZES in tests/store_site.py), at a
+# device pixel ratio of 1
+VIEWPORT_WIDTHS = {"small": 320, "medium": 1024, "large": 3840}
+
+# Product images on each template for the page weight estimate, by the
+# product_context that picks their sizes attribute in product_img.liquid.
+# The collection and search counts are the products per page (--per-page).
+TEMPLATE_IMAGES = {
+    "collection": (None, "collection"),
+    "search": (None, "collection"),
+    "product": (1, None),
+    "cart": (2, "cart"),
+    }
+
+RE_SRCSET_WIDTH = re.compile(r"img_url:\s*(\d+)")
+RE_SIZES_DEFAULT = re.compile(r"assign img_sizes = \"([^\"]+)\"")
+RE_SIZES_CONTEXT = re.compile(
+    r"product_context == \"(\w+)\"\s*-?%}\s*{%-?\s*assign img_sizes = \"([^\"]+)\"")
+RE_MIN_WIDTH = re.compile(r"^\(min-width:\s*(\d+)px\)\s*(.+)$")
+
+
+def srcset_widths(root="."):
+    """Get the srcset widths product_img.liquid requests, in order."""
+    with open(os.path.join(root, PRODUCT_IMG)) as f_in:
+        text = f_in.read()
+    widths = []
+    for width in RE_SRCSET_WIDTH.findall(text):
+        if int(width) not in widths:
+            widths.append(int(width))
+    return widths
+
+
+def sizes_by_context(root="."):
+    """Get product_img.liquid's sizes attribute by product_context.
+
+    The default (no context) is under None.
+    """
+    with open(os.path.join(root, PRODUCT_IMG)) as f_in:
+        text = f_in.read()
+    sizes = {None: RE_SIZES_DEFAULT.search(text).group(1)}
+    sizes.update(RE_SIZES_CONTEXT.findall(text))
+    return sizes
+
+
+def slot_width(sizes, viewport):
+    """Get the px width a sizes attribute gives at a viewport width.
+
+    Only (min-width: Npx) conditions and vw lengths are understood, which is
+    all product_img.liquid uses.
+    """
+    for entry in sizes.split(","):
+        entry = entry.strip()
+        match = RE_MIN_WIDTH.match(entry)
+        if match:
+            if viewport < int(match.group(1)):
+                continue
+            entry = match.group(2)
+        return viewport * float(entry.rstrip("vw")) / 100
+    return viewport
+
+
+def pick_width(widths, slot):
+    """Get the srcset width a browser picks for a slot at 1x: the smallest that fits."""
+    for width in sorted(widths):
+        if width >= slot:
+            return width
+    return max(widths)
+
+
+def variant_url(src, width=None, fmt=None):
+    """Get the CDN URL for an image at a width and format."""
+    parts = urlsplit(src if not src.startswith("//") else "https:" + src)
+    query = [(key, value) for key, value in parse_qsl(parts.query)
+             if key not in ("width", "format")]
+    if width:
+        query.append(("width", str(width)))
+    if fmt:
+        query.append(("format", fmt))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def record(store, outdir, count=10, root="."):
+    """Fetch a sample of product images in every format and width into outdir."""
+    widths = srcset_widths(root)
+    products = json.loads(fetch_bytes(
+        "%s/products.json?limit=%d" % (store.rstrip("/"), count)))["products"]
+    manifest = {"widths": widths, "formats": list(FORMATS), "images": []}
+    os.makedirs(outdir, exist_ok=True)
+    for product in products:
+        if not product["images"]:
+            continue
+        src = product["images"][0]["src"]
+        name = product["handle"]
+        entry = {"name": name, "src": src, "original": name + "/original", "variants": {}}
+        os.makedirs(os.path.join(outdir, name), exist_ok=True)
+        saves = [(entry["original"], variant_url(src))]
+        for fmt in FORMATS:
+            for width in widths:
+                path = "%s/%s-%d" % (name, fmt, width)
+                entry["variants"].setdefault(fmt, {})[str(width)] = path
+                saves.append((path, variant_url(src, width, fmt)))
+        for path, url in saves:
+            print("fetching %s" % url, file=sys.stderr)
+            with open(os.path.join(outdir, path), "wb") as f_out:
+                f_out.write(fetch_bytes(url))
+        manifest["images"].append(entry)
+    with open(os.path.join(outdir, MANIFEST), "w") as f_out:
+        json.dump(manifest, f_out, indent=2)
+    return manifest
+
+
+def luma(pixels):
+    """Get the luma plane of an RGB float array."""
+    return pixels @ [0.299, 0.587, 0.114]
+
+
+def box_mean(plane, size):
+    """Mean over each size x size window fully inside a 2D array."""
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    total = np.pad(plane, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+    return (total[size:, size:] - total[:-size, size:]
+            - total[size:, :-size] + total[:-size, :-size]) / (size * size)
+
+
+def ssim(first, second, size=7):
+    """Mean structural similarity of two RGB float arrays, on luma."""
+    # pylint: disable=invalid-name
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    x, y = luma(first), luma(second)
+    mu_x, mu_y = box_mean(x, size), box_mean(y, size)
+    var_x = box_mean(x * x, size) - mu_x * mu_x
+    var_y = box_mean(y * y, size) - mu_y * mu_y
+    cov = box_mean(x * y, size) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / (
+        (mu_x * mu_x + mu_y * mu_y + c1) * (var_x + var_y + c2))
+    return float(ssim_map.mean())
+
+
+def psnr(first, second):
+    """Peak signal-to-noise ratio in dB of two RGB float arrays."""
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    mse = float(np.mean((first - second) ** 2))
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def decode(data, size=None):
+    """Decode image bytes to an RGB float array, optionally resized to (w, h)."""
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    from PIL import Image
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    if size and img.size != size:
+        img = img.resize(size, Image.LANCZOS)
+    return np.asarray(img, dtype=np.float64)
+
+
+def have_metrics():
+    """Get whether numpy and Pillow are there for SSIM and PSNR."""
+    # pylint: disable=import-outside-toplevel,unused-import
+    try:
+        import numpy
+        import PIL
+    except ImportError:
+        return False
+    return True
+
+
+def measure(indir, metrics=True):
+    """Measure every recorded variant.
+
+    Returns a list of dictionaries with image, format, width, bytes, and
+    (with metrics) ssim and psnr.
+    """
+    with open(os.path.join(indir, MANIFEST)) as f_in:
+        manifest = json.load(f_in)
+    def read(path):
+        with open(os.path.join(indir, path), "rb") as f_in:
+            return f_in.read()
+    rows = []
+    for entry in manifest["images"]:
+        original = read(entry["original"]) if metrics else None
+        for fmt, paths in entry["variants"].items():
+            for width, path in paths.items():
+                data = read(path)
+                row = {"image": entry["name"], "format": fmt, "width": int(width),
+                       "bytes": len(data)}
+                if metrics:
+                    variant = decode(data)
+                    reference = decode(original, (variant.shape[1], variant.shape[0]))
+                    row["ssim"] = ssim(reference, variant)
+                    row["psnr"] = psnr(reference, variant)
+                rows.append(row)
+    return rows
+
+
+def summarize(rows):
+    """Group rows by (format, width) into median bytes and mean SSIM/PSNR."""
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["format"], row["width"]), []).append(row)
+    summary = {}
+    for key, group in groups.items():
+        summary[key] = {"bytes": statistics.median(row["bytes"] for row in group)}
+        if "ssim" in group[0]:
+            summary[key]["ssim"] = statistics.mean(row["ssim"] for row in group)
+            summary[key]["psnr"] = statistics.mean(
+                min(row["psnr"], 100.0) for row in group)
+    return summary
+
+
+def recommend(summary, min_ssim=MIN_SSIM):
+    """Pick the format with the fewest total bytes good enough at every width.
+
+    Returns the format and, per width, the best format on its own.  Without
+    metrics (or if nothing is good enough) the smallest format wins.
+    """
+    formats = sorted({fmt for fmt, _ in summary})
+    widths = sorted({width for _, width in summary})
+    good = lambda fmt, width: summary[(fmt, width)].get("ssim", 1.0) >= min_ssim
+    total = lambda fmt: sum(summary[(fmt, width)]["bytes"] for width in widths)
+    candidates = [fmt for fmt in formats if all(good(fmt, width) for width in widths)]
+    best = min(candidates or formats, key=total)
+    per_width = {}
+    for width in widths:
+        fits = [fmt for fmt in formats if good(fmt, width)] or formats
+        per_width[width] = min(fits, key=lambda fmt, width=width: summary[(fmt, width)]["bytes"])
+    return best, per_width
+
+
+def page_weights(summary, fmt, per_page=12, root="."):
+    """Estimate product image bytes per template and viewport in one format."""
+    sizes = sizes_by_context(root)
+    widths = sorted({width for _, width in summary})
+    weights = {}
+    for template, (count, context) in TEMPLATE_IMAGES.items():
+        count = per_page if count is None else count
+        for name, viewport in VIEWPORT_WIDTHS.items():
+            width = pick_width(widths, slot_width(sizes[context], viewport))
+            weights[(template, name)] = count * summary[(fmt, width)]["bytes"]
+    return weights
+
+
+def report(indir, min_ssim=MIN_SSIM, per_page=12, stream=sys.stdout):
+    """Print the measurements, recommendation, and page weight estimates."""
+    metrics = have_metrics()
+    if not metrics:
+        stream.write("numpy and Pillow not available; reporting bytes only\n")
+    summary = summarize(measure(indir, metrics))
+    stream.write("%-6s %6s %12s %8s %9s\n" % ("format", "width", "median (B)", "SSIM", "PSNR (dB)"))
+    for (fmt, width), stats in sorted(summary.items()):
+        stream.write("%-6s %6d %12.0f %8s %9s\n" % (
+            fmt, width, stats["bytes"],
+            "%.4f" % stats["ssim"] if "ssim" in stats else "-",
+            "%.1f" % stats["psnr"] if "psnr" in stats else "-"))
+    best, per_width = recommend(summary, min_ssim)
+    stream.write("\nrecommended product image format: %s\n" % best)
+    for width, fmt in sorted(per_width.items()):
+        stats = summary[(fmt, width)]
+        stream.write("  %5dw: best alone is %s (%.0f B%s)\n" % (
+            width, fmt, stats["bytes"],
+            ", SSIM %.4f" % stats["ssim"] if "ssim" in stats else ""))
+    formats = sorted({fmt for fmt, _ in summary})
+    weights = {fmt: page_weights(summary, fmt, per_page) for fmt in formats}
+    stream.write("\nestimated product image bytes per page\n")
+    stream.write("%-12s %-8s" % ("template", "viewport")
+                 + "".join(" %10s" % fmt for fmt in formats) + "\n")
+    for template in TEMPLATE_IMAGES:
+        for name in VIEWPORT_WIDTHS:
+            stream.write("%-12s %-8s" % (template, name) + "".join(
+                " %10.0f" % weights[fmt][(template, name)] for fmt in formats) + "\n")
+
+
+def main(argv=None):
+    """Record product images or report on recorded ones."""
+    parser = argparse.ArgumentParser(
+        prog="python -m tools.images",
+        description="Compare product image formats by size and quality.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser("record", help="fetch sample images from a store")
+    record_parser.add_argument("store", help="store URL, like https://example.myshopify.com")
+    record_parser.add_argument("outdir", help="directory to save images to")
+    record_parser.add_argument("-n", "--count", type=int, default=10, help="products to sample")
+    report_parser = subparsers.add_parser("report", help="report on recorded images")
+    report_parser.add_argument("indir", help="directory given to record")
+    report_parser.add_argument(
+        "--min-ssim", type=float, default=MIN_SSIM, help="lowest acceptable mean SSIM")
+    report_parser.add_argument(
+        "--per-page", type=int, default=12, help="products per collection/search page")
+    args = parser.parse_args(argv)
+    if args.command == "record":
+        record(args.store, args.outdir, args.count)
+    else:
+        report(args.indir, args.min_ssim, args.per_page)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])